@@ -1,62 +1,23 @@
 import abc
-import inspect
-import importlib
 from collections import defaultdict
-import inflection
-import os
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import pathlib
-import typing
 
+from acrpg.codegen.blobs import fingerprint
+from acrpg.codegen.ladder import fit_ladder
+from acrpg.codegen.output import OutputWriter
+from acrpg.codegen.schema import Schema, Wrapped
 from acrpg.model.base import _BaseModel
-from acrpg.model.data import DataRef, BaseData, GameData
-from acrpg.model.models import DataModel
-
-
-class Wrapped(object):
-    def __init__(self, cls, cgen: 'CodeGenBase'):
-        self._cls = cls
-        self._entity_name = cgen.get_entity_name(cls)
-        self._entity_name_plural = inflection.pluralize(self._entity_name)
-        self._entity_name_us = inflection.underscore(self._entity_name)
-        self._var_name = cgen.get_class_name_us(cls)
-        self._var_name_camel = inflection.camelize(self._var_name)
-        self._var_name_camel_plural = inflection.pluralize(self._var_name_camel)
-        self._var_name_plural = inflection.pluralize(self._var_name)
-        self._data = None
-        if self._cls.is_erc721():
-            self._data = Wrapped(cgen.get_data_type_for_model(cls), cgen)
+from acrpg.model.data import BaseData
 
-    @property
-    def data(self):
-        return self._data
-
-    @property
-    def entity_name(self):
-        return self._entity_name
 
-    @property
-    def entity_name_plural(self):
-        return self._entity_name_plural
+_worker_cgen = None
 
-    @property
-    def entity_name_us(self):
-        return self._entity_name_us
 
-    @property
-    def var_name(self):
-        return self._var_name
-
-    @property
-    def var_name_camel(self):
-        return self._var_name_camel
-
-    @property
-    def var_name_camel_plural(self):
-        return self._var_name_camel_plural
-
-    @property
-    def var_name_plural(self):
-        return self._var_name_plural
+def _emit_worker(task):
+    cls, mod = task
+    return _worker_cgen.collect_outputs(_worker_cgen.emit_code, cls, mod)
 
 
 class CodeGenBase(object):
@@ -72,128 +33,178 @@ class CodeGenBase(object):
         self._namespace = namespace
         self._out_dir = out_dir
         self._game_data = game_data
-        self._models = {}
-        for _mod in self._modules:
-            self._models[_mod] = [
-                obj for (name, obj) in
-                inspect.getmembers(importlib.import_module(_mod))
-                if inspect.isclass(obj) and issubclass(obj, _BaseModel) and obj.__module__ == _mod and obj is not _BaseModel
-            ]
-            #print(self._models)
+        self._schema = kwargs.get('schema') or Schema(self._modules)
+        self._models = self._schema.models
         #
         self._data_classes = []
         self._erc721_classes = []
         self._poly_structs = defaultdict(list)
         self._poly_bases = dict()
+        self._emit_tasks = []
+        self._ladders = {}
+        #
+        self._ladder_formulas = kwargs.get('ladder_formulas', True)
+        self._dedup_blobs = kwargs.get('dedup_blobs', True)
+        self._jobs = kwargs.get('jobs') or 1
+        self._collected = None
+        self._output = OutputWriter([out_dir])
 
     @property
     def namespace(self):
         return self._namespace
 
-    def generate(self):
-        for mod, objs in self._models.items():
-            for obj in objs:
-                if obj._abstract:
-                    continue
-                if issubclass(obj, GameData):
-                    continue
-                if obj._nft:
-                    self._erc721_classes.append(Wrapped(obj, self))
-                elif obj._is_ladder:
-                    self._data_classes.append(Wrapped(obj, self))
-                elif issubclass(obj, BaseData):
-                    self._data_classes.append(Wrapped(obj, self))
-                elif issubclass(obj, _BaseModel):
-                    self.process_poly_cls(obj)
-                #
-                self.emit_code(obj, mod)
+    @property
+    def schema(self):
+        return self._schema
+
+    def set_game_data(self, game_data):
+        self._game_data = game_data
+
+    def wrap(self, cls):
+        return self._schema.wrap(cls)
+
+    def analyze(self):
+        analysis = self._schema.analysis
+        self._data_classes = analysis.data_classes
+        self._erc721_classes = analysis.erc721_classes
+        self._poly_structs = analysis.poly_structs
+        self._poly_bases = analysis.poly_bases
+        self._emit_tasks = analysis.emit_tasks
+        self.analyze_ladders()
+
+    def analyze_ladders(self):
+        self._ladders = {}
+        for wrp_cls in self._data_classes:
+            if wrp_cls._cls._is_ladder:
+                for data_inst in BaseData.instances(wrp_cls._cls):
+                    self.get_ladder_info(data_inst)
+
+    def get_ladder_info(self, data_inst):
+        # formula and fingerprints, fitted once per instance; the entry holds the instance so its id() is not reused
+        info = self._ladders.get(id(data_inst))
+        if info is None:
+            cls = type(data_inst)
+            exp_ladder = self.is_exp_ladder(cls)
+            exps = [level.experience for level in data_inst.levels] if exp_ladder else None
+            info = self._ladders[id(data_inst)] = (
+                data_inst,
+                fit_ladder(exps) if exp_ladder and self._ladder_formulas else None,
+                fingerprint([level.dict() for level in data_inst.levels]),
+                fingerprint(exps) if exp_ladder else None)
+        return info
+
+    def generate(self, classes=None):
+        self.analyze()
+        self.emit(classes)
+        owned = [pattern for cls in classes or () for pattern in self.get_owned_outputs(cls)] + self.get_run_outputs()
+        return self._output.finish(prune=classes is None, owned=owned)
+
+    def emit(self, classes=None):
+        tasks = self._emit_tasks
+        if classes is not None:
+            tasks = [(cls, mod) for cls, mod in tasks if cls in classes]
+        for outputs in self.run_emit_tasks(tasks):
+            for p, s, statements in outputs:
+                self.write_file(p, s, statements=statements)
+
+    def run_emit_tasks(self, tasks):
+        # workers inherit the loaded data registries, so only fork is usable
+        if self._jobs <= 1 or len(tasks) <= 1 or \
+                'fork' not in multiprocessing.get_all_start_methods():
+            return [self.collect_outputs(self.emit_code, cls, mod) for cls, mod in tasks]
+        global _worker_cgen
+        _worker_cgen = self
+        try:
+            chunksize = max(1, len(tasks) // (self._jobs * 4))
+            with ProcessPoolExecutor(max_workers=self._jobs,
+                                     mp_context=multiprocessing.get_context('fork')) as executor:
+                return list(executor.map(_emit_worker, tasks, chunksize=chunksize))
+        finally:
+            _worker_cgen = None
+
+    def collect_outputs(self, fn, *args):
+        self._collected = []
+        try:
+            fn(*args)
+            return self._collected
+        finally:
+            self._collected = None
 
     @abc.abstractmethod
     def emit_code(self, cls, mod):
         return
 
+    def get_owned_outputs(self, cls):
+        # path patterns whose files emit_code(cls) rewrites in full, so leftovers are stale
+        return []
+
+    def get_run_outputs(self):
+        # files emit() decides on every run, partial or not, and skips when they would be empty
+        return []
+
     def get_entity_name(self, cls):
-        cls_name_us = inflection.underscore(cls.__name__).split('_')
-        #assert cls_name_us[-1] in ['data', 'model', 'base']
-        entity_name = inflection.camelize('_'.join(cls_name_us[:-1]))
-        return entity_name
+        return self._schema.get_entity_name(cls)
 
     def get_class_name_us(self, cls):
-        cls_name_us_ = inflection.underscore(cls.__name__).split('_')
-        #assert cls_name_us_[-1] in ['data', 'model', 'base']
-        return '_'.join(cls_name_us_)
+        return self._schema.get_class_name_us(cls)
 
     def get_model_data_deps(self, cls):
-        deps = set()
-        for fname, fdef in cls.__fields__.items():
-            ftype = fdef.outer_type_
-            t_origin = typing.get_origin(ftype)
-            if t_origin == DataRef:
-                deps.add(Wrapped(typing.get_args(ftype)[0], self))
-        return deps
+        return self._schema.get_model_data_deps(cls)
 
     def get_all_model_deps(self, cls):
-        deps = set()
-        t_origin = typing.get_origin(cls)
-        if t_origin:
-            if t_origin is list:
-                inner_type = typing.get_args(cls)[0]
-                inner_deps = self.get_all_model_deps(inner_type)
-                deps = deps.union(inner_deps)
-        elif issubclass(cls, DataModel):
-            deps.add(Wrapped(cls, self))
-            for fname, fdef in cls.__fields__.items():
-                ftype = fdef.outer_type_
-                deps = deps.union(self.get_all_model_deps(ftype))
-        #
-        return deps
+        return self._schema.get_all_model_deps(cls)
 
     def get_all_deps(self, cls):
-        deps = set()
-        t_origin = typing.get_origin(cls)
-        if t_origin:
-            if t_origin == DataRef:
-                pass
-            elif t_origin is list:
-                inner_type = typing.get_args(cls)[0]
-                inner_deps = self.get_all_deps(inner_type)
-                deps = deps.union(inner_deps)
-        elif issubclass(cls, _BaseModel):
-            deps.add(cls)
-            for fname, fdef in cls.__fields__.items():
-                ftype = fdef.outer_type_
-                deps = deps.union(self.get_all_deps(ftype))
-        #
-        return deps
+        return self._schema.get_all_deps(cls)
 
     def deref_data_ref(self, ftype):
-        t_origin = typing.get_origin(ftype)
-        assert (t_origin == DataRef)
-        return typing.get_args(ftype)[0]
+        return self._schema.deref_data_ref(ftype)
 
     def get_ladder_type_for_model(self, cls):
-        if isinstance(cls, Wrapped):
-            cls = cls._cls
-        assert 'ladder' in cls.__fields__
-        data_ftype = cls.__fields__['ladder'].outer_type_
-        return self.deref_data_ref(data_ftype)
+        return self._schema.get_ladder_type_for_model(cls)
 
     def get_data_type_for_model(self, cls):
-        if isinstance(cls, Wrapped):
-            cls = cls._cls
-        assert 'data' in cls.__fields__
-        data_ftype = cls.__fields__['data'].outer_type_
-        return self.deref_data_ref(data_ftype)
-
-    def process_poly_cls(self, cls):
-        for p_cls in cls.__mro__:
-            if not issubclass(p_cls, _BaseModel):
-                break
-            if p_cls._struct and p_cls != cls:
-                self._poly_structs[p_cls].append(cls)
-                self._poly_bases[cls] = p_cls
-
-    def write_file(self, p: pathlib.Path, s: str):
-        os.makedirs(str(p.parents[0]), exist_ok=True)
-        with open(str(p), 'w') as f:
-            print(s, file=f)
+        return self._schema.get_data_type_for_model(cls)
+
+    def get_ladder_level_type(self, cls):
+        return self._schema.get_ladder_level_type(cls)
+
+    def validate_ladder(self, cls):
+        # generated level lookups binary-search the thresholds
+        for data_inst in BaseData.instances(cls):
+            exps = [level.experience for level in data_inst.levels]
+            assert exps, f"{cls.__name__} {data_inst.id}: ladder has no levels"
+            assert all(a <= b for a, b in zip(exps, exps[1:])), \
+                f"{cls.__name__} {data_inst.id}: level experience must be non-decreasing"
+
+    def is_exp_ladder(self, cls):
+        return cls._is_ladder and list(self.get_ladder_level_type(cls).__fields__) == ['experience']
+
+    def get_ladder_formula(self, cls, data_inst):
+        # only single-valued levels can be generated from a formula
+        return self.get_ladder_info(data_inst)[1]
+
+    def get_ladder_fingerprint(self, data_inst):
+        return self.get_ladder_info(data_inst)[2]
+
+    def get_ladder_table(self, cls, data_inst):
+        _, formula, _, exps_fingerprint = self.get_ladder_info(data_inst)
+        if not self._dedup_blobs or exps_fingerprint is None or formula is not None:
+            return None
+        return f"T_{exps_fingerprint}"
+
+    def get_data_field_value(self, cls, data_inst, fname, fvalue):
+        if fname == 'levels' and cls._is_ladder and (
+                self.get_ladder_formula(cls, data_inst) is not None or
+                self.get_ladder_table(cls, data_inst) is not None):
+            return []
+        return fvalue
+
+    def write_file(self, p: pathlib.Path, s: str, statements=None):
+        if self._collected is not None:
+            self._collected.append((p, s if isinstance(s, bytes) else str(s), statements))
+            return
+        if isinstance(s, bytes):
+            self._output.write(p, s, statements=statements)
+        else:
+            self._output.write(p, f"{s}\n", statements=statements)
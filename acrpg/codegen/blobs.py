@@ -0,0 +1,44 @@
+import hashlib
+import json
+
+
+def fingerprint(payload):
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:12]
+
+
+class BlobCollisionError(Exception):
+    pass
+
+
+class BlobTable(object):
+    def __init__(self, prefix):
+        self._prefix = prefix
+        self._blobs = {}
+        self._refs = {}
+
+    def key(self, payload):
+        return f"{self._prefix}{fingerprint(payload)}"
+
+    def add(self, payload):
+        key = self.key(payload)
+        if key not in self._blobs:
+            self._blobs[key] = payload
+            self._refs[key] = 0
+        elif self._blobs[key] != payload:
+            # a truncated fingerprint must never alias two different lists
+            raise BlobCollisionError(f"Blob key {key} collides for {self._blobs[key]!r} and {payload!r}")
+        self._refs[key] += 1
+        return key
+
+    def refs(self, key):
+        return self._refs.get(key, 0)
+
+    def items(self):
+        return sorted(self._blobs.items())
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def __contains__(self, key):
+        return key in self._blobs
@@ -1,27 +1,49 @@
+from collections import defaultdict
 import inflection
 from pathlib import Path
 import typing
 
-from acrpg.codegen.base import CodeGenBase, Wrapped
+from acrpg.codegen import msgpack
+from acrpg.codegen.base import CodeGenBase
+from acrpg.codegen.blobs import BlobCollisionError, BlobTable
+from acrpg.codegen.keys import KeyManifest
+from acrpg.codegen.migrations import SchemaSnapshot
+from acrpg.codegen.registry import register_backend
+from acrpg.codegen.schema import SchemaError, memoized_type
+from acrpg.codegen.writer import CodeWriter
 from acrpg.model.types import *
 from acrpg.model.base import _BaseModel
 from acrpg.model.data import DataRef, BaseData
 from acrpg.model.models import UpgradeableWithExp
 
 
+@register_backend('csharp')
 class CodeGenCSharp(CodeGenBase):
+    BLOB_MIN_ITEMS = 8
+    SQL_BATCH_SIZE = 500
 
     def __init__(self, *args, **kwargs):
         super(CodeGenCSharp, self).__init__(*args, **kwargs)
         self._server_out_dir = kwargs.get('server_out_dir')
         self._console_app_out_dir = kwargs.get('console_app_out_dir')
-
+        self._data_format = kwargs.get('data_format') or 'code'
+        self._schema_snapshot_path = kwargs.get('schema_snapshot')
+        assert self._data_format in ['code', 'binary'], f"{self._data_format} data format not supported"
+        self._init_chunk_size = kwargs.get('init_chunk_size', 1000)
+        self._list_blobs = None
+        self._msgpack_keys = None
+        self._schema_snapshot = None
+        self._game_data_members = None
+        self._output.add_root(self._server_out_dir)
+        self._output.add_root(self._console_app_out_dir)
+
+    @memoized_type
     def get_sql_type(self, fdef: type):
         #
         t_origin = typing.get_origin(fdef)
         #
         if fdef == cs_ulong:
-            return "bigint" #FIXME
+            return "bigint unsigned"
         elif fdef == cs_int:
             return "int"
         elif fdef == int:
@@ -39,6 +61,59 @@ class CodeGenCSharp(CodeGenBase):
         else:
             return fdef.__name__
 
+    def get_sql_column_type(self, fdef: type):
+        # data refs are sized by the loaded data, so they can't share the type cache
+        t_origin = typing.get_origin(fdef)
+        if t_origin is typing.Optional:
+            return self.get_sql_column_type(typing.get_args(fdef)[0])
+        elif t_origin == DataRef:
+            return self.get_sql_int_type(len(BaseData.instances(typing.get_args(fdef)[0])))
+        return self.get_sql_type(fdef)
+
+    @staticmethod
+    def get_sql_int_type(count):
+        if count <= 0x100:
+            return "tinyint unsigned"
+        elif count <= 0x10000:
+            return "smallint unsigned"
+        return "int unsigned"
+
+    def get_schema_snapshot_path(self):
+        # the snapshot is source, not output: keep it where it is committed and survives clean builds
+        if self._schema_snapshot_path is not None:
+            return Path(self._schema_snapshot_path)
+        return Path(self._server_out_dir).joinpath('Db').joinpath('Migrations').joinpath('schema.json')
+
+    def get_schema_snapshot(self):
+        if self._schema_snapshot is None:
+            self._schema_snapshot = SchemaSnapshot.load(self.get_schema_snapshot_path(), self.get_baseline_db_tables())
+        return self._schema_snapshot
+
+    def get_inventory_item_types(self):
+        # codes are stored in user_inventory, so they persist in the schema snapshot and are never reused;
+        # new item types are numbered by their _inventory_order
+        classes = [wrp_cls._cls for wrp_cls in self._data_classes if wrp_cls._cls.is_erc1155()]
+        for cls in classes:
+            if cls._inventory_order is False:
+                raise SchemaError(f"{cls.__name__} is an inventory item type without _inventory_order")
+        classes.sort(key=lambda cls: cls._inventory_order)
+        item_types = [inflection.underscore(self.get_entity_name(cls)) for cls in classes]
+        codes = self.get_schema_snapshot().codes.assign('user_inventory.Type', item_types, first=1)
+        return sorted((code, item_type) for item_type, code in codes.items())
+
+    def get_inventory_item_type_list(self):
+        # item types by code for ELT/FIELD, retired codes stay as NULL gaps
+        item_types = dict(self.get_inventory_item_types())
+        return ", ".join(f"'{item_types[code]}'" if code in item_types else "NULL"
+                         for code in range(1, max(item_types, default=0) + 1))
+
+    def convert_column(self, table, column, old_ddl, new_ddl):
+        if (table, column) == ('user_inventory', 'Type') and old_ddl.startswith('varchar') and \
+                self.get_inventory_item_types():
+            # rows written before item type codes hold the type name
+            return f"UPDATE `user_inventory` SET `Type` = FIELD(`Type`, {self.get_inventory_item_type_list()});"
+        return None
+
     def get_cs_val(self, ftype, val, ident=0):
         t_origin = typing.get_origin(ftype)
         #
@@ -50,21 +125,47 @@ class CodeGenCSharp(CodeGenBase):
             if t_origin == DataRef:
                 s = f"{inflection.camelize(val.data_type)}.Types.{val.id.upper()}"
             elif t_origin is list:
-                s = f"new List<{self.get_cs_type(typing.get_args(ftype)[0])}> {{\n"
+                s = CodeWriter(f"new List<{self.get_cs_type(typing.get_args(ftype)[0])}> {{\n")
                 for el in val:
                     s += ' ' * (ident + 4) + f"{self.get_cs_val(typing.get_args(ftype)[0], el, ident=(ident+4))},\n"
                 s += ' ' * ident + "}"
             else:
                 assert False
         elif issubclass(ftype, _BaseModel):
-            s = f"new {ftype.__name__}{{\n"
+            s = CodeWriter(f"new {ftype.__name__}{{\n")
             for fname, fval in val:
                 el_type = ftype.__fields__[fname].outer_type_
                 s += ' ' * (ident + 4) + f"{inflection.camelize(fname)} = {self.get_cs_val(el_type, fval, ident=(ident+4))},\n"
             s += ' ' * ident + "}"
         else:
             s = str(val)
-        return s
+        return str(s)
+
+    def get_msgpack_val(self, ftype, val):
+        # values hold data refs, whose ids move when the data is reloaded, so nothing here is cached
+        t_origin = typing.get_origin(ftype)
+        #
+        if t_origin == DataRef:
+            return BaseData._registry[val.ref_str()].get_id()
+        elif t_origin is list:
+            return [self.get_msgpack_val(typing.get_args(ftype)[0], el) for el in val]
+        elif isinstance(ftype, type) and issubclass(ftype, _BaseModel):
+            # nested structs are int-keyed contracts too
+            return self.get_msgpack_row(self.get_msgpack_contract_name(ftype), [
+                (inflection.camelize(fname), self.get_msgpack_val(ftype.__fields__[fname].outer_type_, fval))
+                for fname, fval in val])
+        return val
+
+    def get_msgpack_contract_name(self, cls):
+        return cls.__name__ if issubclass(cls, BaseData) else self.wrap(cls).var_name_camel
+
+    def get_msgpack_row(self, contract, values):
+        # int-keyed contracts are arrays indexed by key, retired keys stay nil
+        keys = self.get_msgpack_keys()[contract]
+        row = [None] * (max(keys.values(), default=-1) + 1)
+        for prop, val in values:
+            row[keys[prop]] = val
+        return row
 
     def get_cs_type(self, fdef: type, dto=False):
         #
@@ -96,7 +197,7 @@ class CodeGenCSharp(CodeGenBase):
                 assert False, f"{t_origin} not supported"
         else:
             if issubclass(fdef, _BaseModel) and dto:
-                wrp_cls = Wrapped(fdef, self)
+                wrp_cls = self.wrap(fdef)
                 return f'{wrp_cls.var_name_camel}DTO'
             return fdef.__name__
 
@@ -111,7 +212,8 @@ class CodeGenCSharp(CodeGenBase):
         elif issubclass(cls, BaseData):
             subpath = 'Data/'
             s, entity_name = self.emit_code_data(cls, mod)
-            self.emit_init_game_data(cls)
+            if self._data_format == 'code':
+                self.emit_init_game_data(cls)
             self._emit_game_data_helper(cls)
         elif issubclass(cls, _BaseModel):
             subpath = 'Structs/'
@@ -122,8 +224,8 @@ class CodeGenCSharp(CodeGenBase):
         path = Path(self._out_dir).joinpath(f'{subpath}{entity_name}.cs')
         self.write_file(path, s)
 
-    def emit_constructor(self, cls):
-        s = f"    public {cls.__name__} ("
+    def emit_constructor(self, cls, body=''):
+        s = CodeWriter(f"    public {cls.__name__} (")
         params = []
         for fname, fdef in cls.__fields__.items():
             if fname == 'id':
@@ -134,11 +236,12 @@ class CodeGenCSharp(CodeGenBase):
         s += ")\n    {\n"
         for fname, fdef in cls.__fields__.items():
             s += f"        this.{inflection.camelize(fname)} = {inflection.camelize(fname)};\n"
+        s += body
         s += "    }\n"
         return s
 
     def _emit_cost_base_struct(self):
-        s = f"""/* Generated/Structs/CostBase.cs */
+        s = CodeWriter(f"""/* Generated/Structs/CostBase.cs */
 using System;
 using System.Collections.Generic;
 using MessagePack;
@@ -154,20 +257,20 @@ namespace {self.namespace}.Shared.Structs
         public abstract void Accept(ICostVisitor visitor);
     }}
 }}
-"""
+""")
         out_path = Path(self._out_dir) \
             .joinpath('Structs') \
             .joinpath(f'CostBase.cs')
         self.write_file(out_path, s)
 
     def _emit_cost_visitor(self):
-        s = f"""/* Generated/Visitors/ICostVisitor.cs */
+        s = CodeWriter(f"""/* Generated/Visitors/ICostVisitor.cs */
 
 namespace {self.namespace}.Shared.Structs
 {{
     public interface ICostVisitor
     {{
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += 8*' ' + f"void Visit(Cost{wrp_cls.entity_name} cost);\n"
         s += """
@@ -180,13 +283,13 @@ namespace {self.namespace}.Shared.Structs
         self.write_file(out_path, s)
 
     def _emit_cost_processor(self):
-        s = f"""/* Generated/Costs/CostProcessor.cs */
+        s = CodeWriter(f"""/* Generated/Costs/CostProcessor.cs */
 
 namespace {self.namespace}.Server.Services
 {{
     public partial class CostProcessor
     {{
-"""
+""")
         s += """
     }
 }
@@ -201,7 +304,7 @@ namespace {self.namespace}.Server.Services
         self._emit_cost_processor()
         self._emit_cost_visitor()
         for wrp_cls in self._erc721_classes:
-            s = f"""/* Generated/Structs/Cost{wrp_cls.entity_name}.cs */
+            s = CodeWriter(f"""/* Generated/Structs/Cost{wrp_cls.entity_name}.cs */
 using System;
 using System.Collections.Generic;
 using MessagePack;
@@ -212,9 +315,10 @@ using {self.namespace}.Shared.Data;
 namespace {self.namespace}.Shared.Structs
 {{
 
-    [MessagePackObject(true)]
+    [MessagePackObject]
     public class Cost{wrp_cls.entity_name} : CostBase
     {{
+        {self.get_msgpack_key_attr(f"Cost{wrp_cls.entity_name}", "Conditions")}
         public List<string> Conditions {{ get; set; }}
         
         public override void Accept(ICostVisitor visitor)
@@ -223,15 +327,15 @@ namespace {self.namespace}.Shared.Structs
         }}
     }}
 }}
-"""
+""")
             out_path = Path(self._out_dir) \
                 .joinpath('Structs') \
                 .joinpath(f'Cost{wrp_cls.entity_name}.cs')
             self.write_file(out_path, s)
 
     def emit_abstrct_code_struct(self, cls):
-        _wrp_cls = Wrapped(cls, self)
-        s = f"""/* Generated/Structs/{cls.__name__}.cs */
+        _wrp_cls = self.wrap(cls)
+        s = CodeWriter(f"""/* Generated/Structs/{cls.__name__}.cs */
 using System;
 using MessagePack;
 
@@ -243,8 +347,10 @@ namespace {self.namespace}.Shared.Structs
 
 public abstract class {_wrp_cls.var_name_camel}
 {{
-"""
+""")
         for fname, fdef in cls.__fields__.items():
+            # serialized through the redeclared properties of the concrete structs
+            s += "    [IgnoreMember]\n"
             s += f"    public {self.get_cs_type(fdef.outer_type_)} {inflection.camelize(fname)} {{ get; set; }}\n"
         s += f"""
     public abstract void Accept(I{_wrp_cls.entity_name}Visitor visitor);
@@ -259,13 +365,13 @@ public abstract class {_wrp_cls.var_name_camel}
         if cls in self._poly_structs:
             return self.emit_abstrct_code_struct(cls)
         #
-        _wrp_cls = Wrapped(cls, self)
+        _wrp_cls = self.wrap(cls)
         inherit_str = ''
         poly_base = self._poly_bases.get(cls)
         if poly_base:
-            poly_base = Wrapped(poly_base, self)
+            poly_base = self.wrap(poly_base)
             inherit_str = f' : {poly_base.var_name_camel}'
-        s = f"""/* Generated/Structs/{cls.__name__}.cs */
+        s = CodeWriter(f"""/* Generated/Structs/{cls.__name__}.cs */
 using System;
 using MessagePack;
 
@@ -275,11 +381,12 @@ using {self.namespace}.Shared.Data;
 namespace {self.namespace}.Shared.Structs
 {{
 
-[MessagePackObject(true)]
+[MessagePackObject]
 public class {_wrp_cls.var_name_camel}{inherit_str}
 {{
-"""
+""")
         for fname, fdef in cls.__fields__.items():
+            s += f"    {self.get_msgpack_key_attr(_wrp_cls.var_name_camel, inflection.camelize(fname))}\n"
             s += f"    public {self.get_cs_type(fdef.outer_type_)} {inflection.camelize(fname)} {{ get; set; }}\n"
         if poly_base:
             s += f"""
@@ -292,8 +399,8 @@ public class {_wrp_cls.var_name_camel}{inherit_str}
         return s, f"{_wrp_cls.var_name_camel}"
 
     def emit_code_model(self, cls, mod):
-        _wrp_cls = Wrapped(cls, self)
-        s = f"""/* Generated/Model/{cls.__name__}.cs */
+        _wrp_cls = self.wrap(cls)
+        s = CodeWriter(f"""/* Generated/Model/{cls.__name__}.cs */
 using System;
 using System.Collections.Generic;
 using MessagePack;
@@ -304,22 +411,174 @@ using {self.namespace}.Shared.Structs;
 namespace {self.namespace}.Shared.Protocol.Models
 {{
 
-[MessagePackObject(true)]
+[MessagePackObject]
 public class {_wrp_cls.var_name_camel}DTO
 {{
-"""
-        for fname, fdef in cls.__fields__.items():
-            t_origin = typing.get_origin(fdef.outer_type_)
-            if t_origin == DataRef:
-                s += f"    public int {inflection.camelize(fname)} {{ get; set; }}\n"
-            else:
-                s += f"    public {self.get_cs_type(fdef.outer_type_, dto=True)} {inflection.camelize(fname)} {{ get; set; }}\n"
+""")
+        for fname, prop_name, cs_type in self.get_dto_fields(cls):
+            s += f"    {self.get_msgpack_key_attr(f'{_wrp_cls.var_name_camel}DTO', prop_name)}\n"
+            s += f"    public {cs_type} {prop_name} {{ get; set; }}\n"
         s += "}\n\n}"
         return s, f"{_wrp_cls.var_name_camel}DTO"
 
+    def get_dto_fields(self, cls):
+        # nft DTOs carry the model id so deltas can address them
+        fields = [('id', 'Id', 'Ulid')] if cls._nft else []
+        for fname, fdef in cls.__fields__.items():
+            if typing.get_origin(fdef.outer_type_) == DataRef:
+                cs_type = 'int'
+            else:
+                cs_type = self.get_cs_type(fdef.outer_type_, dto=True)
+            fields.append((fname, inflection.camelize(fname), cs_type))
+        return fields
+
+    def get_delta_fields(self, cls):
+        # DTO fields a delta can carry, each with its bit in the Fields mask
+        return [(fname, prop_name, cs_type) for fname, prop_name, cs_type in self.get_dto_fields(cls)
+                if fname != 'id' and self.get_dto_nft_list(cls, fname) is None]
+
+    def get_delta_props(self, cls):
+        props = [('Id', 'Ulid')] if cls._nft else []
+        props.append(('Fields', f"{self.wrap(cls).var_name_camel}DeltaFields"))
+        props += [(prop_name, cs_type) for _, prop_name, cs_type in self.get_delta_fields(cls)]
+        for fname, prop_name, cs_type in self.get_dto_fields(cls):
+            el_wrp_cls = self.get_dto_nft_list(cls, fname)
+            if el_wrp_cls is not None:
+                props.append((f"Added{prop_name}", f"List<{el_wrp_cls.var_name_camel}DTO>"))
+                props.append((f"Removed{prop_name}", "List<Ulid>"))
+                props.append((f"Updated{prop_name}", f"List<{el_wrp_cls.var_name_camel}Delta>"))
+        return props
+
+    def get_dto_nft_list(self, cls, fname):
+        # List[<nft model>] fields map onto the server model's id -> model dictionary
+        fdef = cls.__fields__.get(fname)
+        if fdef is None:
+            return None
+        if typing.get_origin(fdef.outer_type_) not in [list, typing.List]:
+            return None
+        el_cls = typing.get_args(fdef.outer_type_)[0]
+        assert isinstance(el_cls, type) and issubclass(el_cls, _BaseModel) and el_cls.is_nft(), \
+            f"{cls.__name__}.{fname} can't be mapped"
+        return self.wrap(el_cls)
+
+    def _emit_model_delta(self, cls):
+        _wrp_cls = self.wrap(cls)
+        name = f"{_wrp_cls.var_name_camel}Delta"
+        s = CodeWriter(f"""/* Generated/Model/{name}.cs */
+using System;
+using System.Collections.Generic;
+using MessagePack;
+
+
+namespace {self.namespace}.Shared.Protocol.Models
+{{
+
+[Flags]
+public enum {name}Fields : uint
+{{
+    None = 0,
+""")
+        delta_fields = self.get_delta_fields(cls)
+        for i, (fname, prop_name, cs_type) in enumerate(delta_fields):
+            s += f"    {prop_name} = {1 << i},\n"
+        s += "}\n\n// only the fields set in Fields are meaningful\n"
+        if not cls._nft:
+            s += f"// {_wrp_cls.var_name_camel} is hand-written without dirty flags, so the server always sets every scalar in Fields\n"
+        if any(self.get_dto_nft_list(cls, fname) is not None for fname, _, _ in self.get_dto_fields(cls)):
+            s += "// Updated entries are matched by Id, a snapshot kept from DTOs that had no Id must be refetched before applying\n"
+        s += f"""[MessagePackObject]
+public class {name}
+{{
+"""
+        for prop_name, cs_type in self.get_delta_props(cls):
+            s += f"    {self.get_msgpack_key_attr(name, prop_name)}\n"
+            s += f"    public {cs_type} {prop_name} {{ get; set; }}\n"
+        s += f"""
+    public bool IsEmpty => Fields == {name}Fields.None"""
+        lists = [(prop_name, self.get_dto_nft_list(cls, fname)) for fname, prop_name, _ in self.get_dto_fields(cls)
+                 if self.get_dto_nft_list(cls, fname) is not None]
+        for prop_name, el_wrp_cls in lists:
+            s += f"""
+        && (Added{prop_name}?.Count ?? 0) == 0 && (Removed{prop_name}?.Count ?? 0) == 0 && (Updated{prop_name}?.Count ?? 0) == 0"""
+        s += f""";
+
+    public void ApplyTo({_wrp_cls.var_name_camel}DTO dto)
+    {{
+"""
+        for fname, prop_name, cs_type in delta_fields:
+            s += f"""        if ((Fields & {name}Fields.{prop_name}) != 0)
+        {{
+            dto.{prop_name} = {prop_name};
+        }}
+"""
+        for prop_name, el_wrp_cls in lists:
+            el_dto = f"{el_wrp_cls.var_name_camel}DTO"
+            s += f"""        dto.{prop_name} ??= new List<{el_dto}>();
+        if (Removed{prop_name} is {{ Count: > 0 }})
+        {{
+            var removed = new HashSet<Ulid>(Removed{prop_name});
+            dto.{prop_name}.RemoveAll(x => removed.Contains(x.Id));
+        }}
+        if (Updated{prop_name} is {{ Count: > 0 }})
+        {{
+            var index = new Dictionary<Ulid, {el_dto}>(dto.{prop_name}.Count);
+            foreach (var item in dto.{prop_name})
+            {{
+                index[item.Id] = item;
+            }}
+            foreach (var delta in Updated{prop_name})
+            {{
+                if (index.TryGetValue(delta.Id, out var item))
+                {{
+                    delta.ApplyTo(item);
+                }}
+            }}
+        }}
+        if (Added{prop_name} is {{ Count: > 0 }})
+        {{
+            dto.{prop_name}.AddRange(Added{prop_name});
+        }}
+"""
+        s += "    }\n}\n\n}"
+        self.write_file(Path(self._out_dir).joinpath('Model').joinpath(f'{name}.cs'), s)
+
+    def _emit_model_deltas(self):
+        for wrp_cls in self._erc721_classes + self.get_dto_classes():
+            self._emit_model_delta(wrp_cls._cls)
+
+    def get_game_data_instance_member(self, cls, data_inst):
+        name = self.wrap(cls).var_name_camel
+        return f"{name}{inflection.camelize(data_inst.id.lower())}"
+
+    def get_game_data_members(self):
+        # every public GameDataService member by name, the instance accessors must not shadow any of them
+        if self._game_data_members is None:
+            members = defaultdict(list)
+            for _wrp_cls in self._data_classes:
+                cls = _wrp_cls._cls
+                name = _wrp_cls.var_name_camel
+                members[f"Get{name}"].append(cls.__name__)
+                for fnames in self.get_secondary_keys(cls):
+                    key_name = 'And'.join(inflection.camelize(fname) for fname in fnames)
+                    members[f"Find{name}By{key_name}"].append(cls.__name__)
+                    members[f"Get{name}By{key_name}"].append(cls.__name__)
+                if cls._upgrade_material:
+                    members[f"{self.get_entity_name(cls)}Exp"].append(cls.__name__)
+                for data_inst in BaseData.instances(cls):
+                    members[self.get_game_data_instance_member(cls, data_inst)].append(data_inst.ref_str())
+            self._game_data_members = members
+        return self._game_data_members
+
     def _emit_game_data_helper(self, cls):
-        _wrp_cls = Wrapped(cls, self)
-        s = f"""
+        _wrp_cls = self.wrap(cls)
+        name = _wrp_cls.var_name_camel
+        table_name = f"_{inflection.camelize(_wrp_cls.var_name, False)}ById"
+        # filled once by Build{name}Lookups() and never written again
+        builds = [f"{table_name} = this._db.{name}Table.All.ToImmutableArray();"]
+        s = CodeWriter(f"""
+using System.Collections.Immutable;
+using System.Linq;
+using MasterMemory;
 
 using {self.namespace}.Shared.Data;
 
@@ -328,13 +587,60 @@ namespace {self.namespace}.Server.GameData
 {{
     public partial class GameDataService
     {{
-        public {_wrp_cls.var_name_camel} Get{_wrp_cls.var_name_camel}(int id)
+        // ids are the dense enum values, so the sorted table doubles as an id-indexed array
+        private ImmutableArray<{name}> {table_name};
+
+        public {name} Get{name}(int id) => {table_name}[id];
+
+        public {name} Get{name}({name}.Types id) => Get{name}((int)id);
+""")
+        for fnames in self.get_secondary_keys(cls):
+            fdefs = [cls.__fields__[fname] for fname in fnames]
+            key_name = 'And'.join(inflection.camelize(fname) for fname in fnames)
+            args_s = ", ".join(f"{self.get_cs_type(fdef.outer_type_)} {inflection.camelize(fname, False)}"
+                               for fname, fdef in zip(fnames, fdefs))
+            key_s = ", ".join(inflection.camelize(fname, False) for fname in fnames)
+            if len(fnames) > 1:
+                key_s = f"({key_s})"
+            s += f"""
+        public RangeView<{name}> Find{name}By{key_name}({args_s}) => this._db.{name}Table.FindBy{key_name}({key_s});
+"""
+            if len(fnames) == 1 and typing.get_origin(fdefs[0].outer_type_) == DataRef:
+                ref_name = self.wrap(self.deref_data_ref(fdefs[0].outer_type_)).var_name_camel
+                index_name = f"_{inflection.camelize(_wrp_cls.var_name, False)}By{key_name}"
+                builds.append(f"{index_name} = BuildReverseIndex(this._db.{name}Table.All, this._db.{ref_name}Table.Count, x => (int)x.{key_name});")
+                s += f"""
+        private ImmutableArray<ImmutableArray<{name}>> {index_name};
+
+        public ImmutableArray<{name}> Get{name}By{key_name}({ref_name}.Types {key_s}) => {index_name}[(int){key_s}];
+"""
+        if cls._upgrade_material:
+            exp_name = f"_{inflection.camelize(_wrp_cls.var_name, False)}Exp"
+            builds.append(f"{exp_name} = this._db.{name}Table.All.Select(x => x.Value).ToImmutableArray();")
+            s += f"""
+        private ImmutableArray<ulong> {exp_name};
+
+        // exp granted per material, indexed by id
+        public ImmutableArray<ulong> {self.get_entity_name(cls)}Exp => {exp_name};
+"""
+        s += f"""
+        private void Build{name}Lookups()
         {{
-            return this._db.{_wrp_cls.var_name_camel}Table.FindById(id);
-        }}
 """
-        s += """
-    }
+        for build in builds:
+            s += f"            {build}\n"
+        s += "        }\n"
+        instances = BaseData.instances(cls)
+        if instances:
+            s += "\n"
+        members = self.get_game_data_members()
+        for data_inst in instances:
+            member = self.get_game_data_instance_member(cls, data_inst)
+            if len(members[member]) > 1:
+                raise SchemaError(f"GameDataService.{member} of {data_inst.ref_str()} collides with "
+                                  f"{', '.join(owner for owner in members[member] if owner != data_inst.ref_str())}")
+            s += f"        public {name} {member} => Get{name}({name}.Types.{data_inst.id.upper()});\n"
+        s += """    }
 }
 """
         out_path = Path(self._server_out_dir)\
@@ -342,8 +648,159 @@ namespace {self.namespace}.Server.GameData
             .joinpath(f'{_wrp_cls.var_name_camel}.cs')
         self.write_file(out_path, s)
 
+    def get_msgpack_contracts(self):
+        contracts = []
+        for cls, mod in self._emit_tasks:
+            _wrp_cls = self.wrap(cls)
+            if cls._nft or cls._dto:
+                contracts.append((f"{_wrp_cls.var_name_camel}DTO", [prop for _, prop, _ in self.get_dto_fields(cls)]))
+                contracts.append((f"{_wrp_cls.var_name_camel}Delta", [prop for prop, _ in self.get_delta_props(cls)]))
+            elif issubclass(cls, BaseData):
+                contracts.append((cls.__name__, [inflection.camelize(fname) for fname in cls.__fields__]))
+            elif issubclass(cls, _BaseModel) and cls not in self._poly_structs:
+                contracts.append((_wrp_cls.var_name_camel, [inflection.camelize(fname) for fname in cls.__fields__]))
+        for wrp_cls in self._erc721_classes:
+            contracts.append((f"Cost{wrp_cls.entity_name}", ['Conditions']))
+        return contracts
+
+    def assign_msgpack_keys(self):
+        # done up front so forked emit workers share the same numbering
+        self._key_manifest = KeyManifest.load(Path(self._out_dir).joinpath('msgpack_keys.json'))
+        self._msgpack_keys = {name: self._key_manifest.assign(name, props)
+                              for name, props in self.get_msgpack_contracts()}
+
+    def get_msgpack_keys(self):
+        # emit() assigns up front, direct emit_code callers assign on first use
+        if self._msgpack_keys is None:
+            self.assign_msgpack_keys()
+        return self._msgpack_keys
+
+    def get_msgpack_key_attr(self, contract, prop, prefix=''):
+        return f"[{prefix}Key({self.get_msgpack_keys()[contract][prop]})]"
+
+    def _emit_msgpack_keys(self):
+        s = CodeWriter(f"""/* Generated/MessagePackKeys.cs */
+
+namespace {self.namespace}.Shared
+{{
+
+// every key each contract has ever used, live or retired; a reused key is a repeated switch arm and fails the build
+internal static class MessagePackKeys
+{{
+""")
+        for name in sorted(self.get_msgpack_keys()):
+            s += f"    private static string {name}(int key) => key switch\n    {{\n"
+            for key, prop in self._key_manifest.entries(name):
+                s += f"        {key} => \"{prop}\",\n"
+            s += "        _ => null,\n    };\n"
+        s += "}\n\n}"
+        self.write_file(Path(self._out_dir).joinpath('MessagePackKeys.cs'), s)
+        self.write_file(Path(self._out_dir).joinpath('msgpack_keys.json'), self._key_manifest.dumps())
+
+    def get_secondary_keys(self, cls):
+        # DataRef fields are always keyed, _indexes declares extra query fields
+        keys = [(fname,) for fname, fdef in cls.__fields__.items()
+                if typing.get_origin(fdef.outer_type_) == DataRef]
+        for fnames in cls._indexes or []:
+            if tuple(fnames) not in keys:
+                keys.append(tuple(fnames))
+        return keys
+
+    def _emit_game_data_indexes(self):
+        s = CodeWriter(f"""
+using System;
+using System.Collections.Generic;
+using System.Collections.Immutable;
+using MasterMemory;
+
+
+namespace {self.namespace}.Server.GameData
+{{
+    public partial class GameDataService
+    {{
+        // rows grouped by the id they reference, indexed by that id
+        private static ImmutableArray<ImmutableArray<T>> BuildReverseIndex<T>(RangeView<T> rows, int count, Func<T, int> key)
+        {{
+            var lists = new List<T>[count];
+            foreach (var row in rows)
+            {{
+                var k = key(row);
+                (lists[k] ??= new List<T>()).Add(row);
+            }}
+            var res = ImmutableArray.CreateBuilder<ImmutableArray<T>>(count);
+            for (int i = 0; i < count; i++)
+            {{
+                res.Add(lists[i]?.ToImmutableArray() ?? ImmutableArray<T>.Empty);
+            }}
+            return res.MoveToImmutable();
+        }}
+
+        // the constructor calls this once _db is loaded, every lookup table is built up front
+        private void BuildLookups()
+        {{
+""")
+        for _wrp_cls in self._data_classes:
+            s += f"            Build{_wrp_cls.var_name_camel}Lookups();\n"
+        s += """        }
+    }
+}
+"""
+        out_path = Path(self._server_out_dir)\
+            .joinpath('GameData')\
+            .joinpath('GameDataIndexes.cs')
+        self.write_file(out_path, s)
+
+    def _emit_master_memory_db(self):
+        tables = {}
+        for _wrp_cls in self._data_classes:
+            cls = _wrp_cls._cls
+            rows = []
+            for data_inst in BaseData.instances(cls):
+                values = []
+                for fname, fvalue in data_inst:
+                    if fname == 'id':
+                        fvalue = data_inst.get_id()
+                    else:
+                        fvalue = self.get_data_field_value(cls, data_inst, fname, fvalue)
+                        fvalue = self.get_msgpack_val(cls.__fields__[fname].outer_type_, fvalue)
+                    values.append((inflection.camelize(fname), fvalue))
+                rows.append(self.get_msgpack_row(cls.__name__, values))
+            tables[_wrp_cls.var_name] = msgpack.packb(rows)
+        # MasterMemory layout: header map of table -> (offset, count), then the table blobs
+        header = {}
+        offset = 0
+        for table_name, table_data in tables.items():
+            header[table_name] = [offset, len(table_data)]
+            offset += len(table_data)
+        out_path = Path(self._server_out_dir)\
+            .joinpath('GameData')\
+            .joinpath('master_memory.bytes')
+        self.write_file(out_path, msgpack.packb(header) + b''.join(tables.values()))
+        #
+        s = CodeWriter(f"""/* Generated/GameData/GameDataBinary.cs */
+using System.IO;
+using MasterMemory;
+
+using {self.namespace}.Shared.Data;
+
+
+namespace {self.namespace}.Server.GameData
+{{
+    public partial class GameDataService
+    {{
+        public const string GeneratedDbPath = "GameData/master_memory.bytes";
+
+        public static MemoryDatabase LoadGeneratedDb() => new MemoryDatabase(File.ReadAllBytes(GeneratedDbPath));
+    }}
+}}
+""")
+        out_path = Path(self._server_out_dir)\
+            .joinpath('GameData')\
+            .joinpath('GameDataBinary.cs')
+        self.write_file(out_path, s)
+
     def _emit_init_game_data_all(self):
-        s = f"""/* Generated/Data/InitGenerated.cs */
+        s = CodeWriter(f"""/* Generated/Data/InitGenerated.cs */
 
 namespace {self.namespace}.ConsoleApp.Data
 {{
@@ -352,7 +809,7 @@ public partial class GameDataBuilder
 {{
     public void InitGenerated()
     {{
-"""
+""")
         for _wrp_cls in self._data_classes:
             s += 8*' '+f"Init{_wrp_cls.var_name_camel}();\n"
         s += """
@@ -366,9 +823,162 @@ public partial class GameDataBuilder
             .joinpath(f'InitGenerated.cs')
         self.write_file(out_path, s)
 
+    def get_init_data_ctor(self, cls, data_inst, ident=12):
+        _wrp_cls = self.wrap(cls)
+        s = CodeWriter(f"new {_wrp_cls.var_name_camel}(")
+        jj = 0
+        for fname, fvalue in data_inst:
+            fdef = cls.__fields__[fname]
+            fvalue = self.get_data_field_value(cls, data_inst, fname, fvalue)
+            comma_s = ',' if jj < len(cls.__fields__)-1 else ''
+            if fname == 'id':
+                s += f"Id: (int){_wrp_cls.var_name_camel}.Types.{data_inst.id.upper()}{comma_s} "
+            else:
+                blob = self.get_list_blob(cls, fname, fvalue)
+                if blob is None:
+                    blob = self.get_cs_val(fdef.outer_type_, fvalue, ident=ident)
+                else:
+                    # every row gets its own list, the shared array is only the source
+                    blob = f"new {self.get_cs_type(fdef.outer_type_)}({blob})"
+                s += f"{inflection.camelize(fname)}: {blob}{comma_s} "
+            jj += 1
+        s += ")"
+        return s
+
+    def get_list_blob_payload(self, cls, fname, fvalue):
+        ftype = cls.__fields__[fname].outer_type_
+        if typing.get_origin(ftype) is not list or len(fvalue) < self.BLOB_MIN_ITEMS:
+            return None
+        el_type = typing.get_args(ftype)[0]
+        el_cs_type = self.get_cs_type(el_type)
+        s = CodeWriter(f"new {el_cs_type}[] {{\n")
+        for el in fvalue:
+            s += 8*' ' + f"{self.get_cs_val(el_type, el, ident=8)},\n"
+        s += 4*' ' + "}"
+        return [f"{el_cs_type}[]", str(s)]
+
+    def get_list_blobs(self):
+        # large list literals repeated across rows, keyed by content
+        if self._list_blobs is None:
+            self._list_blobs = BlobTable('_blob_')
+            if self._dedup_blobs:
+                for _wrp_cls in self._data_classes:
+                    cls = _wrp_cls._cls
+                    for data_inst in BaseData.instances(cls):
+                        for fname, fvalue in data_inst:
+                            fvalue = self.get_data_field_value(cls, data_inst, fname, fvalue)
+                            payload = self.get_list_blob_payload(cls, fname, fvalue)
+                            if payload is not None:
+                                self._list_blobs.add(payload)
+        return self._list_blobs
+
+    def get_list_blob(self, cls, fname, fvalue):
+        payload = self.get_list_blob_payload(cls, fname, fvalue)
+        if payload is None:
+            return None
+        blobs = self.get_list_blobs()
+        key = blobs.key(payload)
+        return key if blobs.refs(key) > 1 else None
+
+    def get_run_outputs(self):
+        return [str(Path(self._console_app_out_dir).joinpath('Data').joinpath('GameDataBlobs.cs').resolve()),
+                str(Path(self._out_dir).joinpath('Data').joinpath('LadderTables.cs').resolve())]
+
+    def _emit_list_blobs(self):
+        blobs = self.get_list_blobs()
+        shared = [(key, payload) for key, payload in blobs.items() if blobs.refs(key) > 1]
+        if not shared:
+            return
+        s = CodeWriter(f"""/* Generated/Data/GameDataBlobs.cs */
+using System.Collections.Generic;
+
+using {self.namespace}.Shared.Data;
+using {self.namespace}.Shared.Structs;
+
+
+namespace {self.namespace}.ConsoleApp.Data
+{{
+
+public partial class GameDataBuilder
+{{
+""")
+        for key, (cs_type, cs_val) in shared:
+            s += f"    private static readonly {cs_type} {key} = {cs_val};\n"
+        s += "}\n\n}"
+        out_path = Path(self._console_app_out_dir)\
+            .joinpath('Data')\
+            .joinpath('GameDataBlobs.cs')
+        self.write_file(out_path, s)
+
+    def _emit_ladder_tables(self):
+        tables = {}
+        for _wrp_cls in self._data_classes:
+            cls = _wrp_cls._cls
+            if not cls._is_ladder:
+                continue
+            for data_inst in BaseData.instances(cls):
+                table = self.get_ladder_table(cls, data_inst)
+                if table is not None:
+                    levels, users = tables.setdefault(table, [data_inst.levels, []])
+                    if [level.experience for level in levels] != [level.experience for level in data_inst.levels]:
+                        raise BlobCollisionError(f"Ladder table {table} collides for {', '.join(users)} and "
+                                                 f"{cls.__name__}.{data_inst.id}")
+                    users.append(f"{cls.__name__}.{data_inst.id}")
+        if not tables:
+            return
+        s = CodeWriter(f"""/* Generated/Data/LadderTables.cs */
+
+namespace {self.namespace}.Shared.Data
+{{
+
+// level experience tables shared by content between ladders
+public static class LadderTables
+{{
+""")
+        for table, (levels, users) in sorted(tables.items()):
+            s += f"    // {', '.join(users)}\n"
+            s += f"    public static readonly ulong[] {table} = new ulong[]\n    {{\n"
+            exps = [str(level.experience) for level in levels]
+            for ii in range(0, len(exps), 16):
+                s += 8*' ' + ', '.join(exps[ii:ii+16]) + ',\n'
+            s += "    };\n"
+        s += "}\n\n}"
+        out_path = Path(self._out_dir)\
+            .joinpath('Data')\
+            .joinpath('LadderTables.cs')
+        self.write_file(out_path, s)
+
+    def get_owned_outputs(self, cls):
+        if self._data_format != 'code' or not issubclass(cls, BaseData):
+            return []
+        # the chunk count follows the instance count
+        out_dir = Path(self._console_app_out_dir).joinpath('Data').resolve()
+        return [str(out_dir.joinpath(f'{self.wrap(cls).var_name_camel}_*.cs'))]
+
+    def emit_init_game_data_header(self, cls_name):
+        return f"""/* Generated/Data/{cls_name}.cs */
+using System.Collections.Generic;
+using MasterMemory;
+
+using {self.namespace}.Shared.Data;
+using {self.namespace}.Shared.Structs;
+
+
+namespace {self.namespace}.ConsoleApp.Data
+{{
+
+public partial class GameDataBuilder
+{{
+"""
+
     def emit_init_game_data(self, cls):
-        _wrp_cls = Wrapped(cls, self)
-        s = f"""/* Generated/Data/{cls.__name__}.cs */
+        _wrp_cls = self.wrap(cls)
+        instances = BaseData.instances(cls)
+        out_dir = Path(self._console_app_out_dir).joinpath('Data')
+        if self._init_chunk_size and len(instances) > self._init_chunk_size:
+            self.emit_init_game_data_chunked(cls, instances, out_dir)
+            return
+        s = CodeWriter(f"""/* Generated/Data/{cls.__name__}.cs */
 using MasterMemory;
 
 using {self.namespace}.Shared.Data;
@@ -384,32 +994,46 @@ public partial class GameDataBuilder
     {{
         _builder.Append(new {_wrp_cls.var_name_camel}[]
         {{
-"""
-        for data_inst in BaseData.instances(cls):
-            s += 12*' ' + f"new {_wrp_cls.var_name_camel}("
-            jj = 0
-            for fname, fvalue in data_inst:
-                fdef = cls.__fields__[fname]
-                comma_s = ',' if jj < len(cls.__fields__)-1 else ''
-                if fname == 'id':
-                    s += f"Id: (int){_wrp_cls.var_name_camel}.Types.{data_inst.id.upper()}{comma_s} "
-                else:
-                    s += f"{inflection.camelize(fname)}: {self.get_cs_val(fdef.outer_type_, fvalue, ident=12)}{comma_s} "
-                jj += 1
-            s += "),\n"
+""")
+        for data_inst in instances:
+            s += 12*' ' + f"{self.get_init_data_ctor(cls, data_inst)},\n"
         s += """
         });
     }
 """
         s += "}\n\n}"
-        out_path = Path(self._console_app_out_dir)\
-            .joinpath('Data')\
-            .joinpath(f'{_wrp_cls.var_name_camel}.cs')
-        self.write_file(out_path, s)
+        self.write_file(out_dir.joinpath(f'{_wrp_cls.var_name_camel}.cs'), s, statements=len(instances))
+
+    def emit_init_game_data_chunked(self, cls, instances, out_dir):
+        # MasterMemory rejects a second Append of the same table, so chunks fill one shared list
+        _wrp_cls = self.wrap(cls)
+        chunks = [instances[i:i+self._init_chunk_size] for i in range(0, len(instances), self._init_chunk_size)]
+        s = CodeWriter(self.emit_init_game_data_header(cls.__name__))
+        s += f"""    private void Init{_wrp_cls.var_name_camel}()
+    {{
+        var items = new List<{_wrp_cls.var_name_camel}>({len(instances)});
+"""
+        for ii in range(len(chunks)):
+            s += f"        Init{_wrp_cls.var_name_camel}_{ii}(items);\n"
+        s += "        _builder.Append(items);\n"
+        s += "    }\n"
+        s += "}\n\n}"
+        self.write_file(out_dir.joinpath(f'{_wrp_cls.var_name_camel}.cs'), s, statements=len(chunks) + 2)
+        #
+        for ii, chunk in enumerate(chunks):
+            s = CodeWriter(self.emit_init_game_data_header(f"{cls.__name__}_{ii}"))
+            s += f"""    private void Init{_wrp_cls.var_name_camel}_{ii}(List<{_wrp_cls.var_name_camel}> items)
+    {{
+"""
+            for data_inst in chunk:
+                s += 8*' ' + f"items.Add({self.get_init_data_ctor(cls, data_inst, ident=8)});\n"
+            s += "    }\n"
+            s += "}\n\n}"
+            self.write_file(out_dir.joinpath(f'{_wrp_cls.var_name_camel}_{ii}.cs'), s, statements=len(chunk))
 
     def emit_code_data(self, cls, mod):
-        _wrp_cls = Wrapped(cls, self)
-        s = f"""/* Generated/Data/{cls.__name__}.cs */
+        _wrp_cls = self.wrap(cls)
+        s = CodeWriter(f"""/* Generated/Data/{cls.__name__}.cs */
 using System.Collections.Generic;
 using MasterMemory;
 
@@ -419,70 +1043,230 @@ using {self.namespace}.Shared.Structs;
 namespace {self.namespace}.Shared.Data
 {{
 
-[MemoryTable("{_wrp_cls.var_name}"), MessagePack.MessagePackObject(true)]  
+[MemoryTable("{_wrp_cls.var_name}"), MessagePack.MessagePackObject]  
 public class {cls.__name__}
 {{
     public enum Types : int
     {{
-"""
+""")
         for _id, data_inst in enumerate(BaseData.instances(cls)):
             s += 8*' ' + f"{data_inst.id.upper()} = {_id},\n"
         s += "    }\n\n"
+        secondary_keys = self.get_secondary_keys(cls)
         for fname, fdef in cls.__fields__.items():
+            s += f"    {self.get_msgpack_key_attr(cls.__name__, inflection.camelize(fname), 'MessagePack.')}\n"
             if fname == 'id':
                 s += "    [PrimaryKey]\n"
                 s += f"    public int Id {{ get; }}\n"
             else:
+                for key_id, fnames in enumerate(secondary_keys):
+                    if fname in fnames:
+                        key_order_s = f", keyOrder: {fnames.index(fname)}" if len(fnames) > 1 else ""
+                        s += f"    [SecondaryKey({key_id}{key_order_s}), NonUnique]\n"
                 s += f"    public {self.get_cs_type(fdef.outer_type_)} {inflection.camelize(fname)} {{ get; }}\n"
-        s += self.emit_constructor(cls)
-        if cls._is_ladder:
-            s += f"""
+        if not cls._is_ladder:
+            s += self.emit_constructor(cls)
+        else:
+            self.validate_ladder(cls)
+            s += self.emit_constructor(cls, body="""\
+        _formula = this.Id < _formulas.Length ? _formulas[this.Id] : null;
+        if (_formula != null)
+        {
+            _levelCount = _formula.Count;
+        }
+        else
+        {
+            _levelExp = this.Id < _tables.Length ? _tables[this.Id] : null;
+            if (_levelExp == null)
+            {
+                _levelExp = new ulong[this.Levels.Count];
+                for (int i = 0; i < _levelExp.Length; i++)
+                {
+                    _levelExp[i] = this.Levels[i].Experience;
+                }
+            }
+            _levelCount = _levelExp.Length;
+            _totalExp = new ulong[_levelCount + 1];
+            for (int i = 0; i < _levelCount; i++)
+            {
+                _totalExp[i + 1] = _totalExp[i] + _levelExp[i];
+            }
+        }
+""")
+            formulas = []
+            tables = []
+            for data_inst in BaseData.instances(cls):
+                formula = self.get_ladder_formula(cls, data_inst)
+                table = self.get_ladder_table(cls, data_inst)
+                if formula is not None:
+                    formulas.append(f"        {self.get_cs_ladder_formula(formula)}, // {data_inst.id}: {formula.name}\n")
+                else:
+                    formulas.append(f"        null, // {data_inst.id}: table\n")
+                if table is not None:
+                    tables.append(f"        LadderTables.{table}, // {data_inst.id}\n")
+                else:
+                    tables.append(f"        null, // {data_inst.id}\n")
+            s += """
+    // levels by Id, Levels is left empty when they come from a formula or a shared table
+    private static readonly LadderFormula[] _formulas = new LadderFormula[]
+    {
+"""
+            s += ''.join(formulas)
+            s += """    };
+
+    private static readonly ulong[][] _tables = new ulong[][]
+    {
+"""
+            s += ''.join(tables)
+            s += f"""    }};
+
+    private readonly LadderFormula _formula;
+    private readonly int _levelCount;
+    private readonly ulong[] _levelExp;
+    private readonly ulong[] _totalExp;
+
+    public ulong GetLevelExperience(int level)
+    {{
+        return _formula != null ? _formula.Experience(level) : _levelExp[level];
+    }}
+
     public (int, ulong) GetLevel(int currLevel, ulong exp)
     {{
-        var level = currLevel;
-        while (exp >= this.Levels[level].Experience) {{
-            level += 1;
+        // first level at or above currLevel whose experience is not reached yet
+        var lo = currLevel < 0 ? 0 : currLevel;
+        var hi = _levelCount;
+        while (lo < hi)
+        {{
+            var mid = (lo + hi) >> 1;
+            if (exp >= this.GetLevelExperience(mid))
+            {{
+                lo = mid + 1;
+            }}
+            else
+            {{
+                hi = mid;
+            }}
+        }}
+        if (lo >= _levelCount)
+        {{
+            return (_levelCount > 0 ? _levelCount - 1 : 0, 0);
         }}
-        var expLeft = this.Levels[level].Experience - exp;
-        return (level, expLeft);
+        var expLeft = this.GetLevelExperience(lo) - exp;
+        return (lo, expLeft);
     }}
     
     public ulong GetLevelExp(int level)
     {{
-        if (level >=  this.Levels.Count)
+        if (level < 0 || level >= _levelCount)
         {{
             return 0;
         }}
-        
-        ulong totExp = 0;
-        for (int i = 0; i < level; i++)
-        {{
-            totExp += this.Levels[i].Experience;
-        }}
-        return totExp;
+        return _formula != null ? _formula.TotalExperience(level) : _totalExp[level];
     }}
 """
         s += "}\n\n}"
         #
         return s, cls.__name__
 
+    def get_cs_ladder_formula(self, formula):
+        kind = 'Polynomial' if formula.kind == formula.POLYNOMIAL else 'Geometric'
+        return f"new LadderFormula(LadderFormulaKind.{kind}, {formula.a}, {formula.b}, {formula.c}, {formula.d}, {formula.count})"
+
+    def _emit_ladder_formula(self):
+        s = CodeWriter(f"""/* Generated/Structs/LadderFormula.cs */
+
+namespace {self.namespace}.Shared.Structs
+{{
+
+    public enum LadderFormulaKind : int
+    {{
+        Polynomial = 1,
+        Geometric = 2,
+    }}
+
+    // Polynomial: (A + B*i + C*i*i) / D, Geometric: A + B * C^i
+    public sealed class LadderFormula
+    {{
+        public LadderFormulaKind Kind {{ get; }}
+        public long A {{ get; }}
+        public long B {{ get; }}
+        public long C {{ get; }}
+        public long D {{ get; }}
+        public int Count {{ get; }}
+
+        public LadderFormula(LadderFormulaKind kind, long a, long b, long c, long d, int count)
+        {{
+            this.Kind = kind;
+            this.A = a;
+            this.B = b;
+            this.C = c;
+            this.D = d;
+            this.Count = count;
+        }}
+
+        public ulong Experience(int level)
+        {{
+            long i = level;
+            if (this.Kind == LadderFormulaKind.Polynomial)
+            {{
+                return (ulong)((this.A + this.B * i + this.C * i * i) / this.D);
+            }}
+            return (ulong)(this.A + this.B * Pow(this.C, level));
+        }}
+
+        // sum of Experience(i) for i < level
+        public ulong TotalExperience(int level)
+        {{
+            long n = level;
+            if (this.Kind == LadderFormulaKind.Polynomial)
+            {{
+                return (ulong)((this.A * n + this.B * (n * (n - 1) / 2) + this.C * ((n - 1) * n * (2 * n - 1) / 6)) / this.D);
+            }}
+            return (ulong)(this.A * n + this.B * ((Pow(this.C, level) - 1) / (this.C - 1)));
+        }}
+
+        private static long Pow(long x, int n)
+        {{
+            long res = 1;
+            while (true)
+            {{
+                if ((n & 1) != 0)
+                {{
+                    res *= x;
+                }}
+                n >>= 1;
+                if (n == 0)
+                {{
+                    return res;
+                }}
+                x *= x;
+            }}
+        }}
+    }}
+}}
+""")
+        out_path = Path(self._out_dir) \
+            .joinpath('Structs') \
+            .joinpath('LadderFormula.cs')
+        self.write_file(out_path, s)
+
     def emit_visitors(self):
         for p_cls in self._poly_structs:
             self.emit_visitor(p_cls)
 
     def emit_visitor(self, p_cls):
         ch_classes = self._poly_structs[p_cls]
-        _wrp_chs = [Wrapped(ch_class, self) for ch_class in ch_classes]
-        _wrp_cls = Wrapped(p_cls, self)
+        _wrp_chs = [self.wrap(ch_class) for ch_class in ch_classes]
+        _wrp_cls = self.wrap(p_cls)
         #
-        s = f"""/* Generated/Structs/I{_wrp_cls.entity_name}Visitor.cs */
+        s = CodeWriter(f"""/* Generated/Structs/I{_wrp_cls.entity_name}Visitor.cs */
 
 namespace {self.namespace}.Shared.Structs
 {{
 
 public interface I{_wrp_cls.entity_name}Visitor
 {{
-"""
+""")
         for _wrp_ch_cls in _wrp_chs:
             s += f"    void Visit({_wrp_ch_cls.var_name_camel} {_wrp_ch_cls.entity_name_us});\n"
         s += "}\n\n}"
@@ -493,8 +1277,9 @@ public interface I{_wrp_cls.entity_name}Visitor
         self.write_file(out_path, s)
 
     def _emit_i_user_repo(self):
-        s = f"""
+        s = CodeWriter(f"""
 using System;
+using System.Collections.Generic;
 
 using {self.namespace}.Server.Db;
 using {self.namespace}.Server.Db.Models;
@@ -504,9 +1289,10 @@ namespace {self.namespace}.Server.Repositories
 
 public partial interface IUserRepository
 {{
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += f"    public {wrp_cls.var_name_camel} AddToUser(UserModel user, {wrp_cls.var_name_camel} {wrp_cls.entity_name_us});\n"
+            s += f"    public void AddToUser(UserModel user, IReadOnlyList<{wrp_cls.var_name_camel}> {wrp_cls.var_name_plural});\n"
             s += f"    public bool RemoveFromUser(UserModel user, {wrp_cls.var_name_camel} {wrp_cls.entity_name_us});\n"
 
         s += "}\n\n}"
@@ -516,34 +1302,60 @@ public partial interface IUserRepository
         self.write_file(out_path, s)
 
     def _emit_user_repo(self):
-        s = f"""//
+        # with no item types there are no codes to map back
+        item_types_s = self.get_inventory_item_type_list()
+        type_s = f"ELT(`Type`, {item_types_s}) AS `Type`" if item_types_s else "`Type`"
+        load_sql = ["SELECT * FROM `user_models` WHERE `Id` = @Id;",
+                    f"SELECT `UserId`, {type_s}, `ItemId`, `Amount` FROM `user_inventory` WHERE `UserId` = @Id;"]
+        for wrp_cls in self._erc721_classes:
+            load_sql.append(f"SELECT * FROM `{wrp_cls.var_name_plural}` WHERE `UserId` = @Id;")
+        load_sql_s = " +\n".join(f'        "{q}"' for q in load_sql)
+        s = CodeWriter(f"""//
 using System;
 using System.Collections.Generic;
 using System.Linq;
 using System.Data;
+using System.Text;
+using Dapper;
 using MagicOnion.Server;
 
 using {self.namespace}.Server.Db;
 using {self.namespace}.Server.Db.Models;
+using {self.namespace}.Server.Mappings;
+using {self.namespace}.Shared.Protocol.Models;
 
 namespace {self.namespace}.Server.Repositories
 {{
 
 public partial class UserRepository 
 {{
+    // inventory amounts as last read from or written to the db, the base for delta writes
+    private readonly Dictionary<(Ulid, string, long), long> _inventoryLoaded = new Dictionary<(Ulid, string, long), long>();
+
+    // user row first, then every child table, in one round trip
+    private const string LoadUserSql =
+{load_sql_s};
+
     private async Task<UserModel> GetFromDbAsync(Ulid id)
     {{
-        var user = await _db.Users.FindAsync(x => x.Id == id);
-        if (user is null)
+        using (var results = await _db.Connection.QueryMultipleAsync(LoadUserSql, new {{ Id = id }}))
         {{
-            return null;
-        }}
-        var user_inventory = await _db.UserInventory.FindAllAsync(x => x.UserId == id);
-"""
+            var user = await results.ReadSingleOrDefaultAsync<UserModel>();
+            if (user is null)
+            {{
+                return null;
+            }}
+            var user_inventory = await results.ReadAsync<UserInventoryModel>();
+            foreach (var item in user_inventory)
+            {{
+                _inventoryLoaded[(item.UserId, item.Type, item.ItemId)] = (long)item.Amount;
+            }}
+""")
         for wrp_cls in self._erc721_classes:
-            s += f"        var {wrp_cls.var_name_plural} = await _db.{wrp_cls.entity_name_plural}.FindAllAsync(x => x.UserId == id);\n"
-            s += f"        user.{wrp_cls.entity_name_plural} = {wrp_cls.var_name_plural}.ToDictionary(x => x.Id, x => x);\n"
-        s += "        return user;\n"
+            s += f"            var {wrp_cls.var_name_plural} = await results.ReadAsync<{wrp_cls.var_name_camel}>();\n"
+            s += f"            user.{wrp_cls.entity_name_plural} = {wrp_cls.var_name_plural}.ToDictionary(x => x.Id, x => x.ClearDirty());\n"
+        s += "            return user;\n"
+        s += "        }\n"
         s += "    }\n"
 
         for wrp_cls in self._erc721_classes:
@@ -556,49 +1368,247 @@ public partial class UserRepository
         return {wrp_cls.entity_name_us};
     }}
 
+    public void AddToUser(UserModel user, IReadOnlyList<{wrp_cls.var_name_camel}> {wrp_cls.var_name_plural})
+    {{
+        user.{wrp_cls.entity_name_plural}.EnsureCapacity(user.{wrp_cls.entity_name_plural}.Count + {wrp_cls.var_name_plural}.Count);
+        for (int i = 0; i < {wrp_cls.var_name_plural}.Count; i++)
+        {{
+            var {wrp_cls.entity_name_us} = {wrp_cls.var_name_plural}[i];
+            {wrp_cls.entity_name_us}.UserId = user.Id;
+            user.{wrp_cls.entity_name_plural}[{wrp_cls.entity_name_us}.Id] = {wrp_cls.entity_name_us};
+            this._changes.{wrp_cls.entity_name_plural}.Add({wrp_cls.entity_name_us});
+        }}
+    }}
+
     public bool RemoveFromUser(UserModel user, {wrp_cls.var_name_camel} {wrp_cls.entity_name_us})
     {{
         var success = user.{wrp_cls.entity_name_plural}.Remove({wrp_cls.entity_name_us}.Id);           
         this._changes.{wrp_cls.entity_name_plural}.Remove({wrp_cls.entity_name_us});
         return success;
     }}
+"""
+        for wrp_cls in self._erc721_classes:
+            columns = ['Id'] + [col_name for col_name, col_type in self.get_db_model_columns(wrp_cls)]
+            fields_enum = f"{wrp_cls.var_name_camel}Fields"
+            s += f"""
+    private async Task Update{wrp_cls.entity_name_plural}(IEnumerable<{wrp_cls.var_name_camel}> models, IDbTransaction tx)
+    {{
+        // plain UPDATE, so a row deleted by another session stays deleted; one statement per set of dirty columns
+        foreach (var group in models.GroupBy(x => x.DirtyFields))
+        {{
+            if (group.Key == {fields_enum}.None)
+            {{
+                continue;
+            }}
+            var columns = new List<string>();
+"""
+            for col_name in columns[1:]:
+                s += f"            if (group.Key.HasFlag({fields_enum}.{col_name})) columns.Add(\"{col_name}\");\n"
+            s += f"""            foreach (var batch in group.Chunk(SqlBatchSize))
+            {{
+                var args = new DynamicParameters();
+                var ids = new StringBuilder();
+                var cases = new StringBuilder();
+                for (int i = 0; i < batch.Length; i++)
+                {{
+                    var m = batch[i];
+                    ids.Append(i == 0 ? "" : ", ").Append($"@Id{{i}}");
+                    cases.Append($" WHEN @Id{{i}} THEN @{{{{0}}}}{{i}}");
+                    args.Add($"Id{{i}}", m.Id);
+"""
+            for col_name in columns[1:]:
+                s += f"                    if (group.Key.HasFlag({fields_enum}.{col_name})) args.Add($\"{col_name}{{i}}\", m.{col_name});\n"
+            s += f"""                }}
+                var sets = columns.Select(c => $"`{{c}}` = CASE `Id`" + string.Format(cases.ToString(), c) + " END");
+                var sql = $"UPDATE `{wrp_cls.var_name_plural}` SET {{string.Join(", ", sets)}} WHERE `Id` IN ({{ids}})";
+                await _db.Connection.ExecuteAsync(sql, args, tx);
+            }}
+        }}
+    }}
 """
         s += f"""
-    public async Task CommitChanges()
+    private const int SqlBatchSize = {self.SQL_BATCH_SIZE};
+
+    private async Task DeleteByIds(string table, IEnumerable<Ulid> ids, IDbTransaction tx)
     {{
-        using (var tx = this._db.BeginTransaction())
+        foreach (var batch in ids.Chunk(SqlBatchSize))
+        {{
+            await _db.Connection.ExecuteAsync($"DELETE FROM `{{table}}` WHERE `Id` IN @Ids", new {{ Ids = batch }}, tx);
+        }}
+    }}
+
+    private (Dictionary<(Ulid, string, long), long>, Dictionary<(Ulid, string, long), long>) CollectInventoryChanges()
+    {{
+        // rows with a known base amount become increments, the rest are written as is
+        var deltas = new Dictionary<(Ulid, string, long), long>(this._changes.InventoryDeltas);
+        var amounts = new Dictionary<(Ulid, string, long), long>();
+        if (this._changes.UserInventory is not null)
+        {{
+            foreach (var item in this._changes.UserInventory.Added.Values)
+            {{
+                CollectInventoryRow(item, true, deltas, amounts);
+            }}
+            foreach (var item in this._changes.UserInventory.Updated.Values)
+            {{
+                CollectInventoryRow(item, false, deltas, amounts);
+            }}
+        }}
+        return (deltas, amounts);
+    }}
+
+    private void CollectInventoryRow(UserInventoryModel item, bool added,
+        Dictionary<(Ulid, string, long), long> deltas, Dictionary<(Ulid, string, long), long> amounts)
+    {{
+        // a key changed both on the row and through AddInventoryDelta is applied once, and the two must agree
+        var key = (item.UserId, item.Type, item.ItemId);
+        var hasRecorded = this._changes.InventoryDeltas.TryGetValue(key, out var recorded);
+        if (_inventoryLoaded.TryGetValue(key, out var loaded) || added)
+        {{
+            var delta = (long)item.Amount - loaded;
+            if (hasRecorded && recorded != delta)
+            {{
+                throw new InvalidOperationException($"Inventory {{key}} changed by {{delta}} on the row and by {{recorded}} through AddInventoryDelta");
+            }}
+            deltas[key] = delta;
+        }}
+        else
         {{
-            if (this._changes.UserInventory is not null)
+            if (hasRecorded)
             {{
-                await this._db.UserInventory.BulkInsertAsync(this._changes.UserInventory.Added.Values.ToList(), tx);
-                await this._db.UserInventory.BulkUpdateAsync(this._changes.UserInventory.Updated.Values.ToList(), tx);
+                throw new InvalidOperationException($"Inventory {{key}} has no loaded amount to check its AddInventoryDelta against");
             }}
+            amounts[key] = (long)item.Amount;
+        }}
+    }}
+
+    private async Task UpsertInventory(Dictionary<(Ulid, string, long), long> amounts, bool increment, IDbTransaction tx)
+    {{
+        var onDuplicate = increment ? "`Amount` = `Amount` + VALUES(`Amount`)" : "`Amount` = VALUES(`Amount`)";
+        foreach (var batch in amounts.Where(x => !increment || x.Value != 0).Chunk(SqlBatchSize))
+        {{
+            var sql = new StringBuilder("INSERT INTO `user_inventory` (`UserId`, `Type`, `ItemId`, `Amount`) VALUES ");
+            var args = new DynamicParameters();
+            for (int i = 0; i < batch.Length; i++)
+            {{
+                var ((userId, type, itemId), amount) = batch[i];
+                sql.Append(i == 0 ? "(" : ", (");
+                sql.Append($"@UserId{{i}}, @Type{{i}}, @ItemId{{i}}, @Amount{{i}})");
+                args.Add($"UserId{{i}}", userId);
+                args.Add($"Type{{i}}", InventoryItemTypes.ToCode(type));
+                args.Add($"ItemId{{i}}", itemId);
+                args.Add($"Amount{{i}}", amount);
+            }}
+            sql.Append(" ON DUPLICATE KEY UPDATE ").Append(onDuplicate);
+            await _db.Connection.ExecuteAsync(sql.ToString(), args, tx);
+        }}
+    }}
+
+    public async Task CommitChanges()
+    {{
+        var (inventoryDeltas, inventoryAmounts) = CollectInventoryChanges();
+        using (var tx = this._db.BeginTransaction())
+        {{
+            await UpsertInventory(inventoryDeltas, true, tx);
+            await UpsertInventory(inventoryAmounts, false, tx);
 """
         for wrp_cls in self._erc721_classes:
             s += f"""
             if (this._changes.{wrp_cls.entity_name_plural} is not null)
             {{
-                foreach(var model in this._changes.{wrp_cls.entity_name_plural}.Removed.Values)
-                {{
-                    await this._db.{wrp_cls.entity_name_plural}.DeleteAsync(model, tx);
-                }}
+                await DeleteByIds("{wrp_cls.var_name_plural}", this._changes.{wrp_cls.entity_name_plural}.Removed.Keys, tx);
                 await this._db.{wrp_cls.entity_name_plural}.BulkInsertAsync(this._changes.{wrp_cls.entity_name_plural}.Added.Values.ToList(), tx);
-                await this._db.{wrp_cls.entity_name_plural}.BulkUpdateAsync(this._changes.{wrp_cls.entity_name_plural}.Updated.Values.ToList(), tx);
+                await Update{wrp_cls.entity_name_plural}(this._changes.{wrp_cls.entity_name_plural}.Updated.Values, tx);
             }}
 """
         s += """
             tx.Commit();
         }
-    }
+
+        foreach (var (key, delta) in inventoryDeltas)
+        {
+            _inventoryLoaded.TryGetValue(key, out var loaded);
+            _inventoryLoaded[key] = loaded + delta;
+        }
+        foreach (var (key, amount) in inventoryAmounts)
+        {
+            _inventoryLoaded[key] = amount;
+        }
+        this._changes.InventoryDeltas.Clear();
+"""
+        for wrp_cls in self._erc721_classes:
+            s += f"""
+        if (this._changes.{wrp_cls.entity_name_plural} is not null)
+        {{
+            foreach (var model in this._changes.{wrp_cls.entity_name_plural}.Added.Values) model.ClearDirty();
+            foreach (var model in this._changes.{wrp_cls.entity_name_plural}.Updated.Values) model.ClearDirty();
+        }}
 """
+        s += "    }\n"
+        s += self._emit_user_repo_delta()
         s += "}\n\n}"
         out_path = Path(self._server_out_dir) \
             .joinpath("Repositories") \
             .joinpath('UserRepository.cs')
         self.write_file(out_path, s)
 
+    def _emit_user_repo_delta(self):
+        user_wrp_cls = next((w for w in self.get_dto_classes() if w.var_name_camel == 'UserModel'), None)
+        if user_wrp_cls is None:
+            return ""
+        s = CodeWriter("""
+    // pending changes of one user as a delta, must run before CommitChanges clears the dirty flags
+    public UserModelDelta CollectDelta(UserModel user)
+    {
+        var delta = this._changes.Users.Updated.ContainsKey(user.Id)
+            ? user.ToDelta()
+            : new UserModelDelta();
+""")
+        for fname, prop_name, cs_type in self.get_dto_fields(user_wrp_cls._cls):
+            el_wrp_cls = self.get_dto_nft_list(user_wrp_cls._cls, fname)
+            if el_wrp_cls is None:
+                continue
+            changes = f"this._changes.{el_wrp_cls.entity_name_plural}"
+            s += f"""
+        if ({changes} is not null)
+        {{
+            foreach (var model in {changes}.Added.Values)
+            {{
+                if (model.UserId == user.Id)
+                {{
+                    (delta.Added{prop_name} ??= new List<{el_wrp_cls.var_name_camel}DTO>()).Add(model.ToDTO());
+                }}
+            }}
+            foreach (var model in {changes}.Removed.Values)
+            {{
+                if (model.UserId == user.Id)
+                {{
+                    (delta.Removed{prop_name} ??= new List<Ulid>()).Add(model.Id);
+                }}
+            }}
+            foreach (var model in {changes}.Updated.Values)
+            {{
+                var item = model.UserId == user.Id ? model.ToDelta() : null;
+                if (item is not null && !item.IsEmpty)
+                {{
+                    (delta.Updated{prop_name} ??= new List<{el_wrp_cls.var_name_camel}Delta>()).Add(item);
+                }}
+            }}
+        }}
+"""
+        s += """        return delta;
+    }
+
+    public async Task<UserModelDelta> CommitChangesWithDelta(UserModel user)
+    {
+        var delta = CollectDelta(user);
+        await CommitChanges();
+        return delta;
+    }
+"""
+        return s
+
     def _emit_user_model(self):
-        s = f"""//
+        s = CodeWriter(f"""//
 using System;
 using System.ComponentModel;
 using System.ComponentModel.DataAnnotations;
@@ -614,7 +1624,7 @@ namespace {self.namespace}.Server.Db.Models
 
 public partial class UserModel
 {{
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += "    [NotMapped]\n"
             s += f"    public Dictionary<Ulid, {wrp_cls.var_name_camel}> {wrp_cls.entity_name_plural} {{ get; set; }} = new Dictionary<Ulid, {wrp_cls.var_name_camel}>();\n"
@@ -626,8 +1636,9 @@ public partial class UserModel
         self.write_file(out_path, s)
 
     def _emit_i_db_change_set(self):
-        s = f"""
+        s = CodeWriter(f"""
 using System;
+using System.Collections.Generic;
 
 using {self.namespace}.Server.Cache;
 using {self.namespace}.Server.Db.Models;
@@ -638,7 +1649,9 @@ namespace {self.namespace}.Server.Db
 public partial interface IDbChangeSet
 {{
     public ChangeSet<(Ulid, string, long), UserInventoryModel> UserInventory {{ get; }}
-"""
+    public Dictionary<(Ulid, string, long), long> InventoryDeltas {{ get; }}
+    public void AddInventoryDelta(Ulid userId, string type, long itemId, long delta);
+""")
         for wrp_cls in self._erc721_classes:
             s += f"    public ChangeSet<Ulid, {wrp_cls.var_name_camel}> {wrp_cls.entity_name_plural} {{ get; }}\n"
         s += "}\n\n}"
@@ -648,7 +1661,7 @@ public partial interface IDbChangeSet
         self.write_file(out_path, s)
 
     def _emit_db_change_set(self):
-        s = f"""//
+        s = CodeWriter(f"""//
 using System;
 using System.Data;
 using System.Collections.Generic;
@@ -664,7 +1677,8 @@ public partial class DbChangeSet
 {{
     private ChangeSet<Ulid, UserModel> _user_models;
     private ChangeSet<(Ulid, string, long), UserInventoryModel> _user_inventory_models;
-"""
+    private Dictionary<(Ulid, string, long), long> _inventory_deltas;
+""")
         for wrp_cls in self._erc721_classes:
             s += f"    private ChangeSet<Ulid, {wrp_cls.var_name_camel}> _{wrp_cls.var_name_plural};\n"
         s += "\n"
@@ -674,6 +1688,17 @@ public partial class DbChangeSet
         
     public ChangeSet<(Ulid, string, long), UserInventoryModel> UserInventory => _user_inventory_models ??
         (_user_inventory_models = new ChangeSet<(Ulid, string, long), UserInventoryModel>());
+
+    // Amount increments by (UserId, Type, ItemId), committed as Amount = Amount + delta
+    public Dictionary<(Ulid, string, long), long> InventoryDeltas => _inventory_deltas ??
+        (_inventory_deltas = new Dictionary<(Ulid, string, long), long>());
+
+    public void AddInventoryDelta(Ulid userId, string type, long itemId, long delta)
+    {
+        var key = (userId, type, itemId);
+        InventoryDeltas.TryGetValue(key, out var curr);
+        InventoryDeltas[key] = curr + delta;
+    }
 """
         for wrp_cls in self._erc721_classes:
             s += f"""
@@ -709,8 +1734,20 @@ public partial class DbChangeSet
         for wrp_cls in self._erc721_classes:
             self._emit_db_model(wrp_cls)
 
+    def get_db_model_columns(self, wrp_cls):
+        columns = [('UserId', 'Ulid')]
+        for fname, fdef in wrp_cls._cls.__fields__.items():
+            if fname == 'id':
+                continue
+            if typing.get_origin(fdef.outer_type_) == DataRef:
+                columns.append((inflection.camelize(fname), 'int'))
+            else:
+                columns.append((inflection.camelize(fname), self.get_cs_type(fdef.outer_type_)))
+        return columns
+
     def _emit_db_model(self, wrp_cls):
-        s = f"""//
+        columns = self.get_db_model_columns(wrp_cls)
+        s = CodeWriter(f"""//
 using System;
 using System.ComponentModel;
 using System.ComponentModel.DataAnnotations;
@@ -723,6 +1760,15 @@ using AlienCell.Server.Db;
 namespace {self.namespace}.Server.Db.Models
 {{
 
+[Flags]
+public enum {wrp_cls.var_name_camel}Fields : uint
+{{
+    None = 0,
+""")
+        for ii, (col_name, col_type) in enumerate(columns):
+            s += f"    {col_name} = {1 << ii},\n"
+        s += f"""}}
+
 [MessagePack.MessagePackObject(true)]
 [Table("{wrp_cls.var_name_plural}")]
 public class {wrp_cls.var_name_camel} : IModel<Ulid>
@@ -730,17 +1776,25 @@ public class {wrp_cls.var_name_camel} : IModel<Ulid>
     [Key]
     public Ulid Id {{ get; set; }} = Ulid.NewUlid();
 
-    public Ulid UserId {{ get; set; }}
+    // columns written since the last load or commit
+    [NotMapped, MessagePack.IgnoreMember]
+    public {wrp_cls.var_name_camel}Fields DirtyFields {{ get; set; }}
 
 """
-        for fname, fdef in wrp_cls._cls.__fields__.items():
-            if fname == 'id':
-                continue
-            t_origin = typing.get_origin(fdef.outer_type_)
-            if t_origin == DataRef:
-                s += f"    public int {inflection.camelize(fname)} {{ get; set; }}\n"
-            else:
-                s += f"    public {self.get_cs_type(fdef.outer_type_)} {inflection.camelize(fname)} {{ get; set; }}\n"
+        for col_name, col_type in columns:
+            field_name = '_' + inflection.camelize(col_name, False)
+            s += f"    private {col_type} {field_name};\n"
+            s += f"    public {col_type} {col_name} {{ get => {field_name}; " \
+                 f"set {{ {field_name} = value; DirtyFields |= {wrp_cls.var_name_camel}Fields.{col_name}; }} }}\n"
+            if col_name == 'UserId':
+                s += "\n"
+        s += f"""
+    public {wrp_cls.var_name_camel} ClearDirty()
+    {{
+        DirtyFields = {wrp_cls.var_name_camel}Fields.None;
+        return this;
+    }}
+"""
         #
         s += "}\n\n}"
         out_path = Path(self._server_out_dir)\
@@ -750,7 +1804,7 @@ public class {wrp_cls.var_name_camel} : IModel<Ulid>
         self.write_file(out_path, s)
 
     def _emit_idb_context(self):
-        s = f"""//
+        s = CodeWriter(f"""//
 using MicroOrm.Dapper.Repositories;
 using MicroOrm.Dapper.Repositories.DbContext;
 
@@ -763,7 +1817,7 @@ public partial interface IDbContext
 {{
     IDapperRepository<UserModel> Users {{ get; }}
     IDapperRepository<UserInventoryModel> UserInventory {{ get; }}
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += f"    IDapperRepository<{wrp_cls.var_name_camel}> {wrp_cls.entity_name_plural} {{ get; }}\n"
         s += "}\n\n}"
@@ -772,60 +1826,176 @@ public partial interface IDbContext
             .joinpath(f'IDbContext.cs')
         self.write_file(out_path, s)
 
-    def _emit_accounts_table_create_sql(self):
-        s = f"CREATE TABLE IF NOT EXISTS `accounts` ("
-        s += " `Id` varbinary(16) not null,"
-        s += " `Address` varchar(40) not null default '',"
-        s += " `DeviceUId` varchar(255) not null default '',"
-        #
-        s += " `Name` varchar(127) not null default '',"
-        s += " `Email` varchar(255) not null default '',"
-        s += " `Phone` varchar(15) not null default '',"
-        #
-        s += " `PasswordHash` varbinary(32) default null,"
-        #
-        s += " `EKS` text not null default '',"
-        s += " `EKSHash` varbinary(32) default null,"
-        #
-        s += " `CreatedAt` timestamp not null default CURRENT_TIMESTAMP,"
-        s += " `UpdatedAt` timestamp not null default CURRENT_TIMESTAMP,"
+    def get_accounts_table(self):
+        return dict(columns=[
+            ('Id', "varbinary(16) not null"),
+            ('Address', "varchar(40) not null default ''"),
+            ('DeviceUId', "varchar(255) not null default ''"),
+            #
+            ('Name', "varchar(127) not null default ''"),
+            ('Email', "varchar(255) not null default ''"),
+            ('Phone', "varchar(15) not null default ''"),
+            #
+            ('PasswordHash', "varbinary(32) default null"),
+            #
+            ('EKS', "text not null default ''"),
+            ('EKSHash', "varbinary(32) default null"),
+            #
+            ('CreatedAt', "timestamp not null default CURRENT_TIMESTAMP"),
+            ('UpdatedAt', "timestamp not null default CURRENT_TIMESTAMP"),
+        ], primary_key=['Id'], indexes=[('Address_Idx', ['Address'])])
+
+    def get_users_table(self):
+        return dict(columns=[
+            ('Id', "varbinary(16) not null"),
+            ('AccountId', "varbinary(16) not null"),
+            ('Exp', "BIGINT not null default 0"),
+            ('Level', "INT not null default 0"),
+        ], primary_key=['Id'], indexes=[])
+
+    def get_user_inventory_table(self):
+        item_count = max([len(BaseData.instances(wrp_cls._cls)) for wrp_cls in self._data_classes
+                          if wrp_cls._cls.is_erc1155()] or [0])
+        return dict(columns=[
+            ('UserId', "varbinary(16) not null"),
+            ('Type', f"{self.get_sql_int_type(max([code for code, _ in self.get_inventory_item_types()] or [0]))} not null"),
+            ('ItemId', f"{self.get_sql_int_type(item_count)} not null default 0"),
+            ('Amount', "INT not null default 0"),
+        ], primary_key=['UserId', 'Type', 'ItemId'], indexes=[('UserId_Idx', ['UserId'])])
+
+    def get_nft_table(self, wrp_cls):
+        columns = [('Id', "varbinary(16) not null"), ('UserId', "varbinary(16) not null")]
+        for fname, fdef in wrp_cls._cls.__fields__.items():
+            if fname == 'id':
+                continue
+            columns.append((inflection.camelize(fname), f"{self.get_sql_column_type(fdef.outer_type_)} not null"))
+        indexes = [(f"{'_'.join(idx_columns)}_Idx", list(idx_columns))
+                   for idx_columns in self.get_table_indexes(wrp_cls)]
+        return dict(columns=columns, primary_key=['Id'], indexes=indexes)
+
+    def get_db_tables(self):
+        tables = {
+            'schema_version': dict(columns=[
+                ('Id', "tinyint unsigned not null"),
+                ('Version', "int not null"),
+            ], primary_key=['Id'], indexes=[]),
+            'accounts': self.get_accounts_table(),
+            'user_models': self.get_users_table(),
+            'user_inventory': self.get_user_inventory_table(),
+        }
+        for wrp_cls in self._erc721_classes:
+            tables[wrp_cls.var_name_plural] = self.get_nft_table(wrp_cls)
+        return tables
+
+    def get_baseline_db_tables(self):
+        # the schema InitDb created before migrations existed
+        tables = {
+            'accounts': self.get_accounts_table(),
+            'user_models': self.get_users_table(),
+            'user_inventory': dict(columns=[
+                ('UserId', "varbinary(16) not null"),
+                ('Type', "varchar(255) not null"),
+                ('ItemId', "INT not null default 0"),
+                ('Amount', "INT not null default 0"),
+            ], primary_key=['UserId', 'Type', 'ItemId'], indexes=[('UserId_Idx', ['UserId'])]),
+        }
+        for wrp_cls in self._erc721_classes:
+            columns = [('Id', "varbinary(16) not null"), ('UserId', "varbinary(16) not null")]
+            for fname, fdef in wrp_cls._cls.__fields__.items():
+                if fname == 'id':
+                    continue
+                sql_type = "bigint" if fdef.outer_type_ == cs_ulong else self.get_sql_type(fdef.outer_type_)
+                columns.append((inflection.camelize(fname), f"{sql_type} not null"))
+            tables[wrp_cls.var_name_plural] = dict(columns=columns, primary_key=['Id'], indexes=[])
+        return tables
+
+    def get_table_indexes(self, wrp_cls):
+        # user loads filter by UserId, lookups narrow further by the referenced data
+        indexes = [('UserId', inflection.camelize(fname))
+                   for fname, fdef in wrp_cls._cls.__fields__.items()
+                   if typing.get_origin(fdef.outer_type_) == DataRef]
+        indexes.append(('UserId',))
+        for columns in wrp_cls._cls._indexes or []:
+            indexes.append(tuple(inflection.camelize(c) for c in columns))
+        res = []
+        for columns in indexes:
+            # an index on a column prefix of another one is redundant
+            if columns in res or any(len(other) > len(columns) and other[:len(columns)] == columns
+                                     for other in indexes):
+                continue
+            res.append(columns)
+        return res
+
+    def _emit_inventory_item_types(self):
+        s = CodeWriter(f"""//
+using System;
+
+namespace {self.namespace}.Server.Db
+{{
+
+// user_inventory stores item types as these codes
+public static class InventoryItemTypes
+{{
+""")
+        item_types = self.get_inventory_item_types()
+        for code, item_type in item_types:
+            s += f"    public const byte {inflection.camelize(item_type)} = {code};\n"
+        s += f"""
+    public static byte ToCode(string type) => type switch
+    {{
+"""
+        for code, item_type in item_types:
+            s += f"        \"{item_type}\" => {inflection.camelize(item_type)},\n"
+        s += f"""        _ => throw new ArgumentOutOfRangeException(nameof(type), type, null)
+    }};
+}}
+
+}}"""
+        out_path = Path(self._server_out_dir) \
+            .joinpath("Db") \
+            .joinpath('InventoryItemTypes.cs')
+        self.write_file(out_path, s)
+
+    def _emit_schema_migrations(self):
+        out_dir = Path(self._server_out_dir).joinpath('Db').joinpath('Migrations')
+        snapshot = self.get_schema_snapshot()
+        snapshot.update(self.get_db_tables(), convert=self.convert_column)
+        for i, statements in enumerate(snapshot.migrations):
+            s = CodeWriter(f"""//
+namespace {self.namespace}.Server.Db
+{{
+
+public static partial class SchemaMigrations
+{{
+    private static string[] V{i + 1}() => new[]
+    {{
+""")
+            for sql in statements:
+                assert '"' not in sql and '\\' not in sql, f"can't embed {sql}"
+                s += f"        \"{sql}\",\n"
+            s += "    };\n}\n\n}"
+            self.write_file(out_dir.joinpath(f'Migration{i + 1:04}.cs'), s)
         #
-        s += " INDEX `Address_Idx` (`Address`),"
-        s += " PRIMARY KEY (`Id`));"
-        return s
+        steps_s = ", ".join(f"V{i + 1}()" for i in range(snapshot.version))
+        s = CodeWriter(f"""//
+namespace {self.namespace}.Server.Db
+{{
 
-    def _emit_users_table_create_sql(self):
-        s = f"CREATE TABLE IF NOT EXISTS `user_models` ("
-        s += " `Id` varbinary(16) not null,"
-        s += " `AccountId` varbinary(16) not null,"
-        s += " `Exp` BIGINT not null default 0,"
-        s += " `Level` INT not null default 0,"
-        s += " PRIMARY KEY (`Id`));"
-        return s
+public static partial class SchemaMigrations
+{{
+    public const int Version = {snapshot.version};
 
-    def _emit_user_inventory_table_create_sql(self):
-        s = f"CREATE TABLE IF NOT EXISTS `user_inventory` ("
-        s += " `UserId` varbinary(16) not null,"
-        s += " `Type` varchar(255) not null,"
-        s += " `ItemId` INT not null default 0,"
-        s += " `Amount` INT not null default 0,"
-        s += " PRIMARY KEY `Pk_UserId_Type_ItemId` (`UserId`, `Type`, `ItemId`),"
-        s += " INDEX `UserId_Idx` (`UserId`)"
-        s += ");"
-        return s
+    // Steps[i] upgrades a database from version i to i + 1
+    public static readonly string[][] Steps = {{ {steps_s} }};
+}}
 
-    def _emit_table_create_sql(self, wrp_cls):
-        s = f"CREATE TABLE IF NOT EXISTS `{wrp_cls.var_name_plural}` (`Id` varbinary(16) not null,"
-        s += " `UserId` varbinary(16) not null,"
-        for fname, fdef in wrp_cls._cls.__fields__.items():
-            if fname == 'id':
-                continue
-            s += f" `{inflection.camelize(fname)}` {self.get_sql_type(fdef.outer_type_)} not null,"
-        s += " PRIMARY KEY (`Id`));"
-        return s
+}}""")
+        self.write_file(out_dir.joinpath('SchemaMigrations.cs'), s)
+        self.write_file(self.get_schema_snapshot_path(), snapshot.dumps())
 
     def _emit_db_context(self):
-        s = f"""//
+        s = CodeWriter(f"""//
+using System.Data.Common;
 using Dapper;
 using MicroOrm.Dapper.Repositories;
 using MicroOrm.Dapper.Repositories.DbContext;
@@ -839,15 +2009,33 @@ namespace {self.namespace}.Server.Db
 public partial class DbContext
 {{
 
+    private int ReadSchemaVersion()
+    {{
+        try
+        {{
+            return Connection.ExecuteScalar<int?>("SELECT `Version` FROM `schema_version` WHERE `Id` = 1;") ?? 0;
+        }}
+        catch (DbException e) when (e.SqlState == "42S02")
+        {{
+            // MySQL error 1146, a fresh database where the first migration creates schema_version;
+            // anything else must not replay the migrations
+            return 0;
+        }}
+    }}
+
     private void InitDb()
     {{
-        Connection.Execute(\"{self._emit_accounts_table_create_sql()}\");
-        Connection.Execute(\"{self._emit_users_table_create_sql()}\");
-        Connection.Execute(\"{self._emit_user_inventory_table_create_sql()}\");
-"""
-        for wrp_cls in self._erc721_classes:
-            s += f"        Connection.Execute(\"{self._emit_table_create_sql(wrp_cls)}\");\n"
-        s += "    }\n\n"
+        for (var version = ReadSchemaVersion(); version < SchemaMigrations.Version; version++)
+        {{
+            foreach (var sql in SchemaMigrations.Steps[version])
+            {{
+                Connection.Execute(sql);
+            }}
+            Connection.Execute("REPLACE INTO `schema_version` (`Id`, `Version`) VALUES (1, @Version);", new {{ Version = version + 1 }});
+        }}
+    }}
+
+""")
         #
         s += f"    private IDapperRepository<UserModel> _user_models;\n"
         s += f"    private IDapperRepository<UserInventoryModel> _user_inventory_models;\n"
@@ -878,7 +2066,7 @@ public partial class DbContext
             self._emit_model_event(wrp_cls)
 
     def _emit_model_event(self, wrp_cls):
-        s = f"""
+        s = CodeWriter(f"""
 namespace {self.namespace}.Generated.Events
 {{
 
@@ -889,7 +2077,7 @@ public class {wrp_cls.entity_name}AddedEvent
 public class {wrp_cls.entity_name}RetiredEvent
 {{
 }}
-"""
+""")
         if issubclass(wrp_cls._cls, UpgradeableWithExp):
             s += f"""
 public class {wrp_cls.entity_name}LevelUpEvent
@@ -909,7 +2097,7 @@ public class {wrp_cls.entity_name}ExpChangeEvent
         self.write_file(out_path, s)
 
     def _emit_ievent_hub(self):
-        s = f"""//
+        s = CodeWriter(f"""//
 using MessagePipe;
 
 namespace {self.namespace}.Generated.Events
@@ -917,7 +2105,7 @@ namespace {self.namespace}.Generated.Events
 
 public interface IEventHubSub
 {{
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += f"    ISubscriber<{wrp_cls.entity_name}AddedEvent> {wrp_cls.entity_name}AddedSub {{ get; }}\n"
             s += f"    ISubscriber<{wrp_cls.entity_name}RetiredEvent> {wrp_cls.entity_name}RetiredSub {{ get; }}\n"
@@ -949,7 +2137,7 @@ public interface IEventHubPub
         self.write_file(out_path, s)
 
     def _emit_event_hub(self):
-        s = f"""//
+        s = CodeWriter(f"""//
 using MessagePipe;
 
 namespace {self.namespace}.Generated.Events
@@ -960,7 +2148,7 @@ public class EventHub : IEventHubPub, IEventHubSub
 
     public EventHub (EventFactory eventFactory)
     {{
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += f"        (_{wrp_cls.entity_name_us}_added_pub, _{wrp_cls.entity_name_us}_added_sub) = eventFactory.CreateEvent<{wrp_cls.entity_name}AddedEvent>();\n"
             s += f"        (_{wrp_cls.entity_name_us}_retired_pub, _{wrp_cls.entity_name_us}_retired_sub) = eventFactory.CreateEvent<{wrp_cls.entity_name}RetiredEvent>();\n"
@@ -1010,16 +2198,22 @@ public class EventHub : IEventHubPub, IEventHubSub
             self._emit_model_iservice(wrp_cls)
 
     def _emit_model_iservice(self, wrp_cls):
-        s = f"""//
+        s = CodeWriter(f"""//
+using System;
+using System.Collections.Generic;
 using MagicOnion;
 
+using {self.namespace}.Shared.Protocol.Models;
+
 namespace {self.namespace}.Shared.Services
 {{
 
 public partial interface IGameService
 {{
     public UnaryResult<int> Retire{wrp_cls.entity_name}(long id);
-"""
+""")
+        if issubclass(wrp_cls._cls, UpgradeableWithExp):
+            s += f"    public UnaryResult<UserModelDelta> Upgrade{wrp_cls.entity_name_plural}WithMaterial(Ulid userId, List<Ulid> ids, List<List<int>> matIds, List<List<ulong>> amounts);\n"
         s += "}\n"
         # namespace end
         s += "\n}"
@@ -1033,10 +2227,14 @@ public partial interface IGameService
             self._emit_model_service(wrp_cls)
 
     def _emit_model_service(self, wrp_cls):
-        s = f"""//
+        s = CodeWriter(f"""//
+using System;
+using System.Collections.Generic;
+using System.Collections.Immutable;
 using MagicOnion;
 
 using {self.namespace}.Shared.Services;
+using {self.namespace}.Shared.Protocol.Models;
 using {self.namespace}.Server.Db.Models;
 
 
@@ -1050,47 +2248,125 @@ public partial class GameService
         await Task.Delay(0);
         return 0;
     }}
-"""
+""")
         if issubclass(wrp_cls._cls, UpgradeableWithExp):
             item_type_s = f"{wrp_cls.entity_name_us}_upgrade_material"
 
+            entity = wrp_cls.entity_name
+            model = f"{entity}Model"
+            var = wrp_cls.var_name
             s += f"""
-    private bool UpgradeWithMaterial(UserModel user, {wrp_cls.entity_name}Model {wrp_cls.var_name}, List<int> matIds, List<ulong> amounts)
+    // sums the requested materials per id and the exp they grant, rejecting unknown ids
+    private static bool Sum{entity}Materials(Span<ulong> totals, ImmutableArray<ulong> matExp, List<int> matIds, List<ulong> amounts, out ulong addExp)
     {{
+        addExp = 0;
+        if (matIds.Count != amounts.Count)
+        {{
+            return false;
+        }}
         for (int i = 0; i < matIds.Count; i++)
         {{
-            if (!this.Users.HasItems(user, \"{item_type_s}\", matIds[i], amounts[i]))
+            var matId = matIds[i];
+            if ((uint)matId >= (uint)matExp.Length)
             {{
                 return false;
             }}
+            totals[matId] += amounts[i];
+            addExp += matExp[matId] * amounts[i];
         }}
+        return true;
+    }}
 
-        for (int i = 0; i < matIds.Count; i++)
+    // every material is checked before any is consumed, so a failed upgrade leaves the inventory untouched
+    private bool TryUse{entity}Materials(UserModel user, Span<ulong> totals)
+    {{
+        for (int matId = 0; matId < totals.Length; matId++)
         {{
-            var (success, itemsLeft) = this.Users.UseItems(user, \"{item_type_s}\", matIds[i], amounts[i]);
-            if (!success)
+            if (totals[matId] != 0 && !this.Users.HasItems(user, \"{item_type_s}\", matId, totals[matId]))
             {{
                 return false;
             }}
         }}
-
-        ulong addExp = 0;
-        for (int i = 0; i < matIds.Count; i++)
+        for (int matId = 0; matId < totals.Length; matId++)
         {{
-            var matData = _gd.Db.{wrp_cls.entity_name}UpgradeMaterialDataTable.FindById(matIds[i]);
-            addExp += matData.Value * amounts[i];
+            if (totals[matId] != 0 && !this.Users.UseItems(user, \"{item_type_s}\", matId, totals[matId]).Item1)
+            {{
+                return false;
+            }}
         }}
+        return true;
+    }}
 
-        var {wrp_cls.entity_name_us}_data = _gd.Get{wrp_cls.entity_name}Data({wrp_cls.var_name}.Data);
-        var {wrp_cls.entity_name_us}_ladder_data = _gd.Get{wrp_cls.entity_name}LadderData((int){wrp_cls.entity_name_us}_data.Ladder);
-    
-        {wrp_cls.var_name}.Exp += addExp;
-        var (newLevel, newExp) = {wrp_cls.entity_name_us}_ladder_data.GetLevel({wrp_cls.var_name}.Level, {wrp_cls.var_name}.Exp);
-        {wrp_cls.var_name}.Level = newLevel;
-        {wrp_cls.var_name}.Exp = newExp;
+    private void Add{entity}Exp({model} {var}, ulong addExp)
+    {{
+        var {wrp_cls.entity_name_us}_data = _gd.Get{entity}Data({var}.Data);
+        var {wrp_cls.entity_name_us}_ladder_data = _gd.Get{entity}LadderData((int){wrp_cls.entity_name_us}_data.Ladder);
+
+        var (newLevel, newExp) = {wrp_cls.entity_name_us}_ladder_data.GetLevel({var}.Level, {var}.Exp + addExp);
+        {var}.Level = newLevel;
+        {var}.Exp = newExp;
+    }}
 
+    private bool UpgradeWithMaterial(UserModel user, {model} {var}, List<int> matIds, List<ulong> amounts)
+    {{
+        var matExp = _gd.{entity}UpgradeMaterialExp;
+        Span<ulong> totals = matExp.Length <= 256 ? stackalloc ulong[matExp.Length] : new ulong[matExp.Length];
+        if (!Sum{entity}Materials(totals, matExp, matIds, amounts, out var addExp) || !TryUse{entity}Materials(user, totals))
+        {{
+            return false;
+        }}
+        Add{entity}Exp({var}, addExp);
         return true;
     }}
+
+    // upgrades every model in one go, materials are checked and consumed once for the whole batch
+    private bool UpgradeWithMaterial(UserModel user, IReadOnlyList<{model}> {wrp_cls.var_name_plural}, IReadOnlyList<List<int>> matIds, IReadOnlyList<List<ulong>> amounts)
+    {{
+        var count = {wrp_cls.var_name_plural}.Count;
+        if (matIds.Count != count || amounts.Count != count)
+        {{
+            return false;
+        }}
+        var matExp = _gd.{entity}UpgradeMaterialExp;
+        Span<ulong> totals = matExp.Length <= 256 ? stackalloc ulong[matExp.Length] : new ulong[matExp.Length];
+        Span<ulong> addExps = count <= 64 ? stackalloc ulong[count] : new ulong[count];
+        for (int i = 0; i < count; i++)
+        {{
+            if (!Sum{entity}Materials(totals, matExp, matIds[i], amounts[i], out addExps[i]))
+            {{
+                return false;
+            }}
+        }}
+        if (!TryUse{entity}Materials(user, totals))
+        {{
+            return false;
+        }}
+        for (int i = 0; i < count; i++)
+        {{
+            Add{entity}Exp({wrp_cls.var_name_plural}[i], addExps[i]);
+        }}
+        return true;
+    }}
+
+    // null when an id is not owned by the user or the materials do not cover the batch
+    public async UnaryResult<UserModelDelta> Upgrade{wrp_cls.entity_name_plural}WithMaterial(Ulid userId, List<Ulid> ids, List<List<int>> matIds, List<List<ulong>> amounts)
+    {{
+        var user = await this.Users.GetAsync(userId);
+        var {wrp_cls.var_name_plural} = new List<{model}>(ids.Count);
+        foreach (var id in ids)
+        {{
+            if (!user.{wrp_cls.entity_name_plural}.TryGetValue(id, out var {var}))
+            {{
+                return null;
+            }}
+            {wrp_cls.var_name_plural}.Add({var});
+        }}
+        if (!UpgradeWithMaterial(user, {wrp_cls.var_name_plural}, matIds, amounts))
+        {{
+            return null;
+        }}
+        return await this.Users.CommitChangesWithDelta(user);
+    }}
 """
         s += "}\n\n}"
         out_path = Path(self._server_out_dir) \
@@ -1103,7 +2379,7 @@ public partial class GameService
             self._emit_model_cheat_service(wrp_cls)
 
     def _emit_model_cheat_service(self, wrp_cls):
-        s = f"""//
+        s = CodeWriter(f"""//
 using System;
 using MagicOnion;
 
@@ -1125,7 +2401,7 @@ public partial class CheatService
         _userRepo.AddToUser(user, {wrp_cls.var_name});
         return {wrp_cls.var_name}.Id;
     }}
-"""
+""")
         s += "}\n"
         # namespace end
         s += "\n}"
@@ -1140,7 +2416,7 @@ public partial class CheatService
             self._emit_model_icheat_service(wrp_cls)
 
     def _emit_model_icheat_service(self, wrp_cls):
-        s = f"""//
+        s = CodeWriter(f"""//
 using System;
 using MagicOnion;
 
@@ -1150,7 +2426,7 @@ namespace {self.namespace}.Shared.Services
 public partial interface ICheatService
 {{
     public UnaryResult<Ulid> Add{wrp_cls.entity_name}(Ulid userId, int dataId);
-"""
+""")
         s += "}\n"
         # namespace end
         s += "\n}"
@@ -1162,7 +2438,7 @@ public partial interface ICheatService
 
 
     def _emit_cost_processor(self):
-        s = f"""// Generated/Costs/CostProcessor.cs
+        s = CodeWriter(f"""// Generated/Costs/CostProcessor.cs
 using {self.namespace}.Shared.Structs;
 
 
@@ -1170,7 +2446,7 @@ namespace {self.namespace}.Server.Services
 {{
     public partial class CostProcessor
     {{
-"""
+""")
         for wrp_cls in self._erc721_classes:
             s += f"""
         public void Visit(Cost{wrp_cls.entity_name} cost)
@@ -1187,7 +2463,10 @@ namespace {self.namespace}.Server.Services
         self.write_file(out_path, s)
 
     def _emit_reward_giver(self):
-        s = f"""// Generated/Rewards/RewardGiver.cs
+        s = CodeWriter(f"""// Generated/Rewards/RewardGiver.cs
+using System;
+using System.Collections.Generic;
+
 using {self.namespace}.Shared.Structs;
 using {self.namespace}.Server.Db.Models;
 
@@ -1196,25 +2475,40 @@ namespace {self.namespace}.Server.Services
 {{
     public partial class RewardGiver
     {{
-"""
-        for wrp_cls in self._erc721_classes:
-            if wrp_cls.entity_name == 'Building':
-                continue #FIXME
+""")
+        reward_classes = [wrp_cls for wrp_cls in self._erc721_classes if wrp_cls.entity_name != 'Building'] #FIXME
+        reward_structs = {ch_cls.__name__: p_cls for ch_cls, p_cls in self._poly_bases.items()}
+        # the batched Visit takes the one base every Reward{Entity} struct derives from
+        reward_bases = {reward_structs[f"Reward{wrp_cls.entity_name}"] for wrp_cls in reward_classes
+                        if f"Reward{wrp_cls.entity_name}" in reward_structs}
+        if len(reward_bases) > 1:
+            raise SchemaError(f"Reward structs derive from more than one base: "
+                              f"{', '.join(sorted(cls.__name__ for cls in reward_bases))}")
+        for wrp_cls in reward_classes:
             s += f"""
-        public void Visit(Reward{wrp_cls.entity_name} reward)
+        private static void Create{wrp_cls.entity_name_plural}(Reward{wrp_cls.entity_name} reward, {wrp_cls.var_name_camel}[] {wrp_cls.var_name_plural}, ref int offset)
         {{
             for (int i = 0; i < reward.Amount; i++)
             {{
-                var {wrp_cls.var_name} = new {wrp_cls.var_name_camel}() 
+                {wrp_cls.var_name_plural}[offset++] = new {wrp_cls.var_name_camel}() 
                 {{
                     Data = (int)reward.{wrp_cls.entity_name}
                 }};
-                this._userRepo.AddToUser(this._user, {wrp_cls.var_name});
             }}
         }}
+
+        public void Visit(Reward{wrp_cls.entity_name} reward)
+        {{
+            // a negative amount grants nothing
+            var {wrp_cls.var_name_plural} = new {wrp_cls.var_name_camel}[Math.Max(reward.Amount, 0)];
+            var offset = 0;
+            Create{wrp_cls.entity_name_plural}(reward, {wrp_cls.var_name_plural}, ref offset);
+            this._userRepo.AddToUser(this._user, {wrp_cls.var_name_plural});
+        }}
 """
-        s += """
-    }
+        if reward_bases:
+            self._emit_reward_giver_batch(s, reward_classes, self.wrap(reward_bases.pop()).var_name_camel)
+        s += """    }
 }
 """
         out_path = Path(self._server_out_dir) \
@@ -1222,8 +2516,275 @@ namespace {self.namespace}.Server.Services
             .joinpath("RewardGiver.cs")
         self.write_file(out_path, s)
 
+    def _emit_reward_giver_batch(self, s, reward_classes, reward_base):
+        s += f"""
+        // models are counted first, so each type is allocated in one array and passed to AddToUser once;
+        // the change set still records the models one by one
+        public void Visit(IReadOnlyList<{reward_base}> rewards)
+        {{
+"""
+        for wrp_cls in reward_classes:
+            s += f"            int {inflection.camelize(wrp_cls.entity_name_us, False)}Count = 0;\n"
+        s += """            for (int i = 0; i < rewards.Count; i++)
+            {
+                switch (rewards[i])
+                {
+"""
+        for wrp_cls in reward_classes:
+            s += f"""                    case Reward{wrp_cls.entity_name} reward:
+                        {inflection.camelize(wrp_cls.entity_name_us, False)}Count += Math.Max(reward.Amount, 0);
+                        break;
+"""
+        s += """                    default:
+                        rewards[i].Accept(this);
+                        break;
+                }
+            }
+"""
+        for wrp_cls in reward_classes:
+            s += f"""
+            var {wrp_cls.var_name_plural} = new {wrp_cls.var_name_camel}[{inflection.camelize(wrp_cls.entity_name_us, False)}Count];
+            var {inflection.camelize(wrp_cls.entity_name_us, False)}Offset = 0;"""
+        s += """
+            for (int i = 0; i < rewards.Count; i++)
+            {
+                switch (rewards[i])
+                {
+"""
+        for wrp_cls in reward_classes:
+            s += f"""                    case Reward{wrp_cls.entity_name} reward:
+                        Create{wrp_cls.entity_name_plural}(reward, {wrp_cls.var_name_plural}, ref {inflection.camelize(wrp_cls.entity_name_us, False)}Offset);
+                        break;
+"""
+        s += """                }
+            }
+"""
+        for wrp_cls in reward_classes:
+            s += f"""
+            if ({wrp_cls.var_name_plural}.Length > 0)
+            {{
+                this._userRepo.AddToUser(this._user, {wrp_cls.var_name_plural});
+            }}"""
+        s += """
+        }
+"""
+
+    def _emit_dto_mapper(self, cls, model_name, dto_name, nft):
+        s = CodeWriter(f"""
+    public static {dto_name} ToDTO(this {model_name} model)
+    {{
+        return new {dto_name}
+        {{
+""")
+        for fname, prop_name, cs_type in self.get_dto_fields(cls):
+            el_wrp_cls = self.get_dto_nft_list(cls, fname)
+            if el_wrp_cls is not None:
+                s += f"            {prop_name} = model.{el_wrp_cls.entity_name_plural}.ToDTOList(),\n"
+            elif nft:
+                s += f"            {prop_name} = model.{prop_name},\n"
+            else:
+                # hand-written models may use wider column types, an out of range value throws instead of wrapping
+                s += f"            {prop_name} = checked(({cs_type})model.{prop_name}),\n"
+        s += f"""        }};
+    }}
+
+    public static {model_name} ToModel(this {dto_name} dto)
+    {{
+        return new {model_name}
+        {{
+"""
+        for fname, prop_name, cs_type in self.get_dto_fields(cls):
+            el_wrp_cls = self.get_dto_nft_list(cls, fname)
+            if el_wrp_cls is not None:
+                s += f"            {el_wrp_cls.entity_name_plural} = dto.{prop_name}.ToModelDictionary(),\n"
+            else:
+                s += f"            {prop_name} = dto.{prop_name},\n"
+        # the initializer goes through the tracked setters, a model built from a DTO starts clean
+        s += "        }.ClearDirty();\n" if nft else "        };\n"
+        s += "    }\n"
+        if not nft:
+            return s
+        s += f"""
+    public static List<{dto_name}> ToDTOList(this Dictionary<Ulid, {model_name}> models)
+    {{
+        if (models is null)
+        {{
+            return null;
+        }}
+        var res = new List<{dto_name}>(models.Count);
+        foreach (var model in models.Values)
+        {{
+            res.Add(model.ToDTO());
+        }}
+        return res;
+    }}
+
+    public static List<{dto_name}> ToDTOList(this IReadOnlyList<{model_name}> models)
+    {{
+        if (models is null)
+        {{
+            return null;
+        }}
+        var res = new List<{dto_name}>(models.Count);
+        for (int i = 0; i < models.Count; i++)
+        {{
+            res.Add(models[i].ToDTO());
+        }}
+        return res;
+    }}
+
+    public static Dictionary<Ulid, {model_name}> ToModelDictionary(this IReadOnlyList<{dto_name}> dtos)
+    {{
+        if (dtos is null)
+        {{
+            return new Dictionary<Ulid, {model_name}>();
+        }}
+        var res = new Dictionary<Ulid, {model_name}>(dtos.Count);
+        for (int i = 0; i < dtos.Count; i++)
+        {{
+            var model = dtos[i].ToModel();
+            res[model.Id] = model;
+        }}
+        return res;
+    }}
+"""
+        return s
+
+    def _emit_dto_mappers(self):
+        s = CodeWriter(f"""
+using System;
+using System.Collections.Generic;
+
+using {self.namespace}.Server.Db.Models;
+using {self.namespace}.Shared.Protocol.Models;
+
+
+namespace {self.namespace}.Server.Mappings
+{{
+
+public static partial class DtoMappers
+{{""")
+        for wrp_cls in self._erc721_classes:
+            s += self._emit_dto_mapper(wrp_cls._cls, wrp_cls.var_name_camel, f"{wrp_cls.var_name_camel}DTO", True)
+        for wrp_cls in self.get_dto_classes():
+            s += self._emit_dto_mapper(wrp_cls._cls, wrp_cls.var_name_camel, f"{wrp_cls.var_name_camel}DTO", False)
+        s += "}\n\n}"
+        out_path = Path(self._server_out_dir) \
+            .joinpath("Mappings") \
+            .joinpath("DtoMappers.cs")
+        self.write_file(out_path, s)
+
+    def _emit_delta_mapper(self, cls, nft):
+        _wrp_cls = self.wrap(cls)
+        model_name = _wrp_cls.var_name_camel
+        name = f"{model_name}Delta"
+        delta_fields = self.get_delta_fields(cls)
+        s = CodeWriter("")
+        if nft:
+            s += f"""
+    public static {name} ToDelta(this {model_name} model)
+    {{
+        var fields = {name}Fields.None;
+"""
+            for fname, prop_name, cs_type in delta_fields:
+                s += f"""        if ((model.DirtyFields & {model_name}Fields.{prop_name}) != 0)
+        {{
+            fields |= {name}Fields.{prop_name};
+        }}
+"""
+            s += f"""        return new {name}
+        {{
+            Id = model.Id,
+            Fields = fields,
+"""
+            for fname, prop_name, cs_type in delta_fields:
+                s += f"            {prop_name} = model.{prop_name},\n"
+            s += "        };\n    }\n"
+        else:
+            # hand-written models have no dirty flags, so every scalar goes out
+            mask = ' | '.join(f"{name}Fields.{prop_name}" for _, prop_name, _ in delta_fields) or f"{name}Fields.None"
+            s += f"""
+    public static {name} ToDelta(this {model_name} model)
+    {{
+        return new {name}
+        {{
+            Fields = {mask},
+"""
+            for fname, prop_name, cs_type in delta_fields:
+                s += f"            {prop_name} = checked(({cs_type})model.{prop_name}),\n"
+            s += "        };\n    }\n"
+        s += f"""
+    public static void ApplyTo(this {name} delta, {model_name} model)
+    {{
+"""
+        for fname, prop_name, cs_type in delta_fields:
+            s += f"""        if ((delta.Fields & {name}Fields.{prop_name}) != 0)
+        {{
+            model.{prop_name} = delta.{prop_name};
+        }}
+"""
+        for fname, prop_name, cs_type in self.get_dto_fields(cls):
+            el_wrp_cls = self.get_dto_nft_list(cls, fname)
+            if el_wrp_cls is None:
+                continue
+            models = f"model.{el_wrp_cls.entity_name_plural}"
+            s += f"""        if (delta.Removed{prop_name} is not null)
+        {{
+            foreach (var id in delta.Removed{prop_name})
+            {{
+                {models}.Remove(id);
+            }}
+        }}
+        if (delta.Updated{prop_name} is not null)
+        {{
+            foreach (var item in delta.Updated{prop_name})
+            {{
+                if ({models}.TryGetValue(item.Id, out var {el_wrp_cls.entity_name_us}))
+                {{
+                    item.ApplyTo({el_wrp_cls.entity_name_us});
+                }}
+            }}
+        }}
+        if (delta.Added{prop_name} is not null)
+        {{
+            foreach (var item in delta.Added{prop_name})
+            {{
+                {models}[item.Id] = item.ToModel();
+            }}
+        }}
+"""
+        s += "    }\n"
+        return s
+
+    def _emit_delta_mappers(self):
+        s = CodeWriter(f"""
+using System;
+using System.Collections.Generic;
+
+using {self.namespace}.Server.Db.Models;
+using {self.namespace}.Shared.Protocol.Models;
+
+
+namespace {self.namespace}.Server.Mappings
+{{
+
+public static partial class DeltaMappers
+{{""")
+        for wrp_cls in self._erc721_classes:
+            s += self._emit_delta_mapper(wrp_cls._cls, True)
+        for wrp_cls in self.get_dto_classes():
+            s += self._emit_delta_mapper(wrp_cls._cls, False)
+        s += "}\n\n}"
+        out_path = Path(self._server_out_dir) \
+            .joinpath("Mappings") \
+            .joinpath("DeltaMappers.cs")
+        self.write_file(out_path, s)
+
+    def get_dto_classes(self):
+        return [self.wrap(cls) for objs in self._models.values() for cls in objs if cls._dto]
+
     def _emit_dto_auto_map(self):
-        s = f"""
+        s = CodeWriter(f"""
 using AutoMapper;
 
 using {self.namespace}.Server.Db.Models;
@@ -1234,12 +2795,14 @@ namespace {self.namespace}.Server.Mappings
 {{
 public partial class AutoMapping
 {{
+    // existing IMapper callers go through the generated DtoMappers
     private void CreateGeneratedMappings()
     {{
-        CreateMap<UserModel, UserModelDTO>().ReverseMap();
-"""
-        for wrp_cls in self._erc721_classes:
-            s += f"        CreateMap<{wrp_cls.entity_name}Model, {wrp_cls.var_name_camel}DTO>().ReverseMap();\n"
+""")
+        for wrp_cls in self.get_dto_classes() + self._erc721_classes:
+            model_name, dto_name = wrp_cls.var_name_camel, f"{wrp_cls.var_name_camel}DTO"
+            s += f"        CreateMap<{model_name}, {dto_name}>().ConvertUsing(x => x.ToDTO());\n"
+            s += f"        CreateMap<{dto_name}, {model_name}>().ConvertUsing(x => x.ToModel());\n"
         s += """
     }
 """
@@ -1248,10 +2811,30 @@ public partial class AutoMapping
             .joinpath("AutoMappings.cs")
         self.write_file(out_path, s)
 
-    def generate(self):
-        super().generate()
+    def emit(self, classes=None):
+        self._list_blobs = None
+        self._schema_snapshot = None
+        self._game_data_members = None
+        self.assign_msgpack_keys()
+        self.get_game_data_members()
+        super().emit(classes)
+        self._emit_msgpack_keys()
+        if self._data_format == 'binary':
+            self._emit_master_memory_db()
+        else:
+            self._emit_list_blobs()
+        self._emit_ladder_tables()
+        # column types are sized by the data
+        self._emit_schema_migrations()
+        self._emit_db_context()
+        if self._data_format == 'code':
+            self._emit_init_game_data_all()
+        if classes is not None:
+            # per-class data outputs come from emit_code, everything below depends on the schema only
+            return
         self.emit_visitors()
         self.emit_db_models()
+        self._emit_game_data_indexes()
         #
         self._emit_i_db_change_set()
         self._emit_db_change_set()
@@ -1261,7 +2844,7 @@ public partial class AutoMapping
         self._emit_user_repo()
         #
         self._emit_idb_context()
-        self._emit_db_context()
+        self._emit_inventory_item_types()
         self._emit_events()
         self._emit_ievent_hub()
         self._emit_event_hub()
@@ -1271,9 +2854,12 @@ public partial class AutoMapping
         self._emit_icheat_services()
         self._emit_model_cheat_services()
         #
+        self._emit_dto_mappers()
         self._emit_dto_auto_map()
+        self._emit_model_deltas()
+        self._emit_delta_mappers()
         #
-        self._emit_init_game_data_all()
         self._emit_reward_giver()
         #
         self._emit_cost_structs()
+        self._emit_ladder_formula()
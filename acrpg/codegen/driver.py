@@ -0,0 +1,37 @@
+from acrpg.codegen.base import CodeGenBase
+from acrpg.codegen.registry import get_backend
+from acrpg.codegen.schema import Schema
+# built-in backends register themselves on import
+import acrpg.codegen.csharp
+import acrpg.codegen.sol
+
+
+class GenerationDriver(object):
+    def __init__(self, game_data, modules=None, jobs=1):
+        self._game_data = game_data
+        self._schema = Schema(modules or CodeGenBase._modules)
+        self._jobs = jobs
+        self._backends = []
+
+    @property
+    def schema(self):
+        return self._schema
+
+    def add_backend(self, name, namespace, out_dir, **kwargs):
+        kwargs.setdefault('jobs', self._jobs)
+        backend = get_backend(name)(namespace, out_dir, self._game_data, schema=self._schema, **kwargs)
+        self._backends.append((name, backend))
+        return backend
+
+    def set_game_data(self, game_data):
+        self._game_data = game_data
+        for name, backend in self._backends:
+            backend.set_game_data(game_data)
+
+    def generate(self, classes=None):
+        # one shared analysis, consumed by every backend
+        self._schema.analysis
+        stats = {}
+        for name, backend in self._backends:
+            stats[name] = backend.generate(classes)
+        return stats
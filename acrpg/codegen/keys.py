@@ -0,0 +1,58 @@
+import json
+
+
+class KeyManifest(object):
+    # MessagePack [Key(n)] numbers per contract; retired keys are never handed out again
+    def __init__(self, contracts=None):
+        self.contracts = contracts or {}
+
+    @classmethod
+    def load(cls, p):
+        try:
+            with open(str(p)) as f:
+                return cls(json.load(f))
+        except FileNotFoundError:
+            return cls()
+
+    def used(self, name):
+        contract = self.contracts.get(name, {})
+        return set(contract.get('keys', {}).values()) | set(contract.get('retired', {}).values())
+
+    def assign(self, name, props, first=0):
+        contract = self.contracts.setdefault(name, dict(keys={}, retired={}))
+        keys = contract['keys']
+        retired = contract['retired']
+        for prop in list(keys):
+            if prop not in props:
+                retired[prop] = keys.pop(prop)
+        used = self.used(name)
+        for prop in props:
+            if prop in keys:
+                continue
+            if prop in retired and retired[prop] not in keys.values():
+                # a property that comes back keeps its old number
+                keys[prop] = retired.pop(prop)
+                continue
+            key = first
+            while key in used:
+                key += 1
+            keys[prop] = key
+            used.add(key)
+        self.validate(name)
+        return dict(keys)
+
+    def validate(self, name):
+        contract = self.contracts[name]
+        seen = {}
+        for prop, key in list(contract['keys'].items()) + list(contract['retired'].items()):
+            assert key not in seen, f"{name}: key {key} of {prop} is already used by {seen[key]}"
+            seen[key] = prop
+
+    def entries(self, name):
+        # (key, prop) for live and retired props, read straight from the contract so a reused key shows up twice
+        contract = self.contracts.get(name, {})
+        return sorted((key, prop) for prop, key in
+                      list(contract.get('keys', {}).items()) + list(contract.get('retired', {}).items()))
+
+    def dumps(self):
+        return json.dumps(self.contracts, indent=1, sort_keys=True)
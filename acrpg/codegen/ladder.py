@@ -0,0 +1,117 @@
+INT64_MAX = 2**63 - 1
+MIN_FIT_LEVELS = 4
+
+
+class LadderFormula(object):
+    POLYNOMIAL = 1
+    GEOMETRIC = 2
+
+    # polynomial: (a + b*i + c*i*i) / d, geometric: a + b * c**i
+    def __init__(self, kind, a, b, c, d, count):
+        self.kind = kind
+        self.a = a
+        self.b = b
+        self.c = c
+        self.d = d
+        self.count = count
+
+    def __eq__(self, other):
+        return isinstance(other, LadderFormula) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"LadderFormula({self.name}, a={self.a}, b={self.b}, c={self.c}, d={self.d}, count={self.count})"
+
+    @property
+    def key(self):
+        return self.kind, self.a, self.b, self.c, self.d, self.count
+
+    @property
+    def name(self):
+        if self.kind == self.GEOMETRIC:
+            return 'geometric'
+        return 'quadratic' if self.c else 'linear'
+
+    def experience(self, i):
+        if self.kind == self.POLYNOMIAL:
+            return (self.a + self.b * i + self.c * i * i) // self.d
+        return self.a + self.b * self.c ** i
+
+    def total_experience(self, n):
+        if self.kind == self.POLYNOMIAL:
+            return (self.a * n + self.b * (n * (n - 1) // 2) + self.c * ((n - 1) * n * (2 * n - 1) // 6)) // self.d
+        return self.a * n + self.b * ((self.c ** n - 1) // (self.c - 1))
+
+    def _partials(self, n):
+        # every intermediate the generated int64 code computes
+        if self.kind == self.POLYNOMIAL:
+            yield self.b * n
+            yield self.c * n * n
+            yield self.a + self.b * n + self.c * n * n
+            yield self.a * n
+            yield self.b * (n * (n - 1) // 2)
+            yield (n - 1) * n * (2 * n - 1)
+            yield self.c * ((n - 1) * n * (2 * n - 1) // 6)
+            yield self.a * n + self.b * (n * (n - 1) // 2) + self.c * ((n - 1) * n * (2 * n - 1) // 6)
+        else:
+            yield self.c ** n
+            yield self.b * self.c ** n
+            yield self.a * n
+            yield self.b * ((self.c ** n - 1) // (self.c - 1))
+            yield self.a * n + self.b * ((self.c ** n - 1) // (self.c - 1))
+
+    def fits_int64(self):
+        for n in range(self.count + 1):
+            for val in self._partials(n):
+                if abs(val) > INT64_MAX:
+                    return False
+        return True
+
+    def matches(self, exps):
+        if len(exps) != self.count:
+            return False
+        if self.kind == self.POLYNOMIAL:
+            return all(e * self.d == self.a + self.b * i + self.c * i * i for i, e in enumerate(exps))
+        return all(e == self.experience(i) for i, e in enumerate(exps))
+
+
+def _gcd_all(*vals):
+    res = 0
+    for val in vals:
+        while val:
+            res, val = val, res % val
+    return abs(res)
+
+
+def _fit_polynomial(exps):
+    e0, e1, e2 = exps[:3]
+    c = e2 - 2 * e1 + e0
+    b = 2 * (e1 - e0) - c
+    a = 2 * e0
+    div = _gcd_all(a, b, c, 2)
+    return LadderFormula(LadderFormula.POLYNOMIAL, a // div, b // div, c // div, 2 // div, len(exps))
+
+
+def _fit_geometric(exps):
+    e0, e1, e2 = exps[:3]
+    d1, d2 = e1 - e0, e2 - e1
+    if d1 <= 0 or d2 % d1:
+        return None
+    r = d2 // d1
+    if r < 2 or d1 % (r - 1):
+        return None
+    b = d1 // (r - 1)
+    return LadderFormula(LadderFormula.GEOMETRIC, e0 - b, b, r, 1, len(exps))
+
+
+def fit_ladder(exps):
+    exps = [int(e) for e in exps]
+    if len(exps) < MIN_FIT_LEVELS:
+        return None
+    for fit in [_fit_polynomial, _fit_geometric]:
+        formula = fit(exps)
+        if formula is not None and formula.matches(exps) and formula.fits_int64():
+            return formula
+    return None
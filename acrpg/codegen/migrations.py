@@ -0,0 +1,107 @@
+import json
+
+from acrpg.codegen.keys import KeyManifest
+
+
+def _quote(columns):
+    return ', '.join(f"`{c}`" for c in columns)
+
+
+def create_table_sql(name, table):
+    defs = [f"`{cname}` {ddl}" for cname, ddl in table['columns']]
+    defs += [f"INDEX `{iname}` ({_quote(columns)})" for iname, columns in table['indexes']]
+    defs.append(f"PRIMARY KEY ({_quote(table['primary_key'])})")
+    return f"CREATE TABLE IF NOT EXISTS `{name}` ({', '.join(defs)});"
+
+
+def alter_table_sql(name, old, new):
+    # one ALTER per table, so the table is rebuilt at most once
+    clauses = []
+    old_columns = dict(old['columns'])
+    new_columns = dict(new['columns'])
+    old_indexes = {iname: list(columns) for iname, columns in old['indexes']}
+    new_indexes = {iname: list(columns) for iname, columns in new['indexes']}
+    for iname, columns in old_indexes.items():
+        if new_indexes.get(iname) != columns:
+            clauses.append(f"DROP INDEX `{iname}`")
+    prev = None
+    for cname, ddl in new['columns']:
+        if cname not in old_columns:
+            clauses.append(f"ADD COLUMN `{cname}` {ddl} " + (f"AFTER `{prev}`" if prev else "FIRST"))
+        elif old_columns[cname] != ddl:
+            clauses.append(f"MODIFY COLUMN `{cname}` {ddl}")
+        prev = cname
+    for cname in old_columns:
+        if cname not in new_columns:
+            clauses.append(f"DROP COLUMN `{cname}`")
+    if list(old['primary_key']) != list(new['primary_key']):
+        clauses.append(f"DROP PRIMARY KEY, ADD PRIMARY KEY ({_quote(new['primary_key'])})")
+    for iname, columns in new_indexes.items():
+        if old_indexes.get(iname) != columns:
+            clauses.append(f"ADD INDEX `{iname}` ({_quote(columns)})")
+    if not clauses:
+        return None
+    return f"ALTER TABLE `{name}` {', '.join(clauses)};"
+
+
+def diff_schemas(old_tables, new_tables, convert=None):
+    # dropped tables are left in place, their data is not ours to delete;
+    # convert(table, column, old_ddl, new_ddl) may return a data conversion to run before the ALTER
+    statements = []
+    for name, table in new_tables.items():
+        if name not in old_tables:
+            statements.append(create_table_sql(name, table))
+            continue
+        old_columns = dict(old_tables[name]['columns'])
+        for cname, ddl in table['columns']:
+            if convert is not None and cname in old_columns and old_columns[cname] != ddl:
+                sql = convert(name, cname, old_columns[cname], ddl)
+                if sql is not None:
+                    statements.append(sql)
+        sql = alter_table_sql(name, old_tables[name], table)
+        if sql is not None:
+            statements.append(sql)
+    return statements
+
+
+class SchemaSnapshot(object):
+    def __init__(self, tables=None, migrations=None, codes=None):
+        self.tables = tables or {}
+        self.migrations = migrations or []
+        # stored enum codes, they must not move once rows hold them
+        self.codes = KeyManifest(codes)
+
+    @property
+    def version(self):
+        return len(self.migrations)
+
+    @classmethod
+    def load(cls, p, baseline=None):
+        try:
+            with open(str(p)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls.seed(baseline or {})
+        return cls(data['tables'], data['migrations'], data.get('codes'))
+
+    @classmethod
+    def seed(cls, baseline):
+        # the first migration recreates the schema that predates the snapshot, a no-op on databases that have it,
+        # so every later step can ALTER from a known state
+        baseline = json.loads(json.dumps(baseline))
+        if not baseline:
+            return cls()
+        return cls(baseline, [[create_table_sql(name, table) for name, table in baseline.items()]])
+
+    def update(self, tables, convert=None):
+        # normalize tuples so the comparison matches what was read back from json
+        tables = json.loads(json.dumps(tables))
+        statements = diff_schemas(self.tables, tables, convert)
+        if statements:
+            self.migrations.append(statements)
+        self.tables = tables
+        return statements
+
+    def dumps(self):
+        return json.dumps(dict(version=self.version, tables=self.tables, migrations=self.migrations,
+                               codes=self.codes.contracts), indent=1)
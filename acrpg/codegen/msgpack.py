@@ -0,0 +1,148 @@
+import struct
+
+
+def packb(obj):
+    buf = []
+    _pack(obj, buf)
+    return b''.join(buf)
+
+
+def _pack_int(val, buf):
+    if 0 <= val < 0x80:
+        buf.append(struct.pack('B', val))
+    elif -0x20 <= val < 0:
+        buf.append(struct.pack('b', val))
+    elif val >= 0:
+        if val <= 0xff:
+            buf.append(struct.pack('>BB', 0xcc, val))
+        elif val <= 0xffff:
+            buf.append(struct.pack('>BH', 0xcd, val))
+        elif val <= 0xffffffff:
+            buf.append(struct.pack('>BI', 0xce, val))
+        elif val <= 0xffffffffffffffff:
+            buf.append(struct.pack('>BQ', 0xcf, val))
+        else:
+            raise OverflowError(f"Integer {val} does not fit into uint64")
+    else:
+        if val >= -0x80:
+            buf.append(struct.pack('>Bb', 0xd0, val))
+        elif val >= -0x8000:
+            buf.append(struct.pack('>Bh', 0xd1, val))
+        elif val >= -0x80000000:
+            buf.append(struct.pack('>Bi', 0xd2, val))
+        elif val >= -0x8000000000000000:
+            buf.append(struct.pack('>Bq', 0xd3, val))
+        else:
+            raise OverflowError(f"Integer {val} does not fit into int64")
+
+
+def _pack_len(n, buf, fix_tag, fix_max, tags):
+    if fix_tag is not None and n <= fix_max:
+        buf.append(struct.pack('B', fix_tag | n))
+    elif tags[0] is not None and n <= 0xff:
+        buf.append(struct.pack('>BB', tags[0], n))
+    elif n <= 0xffff:
+        buf.append(struct.pack('>BH', tags[1], n))
+    else:
+        buf.append(struct.pack('>BI', tags[2], n))
+
+
+def _pack(obj, buf):
+    if obj is None:
+        buf.append(b'\xc0')
+    elif obj is True:
+        buf.append(b'\xc3')
+    elif obj is False:
+        buf.append(b'\xc2')
+    elif isinstance(obj, int):
+        _pack_int(obj, buf)
+    elif isinstance(obj, float):
+        buf.append(struct.pack('>Bd', 0xcb, obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        _pack_len(len(data), buf, 0xa0, 31, (0xd9, 0xda, 0xdb))
+        buf.append(data)
+    elif isinstance(obj, (bytes, bytearray)):
+        _pack_len(len(obj), buf, None, 0, (0xc4, 0xc5, 0xc6))
+        buf.append(bytes(obj))
+    elif isinstance(obj, (list, tuple)):
+        _pack_len(len(obj), buf, 0x90, 15, (None, 0xdc, 0xdd))
+        for el in obj:
+            _pack(el, buf)
+    elif isinstance(obj, dict):
+        _pack_len(len(obj), buf, 0x80, 15, (None, 0xde, 0xdf))
+        for key, val in obj.items():
+            _pack(key, buf)
+            _pack(val, buf)
+    else:
+        raise TypeError(f"Can't pack {type(obj).__name__}")
+
+
+def unpackb(data):
+    obj, end = unpack_from(data)
+    if end != len(data):
+        raise ValueError(f"{len(data) - end} trailing bytes")
+    return obj
+
+
+def unpack_from(data, pos=0):
+    # the subset packb writes, used to read generated blobs back
+    tag = data[pos]
+    pos += 1
+    if tag < 0x80:
+        return tag, pos
+    elif tag >= 0xe0:
+        return tag - 0x100, pos
+    elif tag & 0xf0 == 0x90:
+        return _unpack_array(data, pos, tag & 0x0f)
+    elif tag & 0xf0 == 0x80:
+        return _unpack_map(data, pos, tag & 0x0f)
+    elif tag & 0xe0 == 0xa0:
+        return data[pos:pos + (tag & 0x1f)].decode('utf-8'), pos + (tag & 0x1f)
+    elif tag in _FIXED:
+        return _FIXED[tag], pos
+    elif tag in _SCALARS:
+        fmt = _SCALARS[tag]
+        return struct.unpack_from(fmt, data, pos)[0], pos + struct.calcsize(fmt)
+    elif tag in _LENGTHS:
+        fmt, kind = _LENGTHS[tag]
+        n = struct.unpack_from(fmt, data, pos)[0]
+        pos += struct.calcsize(fmt)
+        if kind == 'array':
+            return _unpack_array(data, pos, n)
+        elif kind == 'map':
+            return _unpack_map(data, pos, n)
+        elif kind == 'str':
+            return data[pos:pos + n].decode('utf-8'), pos + n
+        return bytes(data[pos:pos + n]), pos + n
+    raise ValueError(f"Unsupported tag 0x{tag:02x}")
+
+
+def _unpack_array(data, pos, n):
+    res = []
+    for _ in range(n):
+        el, pos = unpack_from(data, pos)
+        res.append(el)
+    return res, pos
+
+
+def _unpack_map(data, pos, n):
+    res = {}
+    for _ in range(n):
+        key, pos = unpack_from(data, pos)
+        res[key], pos = unpack_from(data, pos)
+    return res, pos
+
+
+_FIXED = {0xc0: None, 0xc2: False, 0xc3: True}
+_SCALARS = {
+    0xcb: '>d',
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+}
+_LENGTHS = {
+    0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+}
@@ -0,0 +1,128 @@
+import fnmatch
+import hashlib
+import json
+import os
+import pathlib
+
+
+class OutputWriter(object):
+    MANIFEST_NAME = '.acrpg-manifest.json'
+
+    def __init__(self, roots=()):
+        self._roots = []
+        self._manifests = {}
+        self._hashes = {}
+        self._written = 0
+        self._skipped = 0
+        self._deleted = 0
+        self._files = []
+        for root in roots:
+            self.add_root(root)
+
+    @property
+    def stats(self):
+        return dict(written=self._written, skipped=self._skipped, deleted=self._deleted)
+
+    def add_root(self, root):
+        if root is None:
+            return
+        root = pathlib.Path(root).resolve()
+        if root in self._roots:
+            return
+        self._roots.append(root)
+        # deepest root wins when output dirs are nested
+        self._roots.sort(key=lambda r: len(r.parts), reverse=True)
+        self._hashes[root] = {}
+        manifest_path = root.joinpath(self.MANIFEST_NAME)
+        try:
+            with open(str(manifest_path)) as f:
+                self._manifests[root] = json.load(f)
+        except (OSError, ValueError):
+            self._manifests[root] = {}
+
+    def _find_root(self, p: pathlib.Path):
+        for root in self._roots:
+            if root == p or root in p.parents:
+                return root
+        return None
+
+    def write(self, p: pathlib.Path, s: str, statements=None):
+        p = pathlib.Path(p).resolve()
+        content = s if isinstance(s, bytes) else str(s).encode('utf-8')
+        self._files.append((p, len(content), statements))
+        digest = hashlib.sha256(content).hexdigest()
+        root = self._find_root(p)
+        rel_path = p.relative_to(root).as_posix() if root is not None else None
+        # entries are [digest, size, mtime_ns], a file touched since the last run is compared by content
+        entry = self._manifests[root].get(rel_path) if root is not None else None
+        unchanged = isinstance(entry, list) and entry == [digest, *self._stat(p)]
+        written = not (unchanged or self._same_content(p, content))
+        if written:
+            os.makedirs(str(p.parent), exist_ok=True)
+            with open(str(p), 'wb') as f:
+                f.write(content)
+            self._written += 1
+        else:
+            self._skipped += 1
+        if root is not None:
+            self._hashes[root][rel_path] = [digest, *self._stat(p)]
+        return written
+
+    @staticmethod
+    def _stat(p):
+        try:
+            st = os.stat(str(p))
+        except OSError:
+            return [None, None]
+        return [st.st_size, st.st_mtime_ns]
+
+    @staticmethod
+    def _same_size(p, content):
+        try:
+            return os.path.getsize(str(p)) == len(content)
+        except OSError:
+            return False
+
+    @staticmethod
+    def _same_content(p, content):
+        if not OutputWriter._same_size(p, content):
+            return False
+        with open(str(p), 'rb') as f:
+            return f.read() == content
+
+    def finish(self, prune=True, owned=()):
+        # owned: path patterns fully re-emitted by a partial run, stale matches are pruned
+        for root in self._roots:
+            hashes = self._hashes[root]
+            stale = set(self._manifests[root]) - set(hashes)
+            if not prune:
+                stale = {rel_path for rel_path in stale
+                         if any(fnmatch.fnmatch(str(root.joinpath(rel_path)), pattern) for pattern in owned)}
+                hashes = {rel_path: digest for rel_path, digest in dict(self._manifests[root], **hashes).items()
+                          if rel_path not in stale}
+            for rel_path in sorted(stale):
+                self._delete(root, root.joinpath(rel_path))
+            if hashes or self._manifests[root]:
+                os.makedirs(str(root), exist_ok=True)
+                with open(str(root.joinpath(self.MANIFEST_NAME)), 'w') as f:
+                    json.dump(dict(sorted(hashes.items())), f, indent=1)
+            self._manifests[root] = hashes
+            self._hashes[root] = {}
+        stats = dict(self.stats, files=self._files)
+        self._written = self._skipped = self._deleted = 0
+        self._files = []
+        return stats
+
+    def _delete(self, root, p):
+        try:
+            os.remove(str(p))
+        except FileNotFoundError:
+            return
+        self._deleted += 1
+        parent = p.parent
+        while parent != root and root in parent.parents:
+            try:
+                os.rmdir(str(parent))
+            except OSError:
+                break
+            parent = parent.parent
@@ -0,0 +1,18 @@
+_backends = {}
+
+
+def register_backend(name):
+    def decorator(cls):
+        _backends[name] = cls
+        return cls
+    return decorator
+
+
+def get_backend(name):
+    if name not in _backends:
+        raise KeyError(f"Unknown backend '{name}', available: {', '.join(backend_names())}")
+    return _backends[name]
+
+
+def backend_names():
+    return sorted(_backends.keys())
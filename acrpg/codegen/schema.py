@@ -0,0 +1,281 @@
+from collections import defaultdict
+import functools
+import inspect
+import importlib
+import inflection
+import typing
+
+from acrpg.model.base import _BaseModel
+from acrpg.model.data import DataRef, BaseData, GameData
+from acrpg.model.models import DataModel
+
+
+class SchemaError(Exception):
+    pass
+
+
+def memoized_type(fn):
+    key_name = fn.__qualname__
+
+    @functools.wraps(fn)
+    def wrapper(self, ftype, *args, **kwargs):
+        key = (key_name, ftype, args, tuple(sorted(kwargs.items())))
+        cache = self.schema.type_cache
+        try:
+            return cache[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return fn(self, ftype, *args, **kwargs)
+        res = cache[key] = fn(self, ftype, *args, **kwargs)
+        return res
+    return wrapper
+
+
+class Wrapped(object):
+    def __init__(self, cls, schema: 'Schema'):
+        self._cls = cls
+        self._schema = schema
+        self._entity_name = schema.get_entity_name(cls)
+        self._entity_name_plural = inflection.pluralize(self._entity_name)
+        self._entity_name_us = inflection.underscore(self._entity_name)
+        self._var_name = schema.get_class_name_us(cls)
+        self._var_name_camel = inflection.camelize(self._var_name)
+        self._var_name_camel_plural = inflection.pluralize(self._var_name_camel)
+        self._var_name_plural = inflection.pluralize(self._var_name)
+        self._data = None
+
+    def __eq__(self, other):
+        return isinstance(other, Wrapped) and self._cls is other._cls
+
+    def __hash__(self):
+        return hash(self._cls)
+
+    def __repr__(self):
+        return f"Wrapped({self._cls.__name__})"
+
+    @property
+    def data(self):
+        if self._data is None and self._cls.is_erc721():
+            self._data = self._schema.wrap(self._schema.get_data_type_for_model(self._cls))
+        return self._data
+
+    @property
+    def entity_name(self):
+        return self._entity_name
+
+    @property
+    def entity_name_plural(self):
+        return self._entity_name_plural
+
+    @property
+    def entity_name_us(self):
+        return self._entity_name_us
+
+    @property
+    def var_name(self):
+        return self._var_name
+
+    @property
+    def var_name_camel(self):
+        return self._var_name_camel
+
+    @property
+    def var_name_camel_plural(self):
+        return self._var_name_camel_plural
+
+    @property
+    def var_name_plural(self):
+        return self._var_name_plural
+
+
+class ModelAnalysis(object):
+    def __init__(self, schema: 'Schema'):
+        self.data_classes = []
+        self.erc721_classes = []
+        self.poly_structs = defaultdict(list)
+        self.poly_bases = dict()
+        self.emit_tasks = []
+        for mod, objs in schema.models.items():
+            for obj in objs:
+                if obj._abstract:
+                    continue
+                if issubclass(obj, GameData):
+                    continue
+                if obj._nft:
+                    self.erc721_classes.append(schema.wrap(obj))
+                elif obj._is_ladder:
+                    self.data_classes.append(schema.wrap(obj))
+                elif issubclass(obj, BaseData):
+                    self.data_classes.append(schema.wrap(obj))
+                elif issubclass(obj, _BaseModel):
+                    self.process_poly_cls(obj)
+                #
+                self.emit_tasks.append((obj, mod))
+        # dependencies are emitted before the classes that reference them
+        rank = {cls: i for i, cls in enumerate(schema.order)}
+        self.emit_tasks.sort(key=lambda task: rank[task[0]])
+
+    def process_poly_cls(self, cls):
+        for p_cls in cls.__mro__:
+            if not issubclass(p_cls, _BaseModel):
+                break
+            if p_cls._struct and p_cls != cls:
+                self.poly_structs[p_cls].append(cls)
+                self.poly_bases[cls] = p_cls
+
+
+class Schema(object):
+    def __init__(self, modules):
+        self._models = {}
+        for _mod in modules:
+            self._models[_mod] = [
+                obj for (name, obj) in
+                inspect.getmembers(importlib.import_module(_mod))
+                if inspect.isclass(obj) and issubclass(obj, _BaseModel) and obj.__module__ == _mod and obj is not _BaseModel
+            ]
+        #
+        self._wrapped = {}
+        self._names = {}
+        self._data_deps = {}
+        self._model_deps = {}
+        self._all_deps = {}
+        self._data_refs = {}
+        self._type_cache = {}
+        self._analysis = None
+        #
+        self._order = []
+        for objs in self._models.values():
+            for obj in objs:
+                for dep in self.get_all_deps(obj):
+                    if dep not in self._order:
+                        self._order.append(dep)
+
+    @property
+    def models(self):
+        return self._models
+
+    @property
+    def order(self):
+        return self._order
+
+    @property
+    def type_cache(self):
+        return self._type_cache
+
+    @property
+    def analysis(self):
+        if self._analysis is None:
+            self._analysis = ModelAnalysis(self)
+        return self._analysis
+
+    def wrap(self, cls):
+        if isinstance(cls, Wrapped):
+            return cls
+        wrp_cls = self._wrapped.get(cls)
+        if wrp_cls is None:
+            wrp_cls = self._wrapped[cls] = Wrapped(cls, self)
+        return wrp_cls
+
+    def get_entity_name(self, cls):
+        key = ('entity', cls)
+        if key not in self._names:
+            cls_name_us = inflection.underscore(cls.__name__).split('_')
+            self._names[key] = inflection.camelize('_'.join(cls_name_us[:-1]))
+        return self._names[key]
+
+    def get_class_name_us(self, cls):
+        key = ('us', cls)
+        if key not in self._names:
+            self._names[key] = inflection.underscore(cls.__name__)
+        return self._names[key]
+
+    @staticmethod
+    def is_model_class(cls, base=_BaseModel):
+        return isinstance(cls, type) and issubclass(cls, base)
+
+    def get_model_data_deps(self, cls):
+        deps = self._data_deps.get(cls)
+        if deps is None:
+            deps = []
+            for fname, fdef in cls.__fields__.items():
+                ftype = fdef.outer_type_
+                if typing.get_origin(ftype) == DataRef:
+                    dep = self.wrap(typing.get_args(ftype)[0])
+                    if dep not in deps:
+                        deps.append(dep)
+            deps = self._data_deps[cls] = tuple(deps)
+        return deps
+
+    def get_data_refs(self, cls):
+        refs = self._data_refs.get(cls)
+        if refs is None:
+            refs = []
+            for dep in self.get_all_deps(cls):
+                for fname, fdef in dep.__fields__.items():
+                    ftype = fdef.outer_type_
+                    while typing.get_origin(ftype) is list:
+                        ftype = typing.get_args(ftype)[0]
+                    if typing.get_origin(ftype) == DataRef and typing.get_args(ftype)[0] not in refs:
+                        refs.append(typing.get_args(ftype)[0])
+            refs = self._data_refs[cls] = tuple(refs)
+        return refs
+
+    def get_all_model_deps(self, cls):
+        deps = self._model_deps.get(cls)
+        if deps is None:
+            deps = self._model_deps[cls] = tuple(
+                self.wrap(dep) for dep in self.get_all_deps(cls) if self.is_model_class(dep, DataModel))
+        return deps
+
+    def get_all_deps(self, cls):
+        deps = self._all_deps.get(cls)
+        if deps is None:
+            deps = []
+            self._walk_deps(cls, deps, [])
+            deps = self._all_deps[cls] = tuple(deps)
+        return deps
+
+    def _walk_deps(self, cls, deps, path):
+        t_origin = typing.get_origin(cls)
+        if t_origin:
+            if t_origin is list:
+                self._walk_deps(typing.get_args(cls)[0], deps, path)
+        elif self.is_model_class(cls):
+            if cls in path:
+                cycle = ' -> '.join(c.__name__ for c in path[path.index(cls):] + [cls])
+                raise SchemaError(f"Cyclic model dependency: {cycle}")
+            if cls in deps:
+                return
+            path.append(cls)
+            for fname, fdef in cls.__fields__.items():
+                self._walk_deps(fdef.outer_type_, deps, path)
+            path.pop()
+            deps.append(cls)
+
+    def deref_data_ref(self, ftype):
+        t_origin = typing.get_origin(ftype)
+        assert (t_origin == DataRef)
+        return typing.get_args(ftype)[0]
+
+    def get_ladder_type_for_model(self, cls):
+        if isinstance(cls, Wrapped):
+            cls = cls._cls
+        assert 'ladder' in cls.__fields__
+        data_ftype = cls.__fields__['ladder'].outer_type_
+        return self.deref_data_ref(data_ftype)
+
+    def get_ladder_level_type(self, cls):
+        if isinstance(cls, Wrapped):
+            cls = cls._cls
+        assert 'levels' in cls.__fields__
+        levels_type = cls.__fields__['levels'].outer_type_
+        assert typing.get_origin(levels_type) is list
+        return typing.get_args(levels_type)[0]
+
+    def get_data_type_for_model(self, cls):
+        if isinstance(cls, Wrapped):
+            cls = cls._cls
+        assert 'data' in cls.__fields__
+        data_ftype = cls.__fields__['data'].outer_type_
+        return self.deref_data_ref(data_ftype)
@@ -4,11 +4,16 @@ from collections import defaultdict
 import typing
 
 from acrpg.codegen.base import CodeGenBase, _BaseModel, Wrapped
+from acrpg.codegen.registry import register_backend
+from acrpg.codegen.schema import memoized_type
+from acrpg.codegen.writer import CodeWriter
 from acrpg.model.data import DataRef, BaseData
 from acrpg.model.models import UpgradeableWithExp, DataModel
+from acrpg.model.types import *
 from acrpg.utils import *
 
 
+@register_backend('sol')
 class SolCodeGenGo(CodeGenBase):
     def __init__(self, *args, **kwargs):
         super(SolCodeGenGo, self).__init__(*args, **kwargs)
@@ -19,9 +24,13 @@ class SolCodeGenGo(CodeGenBase):
         #
         self._erc1155_instances = BaseData._erc1155_instances
         self._erc1155_ids = {}
+        self._upgrade_mats = {}
+
+    def analyze(self):
+        super().analyze()
+        self._erc1155_ids = {}
         for erc1155_id, erc1155_item in enumerate(self._erc1155_instances):
             self._erc1155_ids[erc1155_item.ref_str()] = erc1155_id
-        self._upgrade_mats = {}
 
     def get_upgrade_material(self, cls_):
         _data_cls = self._upgrade_mats.get(cls_.entity_name)
@@ -48,7 +57,7 @@ class SolCodeGenGo(CodeGenBase):
         return self._arr_id
 
     def make_array_initializers(self):
-        s = ""
+        s = CodeWriter()
         for arr_args in self._arrs_to_init:
             s += self.emit_make_array(*arr_args)
             s += "\n"
@@ -56,20 +65,21 @@ class SolCodeGenGo(CodeGenBase):
         return s
 
     def emit_make_array(self, arr_id, ftype, arr):
-        s = f"""
+        s = CodeWriter(f"""
     function get_array_{arr_id}() internal pure returns ({self.get_soltype(ftype)}[] memory _arr) {{
         _arr = new {self.get_soltype(ftype)}[]({len(arr)});
-"""
+""")
         for jj, arr_el in enumerate(arr):
             s += f"        _arr[{jj}] = {self.get_solval(ftype, arr_el)};\n"
         s += "    }"
         return s
 
+    @memoized_type
     def get_soltype(self, fdef: type, is_param=False):
         #
         t_origin = typing.get_origin(fdef)
         #
-        if fdef == int:
+        if fdef in [int, cs_ulong, cs_long, cs_int, cs_uint]:
             return "uint"
         elif fdef == str:
             ts = "string"
@@ -101,24 +111,24 @@ class SolCodeGenGo(CodeGenBase):
 
     def emit_copy_array_from_data(self, ptype, data_ptype, fname, mtype, dtype):
         dtype = self.deref_data_ref(dtype)
-        mtype = Wrapped(mtype, self)
-        _wrap = Wrapped(dtype, self)
-        s = f"""
+        mtype = self.wrap(mtype)
+        _wrap = self.wrap(dtype)
+        s = CodeWriter(f"""
 uint[] memory {fname} = {data_ptype.var_name}.get_{data_ptype.var_name}_{fname}_by_id({data_ptype.var_name}_id);
 {ptype.var_name}.{fname} = new uint[]({fname}.length);
 for (uint i = 0; i < {fname}.length; i++) {{
     {ptype.var_name}.{fname}[i] = create_{mtype.var_name}({fname}[i]);
 }}
-"""
+""")
         return s
 
     def emit_model_init(self, cls):
         if isinstance(cls, Wrapped):
             cls = cls._cls
         data_type_for_model = self.get_data_type_for_model(cls)
-        _wrap_data_type_for_model = Wrapped(data_type_for_model, self)
-        _wrap = Wrapped(cls, self)
-        s = f"function create_{_wrap.var_name}(uint {_wrap_data_type_for_model.var_name}_id) internal returns (uint _id) {{\n"
+        _wrap_data_type_for_model = self.wrap(data_type_for_model)
+        _wrap = self.wrap(cls)
+        s = CodeWriter(f"function create_{_wrap.var_name}(uint {_wrap_data_type_for_model.var_name}_id) internal returns (uint _id) {{\n")
         s += f"    _id = {_wrap.var_name_plural}.length;\n"
         s += f"    {_wrap.var_name}_t memory {_wrap.var_name};\n"
         for fname, fdef in cls.__fields__.items():
@@ -142,7 +152,7 @@ for (uint i = 0; i < {fname}.length; i++) {{
     def get_solval(self, ftype, val, ident=0):
         t_origin = typing.get_origin(ftype)
         #
-        if ftype == int:
+        if ftype in [int, cs_ulong, cs_long, cs_int, cs_uint]:
             s = str(val)
         elif ftype == str:
             s = f"\"{val}\""
@@ -159,7 +169,7 @@ for (uint i = 0; i < {fname}.length; i++) {{
             else:
                 assert False
         elif issubclass(ftype, _BaseModel):
-            s = f"{self.get_struct_name(ftype)}_t({{\n"
+            s = CodeWriter(f"{self.get_struct_name(ftype)}_t({{\n")
             next_ident = ident + 4
             for fidx, (fname, fval) in enumerate(val):
                 el_type = ftype.__fields__[fname].outer_type_
@@ -169,14 +179,14 @@ for (uint i = 0; i < {fname}.length; i++) {{
             s += ' ' * (next_ident + 4) + "})"
         else:
             s = str(val)
-        return s
+        return str(s)
 
     def emit_struct_def(self, cls):
         if isinstance(cls, Wrapped):
             cls = cls._cls
-        s = f"""
+        s = CodeWriter(f"""
 struct {self.get_struct_name(cls)}_t {{
-"""
+""")
         for fname, fdef in cls.__fields__.items():
             s += f"    {self.get_soltype(fdef.outer_type_)} {self.solize_name(fname)};\n"
         if cls.is_erc1155():
@@ -189,19 +199,20 @@ struct {self.get_struct_name(cls)}_t {{
         entity_name = self.get_entity_name(cls)
         plural_entity_name = inflection.pluralize(entity_name.lower())
 
-        _wrap = Wrapped(cls, self)
+        _wrap = self.wrap(cls)
 
-        data_deps = self.get_model_data_deps(cls)
+        data_deps = list(self.get_model_data_deps(cls))
         model_deps = self.get_all_model_deps(cls)
 
-        model_data_type = Wrapped(self.get_data_type_for_model(cls), self)
+        model_data_type = self.wrap(self.get_data_type_for_model(cls))
         if issubclass(cls, UpgradeableWithExp):
-            ladder_type = Wrapped(self.get_ladder_type_for_model(model_data_type), self)
-            data_deps.add(ladder_type)
+            ladder_type = self.wrap(self.get_ladder_type_for_model(model_data_type))
+            if ladder_type not in data_deps:
+                data_deps.append(ladder_type)
 
         self.emit_model_init(cls)
 
-        s = f"""// contracts/generated/model/{entity_name}.sol
+        s = CodeWriter(f"""// contracts/generated/model/{entity_name}.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
@@ -209,7 +220,7 @@ pragma solidity ^0.8.0;
 import "@openzeppelin/contracts/utils/math/SafeMath.sol";
 
 import "../../XDimERC721.sol";
-"""
+""")
         for dep_cls in data_deps:
             s += f"import \"../data/{dep_cls.entity_name}Data.sol\";\n"
 
@@ -282,13 +293,21 @@ contract {entity_name} is XDimERC721 {{
         cls_name_us = self.get_class_name_us(cls)
         entity_name = self.get_entity_name(cls)
         #
-        assert 'levels' in cls.__fields__
-        levels_type = cls.__fields__['levels'].outer_type_
-        assert typing.get_origin(levels_type) is list
-        level_t = typing.get_args(levels_type)[0]
+        level_t = self.get_ladder_level_type(cls)
         level_t_name = self.get_struct_name(level_t)
+        self.validate_ladder(cls)
+        formulas = [self.get_ladder_formula(cls, data_inst) for data_inst in BaseData.instances(cls)]
+        use_formulas = any(formula is not None for formula in formulas)
+        # identical level tables are stored once, under the first id using them
+        table_refs = {}
+        tables = {}
+        for _id, data_inst in enumerate(BaseData.instances(cls)):
+            if formulas[_id] is None and self._dedup_blobs:
+                table_refs[_id] = tables.setdefault(self.get_ladder_fingerprint(data_inst), _id)
+        use_table_refs = any(_id != ref for _id, ref in table_refs.items())
+        levels_expr = f"_{cls_name_us}_levels[_{cls_name_us}_table(_id)]" if use_table_refs else f"_{cls_name_us}_levels[_id]"
         #
-        s = f"""// contracts/generated/data/{entity_name}.sol
+        s = CodeWriter(f"""// contracts/generated/data/{entity_name}.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
@@ -297,30 +316,98 @@ contract {entity_name}Data {{
 
     mapping (uint => mapping (uint => {level_t_name}_t)) _{cls_name_us}_levels;
     mapping (uint => uint) _{cls_name_us}_max_level;
+""")
+        if use_table_refs:
+            s += f"""    // 1 + id whose identical levels table is stored, 0 for its own table
+    mapping (uint => uint) _{cls_name_us}_table_ref;
+
+    function _{cls_name_us}_table(uint _id) internal view returns (uint) {{
+        uint _ref = _{cls_name_us}_table_ref[_id];
+        return _ref == 0 ? _id : _ref - 1;
+    }}
+"""
+        if use_formulas:
+            s += f"""    // kind 1: (a + b*i + c*i*i) / d, kind 2: a + b * c**i, kind 0: levels table
+    mapping (uint => ladder_formula_t) _{cls_name_us}_formula;
+
+    function _experience(uint _id, uint level) internal view returns (uint) {{
+        ladder_formula_t storage _formula = _{cls_name_us}_formula[_id];
+        if (_formula.kind == 0) {{
+            return {levels_expr}[level].experience;
+        }}
+        int i = int(level);
+        if (_formula.kind == 1) {{
+            return uint((_formula.a + _formula.b * i + _formula.c * i * i) / _formula.d);
+        }}
+        return uint(_formula.a + _formula.b * _formula.c ** level);
+    }}
 
     function get_{level_t_name}(uint _id, uint level) external view returns ({level_t_name}_t memory _{level_t_name}) {{
-        _{level_t_name} = _{cls_name_us}_levels[_id][level];
+        if (_{cls_name_us}_formula[_id].kind == 0) {{
+            _{level_t_name} = {levels_expr}[level];
+        }} else {{
+            _{level_t_name}.experience = _experience(_id, level);
+        }}
+    }}
+"""
+        else:
+            s += f"""
+    function _experience(uint _id, uint level) internal view returns (uint) {{
+        return {levels_expr}[level].experience;
     }}
 
+    function get_{level_t_name}(uint _id, uint level) external view returns ({level_t_name}_t memory _{level_t_name}) {{
+        _{level_t_name} = {levels_expr}[level];
+    }}
+"""
+        s += f"""
     function get_level(uint _id, uint curr_level, uint exp) external view returns (uint _level, uint _exp_left) {{
+        uint _max_level = _{cls_name_us}_max_level[_id];
+        uint _hi = _max_level;
         _level = curr_level;
-        while (exp >= _{cls_name_us}_levels[_id][_level].experience) {{
-            _level += 1;
+        while (_level < _hi) {{
+            uint _mid = (_level + _hi) / 2;
+            if (exp >= _experience(_id, _mid)) {{
+                _level = _mid + 1;
+            }} else {{
+                _hi = _mid;
+            }}
         }}
-        _exp_left = exp - _{cls_name_us}_levels[_id][_level].experience;
+        if (_level >= _max_level) {{
+            return (_max_level - 1, 0);
+        }}
+        _exp_left = _experience(_id, _level) - exp;
     }}
 """
         klasses = self.get_all_deps(level_t)
         for dep_kls in klasses:
             s += apply_ident(self.emit_struct_def(dep_kls), 4)
             s += "\n"
+        if use_formulas:
+            s += """
+    struct ladder_formula_t {
+        uint kind;
+        int a;
+        int b;
+        int c;
+        int d;
+    }
+"""
 
         for _id, data_inst in enumerate(BaseData.instances(cls)):
             s += f"""
     function initialize_{cls_name_us}_{data_inst.id}() public {{
 """
-            for level_id, level_data in enumerate(data_inst.levels):
-                s += f"        _{cls_name_us}_levels[{_id}][{level_id}] = {self.get_solval(level_t, level_data)};\n"
+            formula = formulas[_id]
+            if formula is None and table_refs.get(_id, _id) != _id:
+                s += f"        _{cls_name_us}_table_ref[{_id}] = {table_refs[_id] + 1};\n"
+            elif formula is None:
+                for level_id, level_data in enumerate(data_inst.levels):
+                    s += f"        _{cls_name_us}_levels[{_id}][{level_id}] = {self.get_solval(level_t, level_data)};\n"
+            else:
+                s += f"        // {formula.name}\n"
+                s += f"        _{cls_name_us}_formula[{_id}] = ladder_formula_t({{kind: {formula.kind}, " \
+                     f"a: {formula.a}, b: {formula.b}, c: {formula.c}, d: {formula.d}}});\n"
             s += f"\n        _{cls_name_us}_max_level[{_id}] = {len(data_inst.levels)};\n"
             s += "    }\n"
         s += "}"
@@ -332,7 +419,7 @@ contract {entity_name}Data {{
         entity_name = self.get_entity_name(cls)
         plural_entity_name = inflection.pluralize(entity_name.lower())
         struct_name = self.get_struct_name(cls)
-        s = f"""// contracts/generated/data/{entity_name}Data.sol
+        s = CodeWriter(f"""// contracts/generated/data/{entity_name}Data.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
@@ -341,7 +428,7 @@ contract {entity_name}Data {{
 
     mapping(uint => {struct_name}_t) _{plural_entity_name};
 
-"""
+""")
         klasses = self.get_all_deps(cls)
         for dep_kls in klasses:
             s += apply_ident(self.emit_struct_def(dep_kls), 4)
@@ -394,6 +481,7 @@ contract {entity_name}Data {{
         entity_name = ''
         subpath = ''
         #
+        self._arr_id = 0
         if cls._nft:
             subpath = 'model/'
             s, entity_name = self.emit_code_nft(cls, mod)
@@ -409,18 +497,17 @@ contract {entity_name}Data {{
             return
         assert entity_name
         self._contracts.append(entity_name)
-        with open(Path(self._out_dir).joinpath(f'{subpath}{entity_name}.sol'), 'w') as sol_f:
-            sol_f.write(s)
+        self.write_file(Path(self._out_dir).joinpath(f'{subpath}{entity_name}.sol'), s)
 
     def emit_inventory_contract(self):
-        s = f"""// contracts/generated/Inventory.sol
+        s = CodeWriter(f"""// contracts/generated/Inventory.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
 
 import "@openzeppelin/contracts-upgradeable/token/ERC1155/ERC1155Upgradeable.sol";
 
-"""
+""")
         for erc1155_uid, erc1155_item in enumerate(self._erc1155_instances):
             cls_name_us = self.get_class_name_us(type(erc1155_item))
             s += f"uint constant {cls_name_us.upper()}_{erc1155_item.id.upper()} = {erc1155_uid};\n"
@@ -430,17 +517,16 @@ contract Inventory is ERC1155Upgradeable {{
 }}
 """
 
-        with open(Path(self._out_dir).joinpath('Inventory.sol'), 'w') as sol_f:
-            sol_f.write(s)
+        self.write_file(Path(self._out_dir).joinpath('Inventory.sol'), s)
 
 #
     def emit_data_contract(self):
-        s = f"""// contracts/generated/GameData.sol
+        s = CodeWriter(f"""// contracts/generated/GameData.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
 
-"""
+""")
         num_data_classes = len(self._data_classes)
         for jj, data_cls in enumerate(self._data_classes):
 
@@ -461,11 +547,10 @@ contract GameData {
 """
         s += "}"
 
-        with open(Path(self._out_dir).joinpath('GameData.sol'), 'w') as sol_f:
-            sol_f.write(s)
+        self.write_file(Path(self._out_dir).joinpath('GameData.sol'), s)
 
     def emit_game_logic_base_contract(self):
-        s = f"""// contracts/generated/GameLogicBase.sol
+        s = CodeWriter(f"""// contracts/generated/GameLogicBase.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
@@ -476,7 +561,7 @@ import "@openzeppelin/contracts/utils/math/SafeMath.sol";
 
 import "./Inventory.sol";
 import "./GameData.sol";
-"""
+""")
         for erc721_cls in self._erc721_classes:
             s += f"import \"./model/{erc721_cls.entity_name}.sol\";\n"
 
@@ -528,7 +613,7 @@ contract GameLogicBase is Initializable {{
         for erc721_cls in self._erc721_classes:
             if issubclass(erc721_cls._cls, UpgradeableWithExp):
                 upgrade_mat_cls = self.get_upgrade_material(erc721_cls)
-                _w_upgrade_mat_cls = Wrapped(upgrade_mat_cls, self)
+                _w_upgrade_mat_cls = self.wrap(upgrade_mat_cls)
                 s += f"""
     function _{erc721_cls.var_name}_use_exp_material (address _user, uint {erc721_cls.var_name}_id, uint mat_id, uint amount) internal {{
         {_w_upgrade_mat_cls.entity_name}Data.{_w_upgrade_mat_cls.var_name}_t memory {_w_upgrade_mat_cls.var_name} = gdata.get_{_w_upgrade_mat_cls.var_name}_by_id(mat_id);
@@ -657,8 +742,7 @@ contract GameLogicBase is Initializable {{
         s += "    }\n"
 
         s += "}"
-        with open(Path(self._out_dir).joinpath('GameLogicBase.sol'), 'w') as sol_f:
-            sol_f.write(s)
+        self.write_file(Path(self._out_dir).joinpath('GameLogicBase.sol'), s)
 
     def emit_deser_func(self, tname, bsz):
         return f"""
@@ -693,14 +777,14 @@ function dump_{tname}({tname} _value, bytes memory _data) internal pure {{
 """
 
     def emit_serdes_library(self):
-        s = f"""// contracts/SerDes.sol
+        s = CodeWriter(f"""// contracts/SerDes.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
 
 library SerDes {{
     
-"""
+""")
         for sz in range(8, 264, 8):
             bsz = sz // 8
             s += apply_ident(self.emit_deser_func(f'int{sz}', bsz), 4)
@@ -750,22 +834,21 @@ library SerDes {{
     }}
 """
         s += "}"
-        with open(Path(self._out_dir).joinpath('../SerDes.sol'), 'w') as sol_f:
-            sol_f.write(s)
+        self.write_file(Path(self._out_dir).joinpath('../SerDes.sol'), s)
 
     def emit_visitor(self, p_cls):
         ch_classes = self._poly_structs[p_cls]
-        _wrap_chs = [Wrapped(ch_class, self) for ch_class in ch_classes]
-        _wrap = Wrapped(p_cls, self)
+        _wrap_chs = [self.wrap(ch_class) for ch_class in ch_classes]
+        _wrap = self.wrap(p_cls)
         #
-        s = f"""// contracts/visitors/{_wrap.entity_name}Visitor.sol
+        s = CodeWriter(f"""// contracts/visitors/{_wrap.entity_name}Visitor.sol
 // SPDX-License-Identifier: UNLICENSED
 
 pragma solidity ^0.8.0;
 
 import "../../SerDes.sol";
 
-"""
+""")
         for jj, ch_class in enumerate(_wrap_chs):
             s += f"uint constant {_wrap.entity_name.upper()}_TYPE_{ch_class.var_name.upper()} = {jj};\n"
 
@@ -818,16 +901,18 @@ contract {_wrap.entity_name}Visitor {{
 """
         #
         s += "}"
-        with open(Path(self._out_dir).joinpath('visitors').joinpath(f'{_wrap.entity_name}Visitor.sol'), 'w') as sol_f:
-            sol_f.write(s)
+        self.write_file(Path(self._out_dir).joinpath('visitors').joinpath(f'{_wrap.entity_name}Visitor.sol'), s)
 
     def emit_visitors(self):
         for p_cls in self._poly_structs:
             self.emit_visitor(p_cls)
 
-    def generate(self):
-        super().generate()
-        self.emit_inventory_contract()
+    def emit(self, classes=None):
+        super().emit(classes)
+        if classes is None or any(cls.is_erc1155() for cls in classes):
+            self.emit_inventory_contract()
+        if classes is not None:
+            return
         self.emit_data_contract()
         self.emit_visitors()
         self.emit_game_logic_base_contract()
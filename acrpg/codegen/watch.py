@@ -0,0 +1,91 @@
+import os
+import time
+from pathlib import Path
+
+from acrpg.codegen.driver import GenerationDriver
+from acrpg.model.data import BaseData, GameData
+
+
+class DataWatcher(object):
+    def __init__(self, data_dir, interval=0.5):
+        self._data_dir = Path(data_dir)
+        self._interval = interval
+        self._files = {}
+
+    def scan(self):
+        stamps = {}
+        for root, dirnames, filenames in os.walk(str(self._data_dir)):
+            for filename in filenames:
+                fpath = Path(root).joinpath(Path(filename))
+                if fpath.suffix == '.json':
+                    st = fpath.stat()
+                    stamps[fpath] = (st.st_mtime_ns, st.st_size)
+        return stamps
+
+    def load(self):
+        for fpath, stamp in self.scan().items():
+            self._files[fpath] = (stamp, GameData.parse_file(fpath))
+        return self.game_data()
+
+    def game_data(self):
+        gd = GameData()
+        for stamp, file_gd in self._files.values():
+            gd.merge(file_gd)
+        return gd
+
+    def poll(self, driver: GenerationDriver):
+        stamps = self.scan()
+        changed = [fpath for fpath, stamp in stamps.items()
+                   if fpath not in self._files or self._files[fpath][0] != stamp]
+        removed = [fpath for fpath in self._files if fpath not in stamps]
+        if not changed and not removed:
+            return None
+        #
+        classes = set()
+        for fpath in changed + removed:
+            if fpath in self._files:
+                classes.update(type(inst) for inst in self._files[fpath][1].instances())
+        files = {}
+        for fpath, stamp in stamps.items():
+            if fpath not in changed:
+                files[fpath] = self._files[fpath]
+                continue
+            try:
+                file_gd = GameData.parse_file(fpath)
+            except (ValueError, TypeError) as e:
+                print(f"{fpath}: {e}")
+                file_gd = self._files[fpath][1] if fpath in self._files else GameData()
+            files[fpath] = (stamp, file_gd)
+            classes.update(type(inst) for inst in file_gd.instances())
+        self._files = files
+        # ids are positional, so rebuild the registries in load order
+        BaseData.reset_registry()
+        for stamp, file_gd in self._files.values():
+            for inst in file_gd.instances():
+                inst.register()
+        driver.set_game_data(self.game_data())
+        return driver.generate(self.affected_classes(driver.schema, classes))
+
+    def affected_classes(self, schema, classes):
+        affected = set(classes)
+        data_classes = [wrp_cls._cls for wrp_cls in schema.analysis.data_classes]
+        while True:
+            dependents = {cls for cls in data_classes
+                          if cls not in affected and affected.intersection(schema.get_data_refs(cls))}
+            if not dependents:
+                return affected
+            affected.update(dependents)
+
+    def run(self, driver: GenerationDriver):
+        try:
+            while True:
+                start = time.perf_counter()
+                stats = self.poll(driver)
+                if stats is not None:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    for name, backend_stats in stats.items():
+                        print(f"{name}: {backend_stats['written']} files written, "
+                              f"{backend_stats['skipped']} unchanged in {elapsed:.0f} ms")
+                time.sleep(self._interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,52 @@
+import contextlib
+
+
+class CodeWriter(object):
+    def __init__(self, s='', ident=0):
+        self._chunks = []
+        self._len = 0
+        self._ident = ident
+        if s:
+            self.write(s)
+
+    def write(self, s):
+        if isinstance(s, CodeWriter):
+            self._chunks.extend(s._chunks)
+            self._len += s._len
+        elif s:
+            self._chunks.append(s)
+            self._len += len(s)
+        return self
+
+    def __iadd__(self, s):
+        return self.write(s)
+
+    def line(self, s=''):
+        if s:
+            return self.write(' ' * self._ident + s + '\n')
+        return self.write('\n')
+
+    @contextlib.contextmanager
+    def ident(self, n=4):
+        self._ident += n
+        try:
+            yield self
+        finally:
+            self._ident -= n
+
+    def __len__(self):
+        return self._len
+
+    def getvalue(self):
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if self._chunks else ''
+
+    def write_to(self, f):
+        f.writelines(self._chunks)
+
+    def __str__(self):
+        return self.getvalue()
+
+    def __format__(self, format_spec):
+        return format(self.getvalue(), format_spec)
@@ -11,7 +11,9 @@ class _BaseModelMeta(type(BaseModel)):
         '_upgrade_material',
         '_upgrade_target',
         '_is_ladder',
-        '_struct'
+        '_struct',
+        '_indexes',
+        '_inventory_order'
     )
 
     def __new__(mcs, cls_name, bases, namespace):
@@ -21,6 +21,9 @@ class BaseData(_BaseModel):
 
     def __init__(self, **data):
         super().__init__(**data)
+        self.register()
+
+    def register(self):
         ref_str = self.ref_str()
         BaseData._registry[ref_str] = self
         #
@@ -49,6 +52,14 @@ class BaseData(_BaseModel):
         #assert value.isalnum(), 'must be alphanumeric'
         return value
 
+    @staticmethod
+    def reset_registry():
+        BaseData._registry.clear()
+        BaseData._instances.clear()
+        BaseData._ids.clear()
+        BaseData._erc1155_instances.clear()
+        BaseData._erc721_instances.clear()
+
     @staticmethod
     def data_classes():
         return BaseData._instances.keys()
@@ -96,8 +107,30 @@ class DataRef(typing.Generic[ReferencedType]):
         return f"'{self.data_type}/{self.id}'"
 
 
+class Condition(str):
+    # expression source, bound against the model schema while the data is validated
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate_condition
+
+    @classmethod
+    def validate_condition(cls, v):
+        if not isinstance(v, str):
+            raise TypeError("Condition should be string")
+        # the binder imports the model classes, which import this module
+        from acrpg.model.expr_binder import ExprTypeError, bind_expr
+        cond = cls(v)
+        try:
+            cond.expr = bind_expr(v)
+        except ExprTypeError as e:
+            raise ValueError(str(e))
+        return cond
+
+
 class CurrencyData(BaseData):
     _tokenized = True
+    _inventory_order = 1
 
     name: str
     ticker: str
@@ -205,6 +238,7 @@ class ExpeditionData(BaseData):
 
 class HeroUpgradeMaterialData(BaseData):
     _upgrade_material = True
+    _inventory_order = 2
     _upgrade_target = 'Hero'
 
     type: str = Field("hero_upgrade_material", const=True)
@@ -215,6 +249,7 @@ class HeroUpgradeMaterialData(BaseData):
 
 class WeaponUpgradeMaterialData(BaseData):
     _upgrade_material = True
+    _inventory_order = 3
     _upgrade_target = 'Weapon'
 
     type: str = Field("weapon_upgrade_material", const=True)
@@ -225,6 +260,7 @@ class WeaponUpgradeMaterialData(BaseData):
 
 class ArtifactUpgradeMaterialData(BaseData):
     _upgrade_material = True
+    _inventory_order = 4
     _upgrade_target = 'Artifact'
 
     type: str = Field("artifact_upgrade_material", const=True)
@@ -233,6 +269,16 @@ class ArtifactUpgradeMaterialData(BaseData):
     description: str
 
 
+class CostData(_BaseModel):
+    # only validated here, the C# Cost structs are emitted from the nft models
+    _abstract = True
+
+    hero: typing.Optional[DataRef[HeroData]]
+    weapon: typing.Optional[DataRef[WeaponData]]
+    artifact: typing.Optional[DataRef[ArtifactData]]
+    conditions: typing.List[Condition] = []
+
+
 class GameData(_BaseModel):
     upgrade_materials: typing.Optional[typing.List[
         typing.Union[HeroUpgradeMaterialData,
@@ -255,6 +301,7 @@ class GameData(_BaseModel):
     achievements: typing.Optional[typing.List[AchievementData]] = []
     expeditions: typing.Optional[typing.List[ExpeditionData]] = []
     skills: typing.Optional[typing.List[SkillData]] = []
+    costs: typing.Optional[typing.List[CostData]] = []
 
     def resolve_refs(self):
         pass
@@ -263,3 +310,10 @@ class GameData(_BaseModel):
         for key, value in self:
             if isinstance(value, typing.List):
                 value.extend(getattr(other, key))
+
+    def instances(self):
+        for key, value in self:
+            if isinstance(value, typing.List):
+                for inst in value:
+                    if isinstance(inst, BaseData):
+                        yield inst
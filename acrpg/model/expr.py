@@ -30,6 +30,24 @@ class BoolConstExpr(ConstExpr):
         super(BoolConstExpr, self).__init__(*args)
 
 
+class UnaryOpExpr(Expr):
+    def __init__(self, a):
+        super(UnaryOpExpr, self).__init__()
+        self.a = a
+
+
+class NegExpr(UnaryOpExpr):
+    pass
+
+
+class NotExpr(UnaryOpExpr):
+    pass
+
+
+class InvertExpr(UnaryOpExpr):
+    pass
+
+
 class BinOpExpr(Expr):
     def __init__(self, *args):
         super(Expr, self).__init__()
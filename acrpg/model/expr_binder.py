@@ -0,0 +1,214 @@
+import inflection
+import operator
+import pyparsing as pp
+import typing
+
+from acrpg.model.base import _BaseModel
+from acrpg.model.data import BaseData, DataRef
+from acrpg.model.expr import *
+from acrpg.model.expr_parser import exp
+from acrpg.model.models import DataModel, UserModel
+from acrpg.model.types import *
+
+
+class ExprTypeError(Exception):
+    pass
+
+
+class SlotRefExpr(RefExpr):
+    def __init__(self, name, root, slots, type_):
+        super(SlotRefExpr, self).__init__(name)
+        self.root = root
+        self.slots = slots
+        self.type = type_
+
+
+_INT_TYPES = (int, cs_ulong, cs_long, cs_uint, cs_int)
+
+_ARITH_OPS = {
+    AddExpr: operator.add,
+    SubExpr: operator.sub,
+    MulExpr: operator.mul,
+    DivExpr: operator.floordiv,
+    OrExpr: operator.or_,
+    XorExpr: operator.xor,
+    AndExpr: operator.and_,
+    LSRExpr: operator.rshift,
+    LSLExpr: operator.lshift,
+}
+
+_CMP_OPS = {
+    LTExpr: operator.lt,
+    GTExpr: operator.gt,
+    LTEExpr: operator.le,
+    GTEExpr: operator.ge,
+}
+
+_EQ_OPS = {
+    EQExpr: operator.eq,
+    NEExpr: operator.ne,
+}
+
+_UNARY_OPS = {
+    NegExpr: (operator.neg, int),
+    InvertExpr: (operator.invert, int),
+    NotExpr: (operator.not_, bool),
+}
+
+_LOGICAL_OPS = {
+    LogicalAndExpr: lambda a, b: a and b,
+    LogicalOrExpr: lambda a, b: a or b,
+}
+
+
+def type_kind(ftype):
+    if ftype in _INT_TYPES:
+        return int
+    elif ftype in (str, bool):
+        return ftype
+    elif typing.get_origin(ftype) == DataRef:
+        return DataRef
+    return ftype
+
+
+def default_scope():
+    scope = {}
+    classes = [DataModel, UserModel]
+    while classes:
+        cls = classes.pop(0)
+        classes.extend(cls.__subclasses__())
+        if cls._abstract:
+            continue
+        name = inflection.underscore(cls.__name__).split('_')
+        scope['_'.join(name[:-1])] = cls
+    return scope
+
+
+class ExprBinder(object):
+
+    def __init__(self, scope: typing.Dict[str, type]):
+        self._roots = list(scope.keys())
+        self._scope = scope
+        self._slots = {}
+
+    @property
+    def roots(self):
+        return self._roots
+
+    def field_slots(self, cls):
+        slots = self._slots.get(cls)
+        if slots is None:
+            slots = {fname: (idx, fdef.outer_type_) for idx, (fname, fdef) in enumerate(cls.__fields__.items())}
+            self._slots[cls] = slots
+        return slots
+
+    def resolve(self, name):
+        root_name, *path = name.split('.')
+        if root_name not in self._scope:
+            raise ExprTypeError(f"Unknown name '{root_name}' in '{name}'")
+        ftype = self._scope[root_name]
+        slots = []
+        for fname in path:
+            if not (isinstance(ftype, type) and issubclass(ftype, _BaseModel)):
+                raise ExprTypeError(f"'{name}': {ftype} has no field '{fname}'")
+            field_slots = self.field_slots(ftype)
+            if fname not in field_slots:
+                raise ExprTypeError(f"'{name}': {ftype.__name__} has no field '{fname}'")
+            slot, ftype = field_slots[fname]
+            slots.append(slot)
+        return SlotRefExpr(name, self._roots.index(root_name), tuple(slots), type_kind(ftype))
+
+    def bind(self, expr):
+        return self._bind(expr)[0]
+
+    def _bind(self, expr):
+        if isinstance(expr, RefExpr):
+            bound = self.resolve(expr.name)
+            return bound, bound.type
+        elif isinstance(expr, BoolConstExpr):
+            return expr, bool
+        elif isinstance(expr, IntConstExpr):
+            return expr, int
+        elif isinstance(expr, StrConstExpr):
+            return expr, str
+        elif isinstance(expr, UnaryOpExpr):
+            a, a_type = self._bind(expr.a)
+            op, expected = _UNARY_OPS[type(expr)]
+            if a_type is not expected:
+                raise ExprTypeError(
+                    f"{type(expr).__name__}: operand {getattr(a_type, '__name__', a_type)}, expected {expected.__name__}")
+            if isinstance(a, ConstExpr):
+                # negative literals parse as a negated constant, fold them back
+                return type(a)(op(a.val)), expected
+            return type(expr)(a), expected
+        elif isinstance(expr, BinOpExpr):
+            a, a_type = self._bind(expr.a)
+            b, b_type = self._bind(expr.b)
+            op_cls = type(expr)
+            if op_cls in _ARITH_OPS:
+                self._check(expr, a_type, b_type, int)
+                return op_cls(a, b), int
+            elif op_cls in _CMP_OPS:
+                self._check(expr, a_type, b_type, int)
+                return op_cls(a, b), bool
+            elif op_cls in _EQ_OPS:
+                # data refs are positional ids, so they compare with ints
+                if {a_type, b_type} == {DataRef, int}:
+                    return op_cls(a, b), bool
+                self._check(expr, a_type, b_type, a_type)
+                return op_cls(a, b), bool
+            elif op_cls in _LOGICAL_OPS:
+                self._check(expr, a_type, b_type, bool)
+                return op_cls(a, b), bool
+        raise ExprTypeError(f"Unsupported expression {type(expr).__name__}")
+
+    def _check(self, expr, a_type, b_type, expected):
+        if a_type is not expected or b_type is not expected:
+            raise ExprTypeError(
+                f"{type(expr).__name__}: operands {getattr(a_type, '__name__', a_type)} and "
+                f"{getattr(b_type, '__name__', b_type)}, expected {getattr(expected, '__name__', expected)}")
+
+
+def as_row(model):
+    if isinstance(model, _BaseModel):
+        return tuple(as_row(val) for _, val in model)
+    elif isinstance(model, list):
+        return [as_row(val) for val in model]
+    elif isinstance(model, DataRef):
+        return BaseData._registry[model.ref_str()].get_id()
+    return model
+
+
+class ExprEvaluator(object):
+
+    def __init__(self, expr):
+        self._expr = expr
+
+    def eval(self, env):
+        return self._eval(self._expr, env)
+
+    def _eval(self, expr, env):
+        if isinstance(expr, SlotRefExpr):
+            val = env[expr.root]
+            for slot in expr.slots:
+                val = val[slot]
+            return val
+        elif isinstance(expr, ConstExpr):
+            return expr.val
+        op_cls = type(expr)
+        if op_cls in _UNARY_OPS:
+            return _UNARY_OPS[op_cls][0](self._eval(expr.a, env))
+        if op_cls in _LOGICAL_OPS:
+            return _LOGICAL_OPS[op_cls](self._eval(expr.a, env), self._eval(expr.b, env))
+        op = _ARITH_OPS.get(op_cls) or _CMP_OPS.get(op_cls) or _EQ_OPS[op_cls]
+        return op(self._eval(expr.a, env), self._eval(expr.b, env))
+
+
+def bind_expr(src, scope=None):
+    try:
+        parsed = exp.parseString(src, parseAll=True)[0]
+    except pp.ParseException as e:
+        raise ExprTypeError(f"Invalid expression '{src}' at char {e.loc}")
+    if hasattr(parsed, 'eval') and not isinstance(parsed, Expr):
+        parsed = parsed.eval()
+    return ExprBinder(scope or default_scope()).bind(parsed)
@@ -42,8 +42,18 @@ class FCallBuilder(object):
 
 
 class NegOpBuilder(OpBuilder):
+    _ops = {
+        "-": NegExpr,
+        "!": NotExpr,
+        "~": InvertExpr,
+    }
+
     def eval(self):
-        pass
+        # right associative, the innermost operator applies first
+        val = self._eval(self.value[-1])
+        for op in reversed(self.value[:-1]):
+            val = type(self)._ops[op](val)
+        return val
 
 
 class LogicalAndOpBuilder(OpBuilder):
@@ -168,7 +178,7 @@ exp_atom = (
 exp <<= pp.infixNotation(
     exp_atom,
     [
-        (pp.oneOf("! - ~"), 1, pp.opAssoc.RIGHT),
+        (pp.oneOf("! - ~"), 1, pp.opAssoc.RIGHT, NegOpBuilder),
         (pp.oneOf("* /"), 2, pp.opAssoc.LEFT, MulOpBuilder),
         (pp.oneOf("+ -"), 2, pp.opAssoc.LEFT, AddSubOpBuilder),
         (pp.oneOf("<< >>"), 2, pp.opAssoc.LEFT, ShiftOpBuilder),
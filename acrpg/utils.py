@@ -1,4 +1,4 @@
 def apply_ident(s, n):
-    lines = s.split('\n')
+    lines = str(s).split('\n')
     ident = ' ' * n
     return '\n'.join([ident + line for line in lines]) + '\n'
@@ -0,0 +1,55 @@
+import argparse
+import time
+from pathlib import Path
+
+from acrpg.codegen.csharp import CodeGenCSharp
+from acrpg.codegen.sol import SolCodeGenGo
+from acrpg.model.data import BaseData, GameData, HeroLadderData, HeroData, AchievementData
+
+
+def make_instances(num_instances, num_levels):
+    for cls in [HeroLadderData, HeroData, AchievementData]:
+        BaseData._instances[cls].clear()
+        BaseData._ids[cls].clear()
+    for i in range(num_instances):
+        HeroLadderData(id=f"ladder_{i}", levels=[dict(experience=j * 100) for j in range(num_levels)])
+        HeroData(id=f"hero_{i}", name=f"hero_{i}", description="xxx", ladder=f"hero_ladder_data/ladder_{i}",
+                 affinity="affinity_data/fire", klass="hero_class_data/tank", slots=[], skills=[],
+                 quality="quality_data/common")
+        AchievementData(id=f"achievement_{i}", name=f"achievement_{i}", description="xxx")
+
+
+def bench(cgen, fn, *args):
+    start = time.perf_counter()
+    outputs = cgen.collect_outputs(fn, *args)
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(len(s) for _, s, _ in outputs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument("--levels", type=int, default=10)
+    args = parser.parse_args()
+
+    out_dir = Path('bench_generated')
+    csharp_gen = CodeGenCSharp('Bench', out_dir, GameData(),
+                               server_out_dir=out_dir, console_app_out_dir=out_dir)
+    sol_gen = SolCodeGenGo('Bench', out_dir, GameData())
+    cases = [
+        ('cs HeroData', csharp_gen, csharp_gen.emit_code, HeroData, None),
+        ('cs HeroLadderData', csharp_gen, csharp_gen.emit_code, HeroLadderData, None),
+        ('sol AchievementData', sol_gen, sol_gen.emit_code, AchievementData, None),
+    ]
+    print(f"{'case':<28}{'instances':>10}{'bytes':>14}{'seconds':>10}{'ns/byte':>10}")
+    for size in args.sizes:
+        make_instances(size, args.levels)
+        csharp_gen.analyze()
+        sol_gen.analyze()
+        for name, cgen, fn, *fn_args in cases:
+            elapsed, nbytes = bench(cgen, fn, *fn_args)
+            print(f"{name:<28}{size:>10}{nbytes:>14}{elapsed:>10.3f}{elapsed * 1e9 / max(nbytes, 1):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,9 @@ import argparse
 import os
 from pathlib import Path
 
-from acrpg.codegen.csharp import CodeGenCSharp
-from acrpg.codegen.sol import SolCodeGenGo
+from acrpg.codegen.driver import GenerationDriver
+from acrpg.codegen.registry import backend_names
+from acrpg.codegen.watch import DataWatcher
 from acrpg.model.data import GameData
 
 
@@ -11,9 +12,9 @@ ROOT_DIR = Path(__file__).parent.resolve()
 DATA_DIR = ROOT_DIR.joinpath('data')
 
 
-def load_all_data():
+def load_all_data(data_dir=DATA_DIR):
     gd = GameData()
-    for root, dirnames, filenames in os.walk(str(DATA_DIR)):
+    for root, dirnames, filenames in os.walk(str(data_dir)):
         for filename in filenames:
             fpath = Path(root).joinpath(Path(filename))
             if fpath.suffix == '.json':
@@ -21,25 +22,62 @@ def load_all_data():
     return gd
 
 
+def print_report(files):
+    print(f"    {'bytes':>12}{'statements':>12}  path")
+    for p, size, statements in sorted(files, key=lambda f: f[1], reverse=True):
+        print(f"    {size:>12}{statements if statements is not None else '-':>12}  {p}")
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--project-name", type=str, default='AlienCell')
+    parser.add_argument("--data-dir", type=str, default=str(DATA_DIR))
     parser.add_argument("--out-dir", type=str, default=str(ROOT_DIR.joinpath("generated")))
     parser.add_argument("--server-out-dir", type=str, default=ROOT_DIR.joinpath("gen_server"))
     parser.add_argument("--console-app-out-dir", type=str, default=ROOT_DIR.joinpath("gen_console_app"))
+    parser.add_argument("--data-format", type=str, default='code', choices=['code', 'binary'])
+    parser.add_argument("--init-chunk-size", type=int, default=1000)
+    parser.add_argument("--ladder-tables", action='store_true')
+    parser.add_argument("--no-dedup", action='store_true')
+    parser.add_argument("--schema-snapshot", type=str, default=ROOT_DIR.joinpath("schema").joinpath("schema.json"))
+    parser.add_argument("--sol-out-dir", type=str, default=ROOT_DIR.joinpath("contracts/generated"))
+    parser.add_argument("--backends", type=str, nargs='+', default=['csharp'], choices=backend_names())
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--watch", action='store_true')
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--report", action='store_true')
     args = parser.parse_args()
 
-    gen_dir = Path(args.out_dir)
-    #sol_path = ROOT_DIR.joinpath("contracts/generated")
+    backend_args = {
+        'csharp': (Path(args.out_dir), dict(server_out_dir=Path(args.server_out_dir),
+                                            console_app_out_dir=Path(args.console_app_out_dir),
+                                            data_format=args.data_format,
+                                            schema_snapshot=Path(args.schema_snapshot),
+                                            init_chunk_size=args.init_chunk_size,
+                                            ladder_formulas=not args.ladder_tables,
+                                            dedup_blobs=not args.no_dedup)),
+        'sol': (Path(args.sol_out_dir), dict(ladder_formulas=not args.ladder_tables,
+                                             dedup_blobs=not args.no_dedup)),
+    }
+    #
+    watcher = None
+    if args.watch:
+        watcher = DataWatcher(args.data_dir, interval=args.poll_interval)
+        game_data = watcher.load()
+    else:
+        game_data = load_all_data(args.data_dir)
+    driver = GenerationDriver(game_data, jobs=args.jobs)
+    for name in args.backends:
+        out_dir, kwargs = backend_args.get(name, (ROOT_DIR.joinpath(name), dict()))
+        driver.add_backend(name, args.project_name, out_dir, **kwargs)
     #
-    game_data = load_all_data()
-    csharp_gen = CodeGenCSharp(args.project_name, gen_dir, game_data,
-                               server_out_dir=Path(args.server_out_dir),
-                               console_app_out_dir=Path(args.console_app_out_dir))
-    #sol_gen = SolCodeGenGo('AlienCell', sol_path, game_data)
+    for name, stats in driver.generate().items():
+        print(f"{name}: {stats['written']} files written, {stats['skipped']} unchanged, {stats['deleted']} deleted")
+        if args.report:
+            print_report(stats['files'])
     #
-    csharp_gen.generate()
-    #sol_gen.generate()
+    if watcher:
+        watcher.run(driver)
 
 
 if __name__ == '__main__':
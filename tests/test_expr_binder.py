@@ -0,0 +1,32 @@
+import pydantic
+import pytest
+
+from acrpg.model.data import GameData
+from acrpg.model.expr_binder import ExprEvaluator, ExprTypeError, bind_expr
+
+
+def test_conditions_bound_on_load():
+    game_data = GameData.parse_obj(dict(costs=[dict(conditions=["hero.level > -1"])]))
+    cond = game_data.costs[0].conditions[0]
+    assert ExprEvaluator(cond.expr).eval([(0, 0, 0)] * 5) is True
+
+
+def test_str_int_comparison_rejected_on_load():
+    with pytest.raises(pydantic.ValidationError, match="expected int"):
+        GameData.parse_obj(dict(costs=[dict(conditions=['hero.level == "40"'])]))
+
+
+@pytest.mark.parametrize("src,level,res", [
+    ("-1 < hero.level", 0, True),
+    ("-hero.level < -2", 3, True),
+    ("!(hero.level > 3)", 5, False),
+    ("~hero.level == -6", 5, True),
+])
+def test_unary_ops(src, level, res):
+    env = [(0, level, 0)] * 5
+    assert ExprEvaluator(bind_expr(src)).eval(env) is res
+
+
+def test_unary_type_error():
+    with pytest.raises(ExprTypeError):
+        bind_expr("-true")
@@ -0,0 +1,52 @@
+import inflection
+import typing
+
+from acrpg.codegen import msgpack
+from acrpg.codegen.csharp import CodeGenCSharp
+from acrpg.model.base import _BaseModel
+from acrpg.model.data import BaseData, DataRef, GameData, HeroLadderData
+from gen import DATA_DIR, load_all_data
+
+
+def decode(cgen, ftype, val):
+    # reads an int-keyed row back into field names, recursing into nested structs
+    if typing.get_origin(ftype) is list:
+        return [decode(cgen, typing.get_args(ftype)[0], el) for el in val]
+    elif isinstance(ftype, type) and issubclass(ftype, _BaseModel):
+        assert isinstance(val, list), f"{ftype.__name__} packed as {type(val).__name__}"
+        keys = cgen.get_msgpack_keys()[cgen.get_msgpack_contract_name(ftype)]
+        return {fname: decode(cgen, fdef.outer_type_, val[keys[inflection.camelize(fname)]])
+                for fname, fdef in ftype.__fields__.items()}
+    return val
+
+
+def source(ftype, val):
+    if typing.get_origin(ftype) == DataRef:
+        return BaseData._registry[val.ref_str()].get_id()
+    elif typing.get_origin(ftype) is list:
+        return [source(typing.get_args(ftype)[0], el) for el in val]
+    elif isinstance(ftype, type) and issubclass(ftype, _BaseModel):
+        return {fname: source(ftype.__fields__[fname].outer_type_, fval) for fname, fval in val}
+    return val
+
+
+def test_master_memory_round_trip(tmp_path):
+    BaseData.reset_registry()
+    game_data = load_all_data(DATA_DIR)
+    # levels are only written when no formula or shared table replaces them
+    cgen = CodeGenCSharp('Test', tmp_path, game_data, server_out_dir=tmp_path, console_app_out_dir=tmp_path,
+                         data_format='binary', ladder_formulas=False, dedup_blobs=False)
+    cgen.analyze()
+    outputs = {p.name: s for p, s, _ in cgen.collect_outputs(cgen._emit_master_memory_db)}
+    data = outputs['master_memory.bytes']
+    header, start = msgpack.unpack_from(data)
+    assert BaseData.instances(HeroLadderData)[0].levels
+    for wrp_cls in cgen._data_classes:
+        cls = wrp_cls._cls
+        offset, size = header[wrp_cls.var_name]
+        rows = msgpack.unpackb(data[start + offset:start + offset + size])
+        assert len(rows) == len(BaseData.instances(cls))
+        for row, data_inst in zip(rows, BaseData.instances(cls)):
+            expected = source(cls, data_inst)
+            expected['id'] = data_inst.get_id()
+            assert decode(cgen, cls, row) == expected